@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation
+import run
+
+"""
+Batch matching for several courses or sections at once.
+
+Takes a JSON manifest of jobs and runs them all from one process pool, so the interpreter,
+pandas and the matching modules are only loaded once per worker rather than once per course.
+Each job gets its own directory under the output directory, holding its output CSV (or
+whatever its configuration's post-processing writes), a log of everything it printed and a
+report.json with its status, timing and pipeline counters. A job that fails is reported as
+such without affecting any of the others.
+
+The manifest is either a list of jobs or an object with a "jobs" list. Each job needs a
+"config" and a "csv" path (relative paths are resolved against the manifest's directory) and
+may also give a "name" (defaulting to the CSV's file name), "previous", "key", "seed" and
+"restarts", which mean the same as the corresponding run.py options.
+
+Example usage:
+
+python batch.py manifest.json --workers 4 --output-dir batch-out
+"""
+
+# Job options passed through to run.match, along with their defaults.
+JOB_OPTIONS = {"previous": None, "key": "sid", "seed": None, "restarts": None}
+
+
+def load_manifest(manifest_path: str) -> list:
+    """
+    Read a manifest into a list of jobs with absolute paths and unique names.
+
+    Args:
+        manifest_path (str): Path to the JSON manifest
+
+    Returns:
+        list: Job dictionaries with "name", "config", "csv" and every JOB_OPTIONS key
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("jobs", [])
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    jobs, names = [], set()
+    for i, entry in enumerate(manifest):
+        assert (
+            "config" in entry and "csv" in entry
+        ), f"Job {i} in the manifest must specify both a 'config' and a 'csv' path!"
+        job = {**JOB_OPTIONS, **entry}
+        for path_key in ("config", "csv", "previous"):
+            if job[path_key]:
+                job[path_key] = os.path.join(base_dir, job[path_key])
+
+        # Name each job's directory after its CSV unless told otherwise, keeping names unique.
+        name = job.get("name") or os.path.splitext(os.path.basename(job["csv"]))[0]
+        unique_name, k = name, 2
+        while unique_name in names:
+            unique_name = f"{name}-{k}"
+            k += 1
+        names.add(unique_name)
+        job["name"] = unique_name
+        jobs.append(job)
+    return jobs
+
+
+def run_job(job: dict, output_dir: str, debug: bool = False, cache: bool = False):
+    """
+    Run a single matching job in its own directory, capturing its output and never raising.
+
+    Returns:
+        dict: The job's report, which is also written to report.json in its directory
+    """
+    job_dir = os.path.join(output_dir, job["name"])
+    os.makedirs(job_dir, exist_ok=True)
+    parsed_args = argparse.Namespace(
+        config_file=job["config"],
+        csv_file=job["csv"],
+        debug=debug,
+        workers=1,
+        cache=cache,
+        output="out-private.csv",
+        format="csv",
+        index=None,
+        explain=False,
+        validation_report="validation.json",
+        **{key: job[key] for key in JOB_OPTIONS},
+    )
+    report = {"name": job["name"], "config": job["config"], "csv": job["csv"]}
+
+    # Jobs within a worker run one at a time, so changing directory for post-processing code
+    # that writes relative to it is safe as long as it's put back afterwards.
+    cwd = os.getcwd()
+    start_time = time.time()
+    profiler = instrumentation.enable(trace_memory=False)
+    try:
+        os.chdir(job_dir)
+        with open("log.txt", "w") as log, contextlib.redirect_stdout(log):
+            run.match(parsed_args, start_time)
+        report["status"] = "ok"
+    except Exception as e:
+        report["status"] = "failed"
+        report["error"] = f"{type(e).__name__}: {e}"
+        report["traceback"] = traceback.format_exc()
+    finally:
+        instrumentation.disable()
+        os.chdir(cwd)
+    report["seconds"] = time.time() - start_time
+    report["counters"] = profiler.report()["counters"]
+
+    with open(os.path.join(job_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def run_batch(
+    jobs: list,
+    output_dir: str,
+    workers: int = 1,
+    debug: bool = False,
+    cache: bool = False,
+) -> list:
+    """
+    Run every job, concurrently across a pool of worker processes if requested.
+
+    Args:
+        jobs (list): Jobs as returned by load_manifest
+        output_dir (str): Directory to create each job's directory in
+        workers (int, optional): Number of worker processes
+        debug (bool, optional): Whether jobs should log debugging info
+        cache (bool, optional): Whether jobs should reuse cached parses of their CSVs
+
+    Returns:
+        list: Job reports, in manifest order
+    """
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    if workers <= 1:
+        return [run_job(job, output_dir, debug, cache) for job in jobs]
+
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_job, job, output_dir, debug, cache) for job in jobs
+        ]
+        for job, future in zip(jobs, futures):
+            # run_job never raises, but a worker process dying takes its job down with it.
+            try:
+                reports.append(future.result())
+            except Exception as e:
+                reports.append(
+                    {
+                        "name": job["name"],
+                        "config": job["config"],
+                        "csv": job["csv"],
+                        "status": "failed",
+                        "error": f"{type(e).__name__}: {e}",
+                    }
+                )
+    return reports
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "manifest", help="Path to a JSON manifest of (config, csv) matching jobs."
+    )
+    arg_parser.add_argument(
+        "--workers",
+        help="Number of worker processes to run jobs on.",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    arg_parser.add_argument(
+        "--output-dir",
+        help="Directory to write each job's outputs and report to.",
+        default="batch-output",
+    )
+    arg_parser.add_argument(
+        "--debug", help="Turn on debug logging in every job.", action="store_true"
+    )
+    arg_parser.add_argument(
+        "--no-cache",
+        help="Parse every job's CSV from scratch, rather than reusing (or making) cached parses.",
+        action="store_false",
+        dest="cache",
+    )
+    parsed_args = arg_parser.parse_args()
+
+    start_time = time.time()
+    jobs = load_manifest(parsed_args.manifest)
+    print(f"Running {len(jobs)} matching jobs on {parsed_args.workers} workers...")
+    reports = run_batch(
+        jobs,
+        parsed_args.output_dir,
+        workers=parsed_args.workers,
+        debug=parsed_args.debug,
+        cache=parsed_args.cache,
+    )
+    for report in reports:
+        detail = report.get("error") or f"{report['seconds']:.1f}s"
+        print(f"\t{report['name']}: {report['status']} ({detail})")
+
+    summary_path = os.path.join(parsed_args.output_dir, "batch_report.json")
+    with open(summary_path, "w") as f:
+        json.dump(
+            {"seconds": time.time() - start_time, "jobs": reports}, f, indent=2
+        )
+    num_failed = sum(report["status"] != "ok" for report in reports)
+    print(
+        f"{len(reports) - num_failed} of {len(reports)} jobs succeeded; report written to '{summary_path}'."
+    )
+    if num_failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
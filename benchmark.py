@@ -0,0 +1,404 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import config_parser
+import form_parser
+import partitioning
+import existing_groups
+import best_effort
+import instrumentation
+from student_table import StudentTable, table_columns
+
+"""
+Benchmark harness for the full matching pipeline.
+
+Generates synthetic form responses matching the example_config.py ROW_CONFIG schema at the
+requested scales, then times every pipeline stage separately and saves the results as JSON so
+that runs can be compared across commits (see --compare). Every run happens in a fresh process,
+so its peak resident set size ("max_rss_kb") belongs to that run alone rather than to every
+scale run before it; --trace-memory additionally records per-stage tracemalloc peaks.
+
+Example usage:
+
+python benchmark.py --students 1000 10000 100000 --output bench.json
+python benchmark.py --students 1000 10000 100000 --compare bench.json
+"""
+
+HEADERS = [
+    "Timestamp",
+    "Email Address",
+    "SID",
+    "First name",
+    "Last name",
+    "What year are you in?",
+    "Would you like to be part of a course study group?",
+    "Do you have an existing study group of size 2-6 in mind?",
+    "What is your timezone offset?",
+    "What times of the day would you like to meet?",
+    "What days of the week would you like to meet?",
+    "Would you like to attend the same discussion section as your group?",
+    "Which discussion section times work for you?",
+    "2nd Group Member Berkeley Student Email",
+    "3rd Group Member Berkeley Student Email",
+    "4th Group Member Berkeley Student Email",
+    "5th Group Member Berkeley Student Email",
+    "6th Group Member Berkeley Student Email",
+    "Will you be on the Berkeley campus?",
+    "Which of these options best describes your race?",
+    "How do you self-identify?",
+    "Anything else you would like us to know?",
+]
+
+YEARS = ["Freshman", "Sophomore", "Junior", "Senior", "Transfer"]
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+TIMES = ["Morning", "Afternoon", "Evening", "Night"]
+TIMEZONES = ["UTC-7", "UTC-5", "UTC-4", "UTC+1", "UTC+5.5", "UTC+8", "UTC+9"]
+SECTIONS = ["10-11 M/W", "11-12 M/W", "1-2 M/W", "2-3 M/W", "3-4 M/W", "4-5 M/W"]
+RACES = [
+    "White",
+    "Asian",
+    "Hispanic",
+    "Black/African American",
+    "American Indian or Alaska Native",
+    "Native Hawaiian or Other Pacific Islander",
+    "Middle-Eastern",
+    "Multiple races",
+    "Prefer not to answer",
+]
+GENDERS = ["Female", "Male", "Non-binary", "Prefer not to answer"]
+
+# Phases of multi-partitioning, which are nested within the "partitioning" stage.
+PARTITIONING_STAGES = [
+    "build_partition_index",
+    "dfs",
+    "uniquify_assignments",
+    "bottom_up_merge",
+]
+
+# Stages reported on, in pipeline order.
+STAGES = [
+    "parse",
+    "student_table",
+    "handle_existing",
+    "build_partition_index",
+    "dfs",
+    "uniquify_assignments",
+    "bottom_up_merge",
+    "postprocess_partitions",
+    "run_best_effort",
+    "post_processing",
+]
+
+
+def value_names(base: list, count: int) -> list:
+    # Use real answer choices where possible and make up more if asked for a higher cardinality.
+    return base[:count] + [f"{base[0]} {i}" for i in range(len(base), count)]
+
+
+def generate_roster(
+    path: str,
+    num_students: int,
+    num_days: int = len(DAYS),
+    num_times: int = len(TIMES),
+    max_choices: int = 3,
+    existing_rate: float = 0.1,
+    seed: int = 0,
+):
+    """
+    Write a synthetic form response CSV in the example_config.py ROW_CONFIG schema.
+
+    Args:
+        path (str): Where to write the CSV
+        num_students (int): Number of responses
+        num_days (int, optional): Cardinality of the meeting days checkbox column
+        num_times (int, optional): Cardinality of the meeting times checkbox column
+        max_choices (int, optional): Maximum boxes checked per checkbox column
+        existing_rate (float, optional): Fraction of students requesting an existing group
+        seed (int, optional): Random seed
+    """
+    rng = random.Random(seed)
+    days, times = value_names(DAYS, num_days), value_names(TIMES, num_times)
+    emails = [f"student{i}@berkeley.edu" for i in range(num_students)]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        for i in range(num_students):
+            # Students with existing groups list a few neighbours, occasionally with a typo.
+            has_existing = rng.random() < existing_rate
+            partners = [""] * 5
+            if has_existing:
+                block = i - i % 4
+                for k in range(rng.randint(1, 3)):
+                    partner = emails[min(num_students - 1, block + k + 1)]
+                    partners[k] = partner if rng.random() < 0.9 else "typo@berkeley.edu"
+            writer.writerow(
+                [
+                    "2020/08/26 12:00:00 PM PDT",
+                    emails[i],
+                    str(3030000000 + i),
+                    f"First{i}",
+                    f"Last{i}",
+                    rng.choice(YEARS),
+                    "Yes" if rng.random() < 0.95 else "No",
+                    "Yes" if has_existing else "No",
+                    rng.choice(TIMEZONES),
+                    ", ".join(rng.sample(times, rng.randint(1, min(2, max_choices)))),
+                    ", ".join(rng.sample(days, rng.randint(1, max_choices))),
+                    rng.choice(["Yes, I would like to", "No preference"]),
+                    ", ".join(rng.sample(SECTIONS, rng.randint(1, 2))),
+                    *partners,
+                    rng.choice(["Yes", "No"]),
+                    rng.choice(RACES),
+                    rng.choice(GENDERS),
+                    "",
+                ]
+            )
+
+
+def run_pipeline(config, csv_path: str, trace_memory: bool = False) -> dict:
+    profiler = instrumentation.enable(trace_memory=trace_memory)
+
+    with instrumentation.stage("parse"):
+        nodes = form_parser.parse_from_csv(csv_path, config.row_config)
+    num_students = len(nodes)
+    with instrumentation.stage("student_table"):
+        table = StudentTable.from_nodes(nodes, columns=table_columns(config))
+
+    matched = []
+    with instrumentation.stage("handle_existing"):
+        if "Existing" in config.constraints:
+            matched.extend(existing_groups.handle_existing(config, nodes))
+
+    # Multi-partitioning records its own phases as nested stages.
+    with instrumentation.stage("partitioning"):
+        subgroups = partitioning.run_multi_partitioning(config, nodes, table=table)
+    with instrumentation.stage("postprocess_partitions"):
+        if config.postprocess_partitions:
+            subgroups = config.postprocess_partitions(subgroups)
+
+    stats = {}
+    with instrumentation.stage("run_best_effort"):
+        matched.extend(best_effort.run_best_effort(config, subgroups, stats=stats))
+
+    # Post-processing writes its own output files and prints a lot, so run it out of the way.
+    error = None
+    with instrumentation.stage("post_processing"):
+        if config.post_processing:
+            cwd = os.getcwd()
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                os.chdir(tmp_dir)
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        config.post_processing(matched)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                finally:
+                    os.chdir(cwd)
+
+    instrumentation.disable()
+    report = profiler.report()
+    stages = {}
+    for stage in report["stages"]:
+        stages[stage["name"]] = {
+            "seconds": stage["wall_seconds"],
+            "cpu_seconds": stage["cpu_seconds"],
+        }
+        if "peak_traced_bytes" in stage:
+            stages[stage["name"]]["peak_bytes"] = stage["peak_traced_bytes"]
+    return {
+        "students": num_students,
+        "subgroups": len(subgroups),
+        "groups": len(matched),
+        "counters": report["counters"],
+        "best_effort": stats,
+        "post_processing_error": error,
+        "stages": stages,
+    }
+
+
+def measure_run(config_path: str, csv_path: str, trace_memory: bool = False) -> dict:
+    """
+    Run the pipeline once in this (fresh) process, adding the process's peak resident set
+    size to the results.
+    """
+    config = config_parser.import_config(config_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run_pipeline(config, csv_path, trace_memory)
+    result["max_rss_kb"] = instrumentation.max_rss_kb()
+    return result
+
+
+def measure_in_subprocess(
+    config_path: str, csv_path: str, trace_memory: bool = False
+) -> dict:
+    # Spawn (rather than fork) so the run starts from a clean process whose memory use
+    # doesn't include the parent's.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(measure_run, config_path, csv_path, trace_memory).result()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    # Print per-stage timing ratios against a previous results file, matched up by scale.
+    by_students = {run["students"]: run for run in baseline["runs"]}
+    print(f"\nComparison against {baseline.get('commit')} (new / old):")
+    for run in results["runs"]:
+        old = by_students.get(run["students"])
+        if not old:
+            continue
+        print(f"{run['students']} students:")
+        for stage in STAGES:
+            new_s = run["stages"][stage]["seconds"]
+            old_s = old["stages"].get(stage, {}).get("seconds")
+            if old_s:
+                print(
+                    f"\t{stage:>24}: {new_s:8.3f}s vs {old_s:8.3f}s ({new_s / old_s:.2f}x)"
+                )
+
+
+def run():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--students",
+        help="Roster sizes to benchmark.",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+    )
+    arg_parser.add_argument(
+        "--config",
+        help="Matching configuration file (must be compatible with the example_config.py schema).",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "example_config.py"
+        ),
+    )
+    arg_parser.add_argument(
+        "--days",
+        help="Cardinality of the meeting days column.",
+        type=int,
+        default=len(DAYS),
+    )
+    arg_parser.add_argument(
+        "--times",
+        help="Cardinality of the meeting times column.",
+        type=int,
+        default=len(TIMES),
+    )
+    arg_parser.add_argument(
+        "--max-choices",
+        help="Maximum boxes checked per checkbox column.",
+        type=int,
+        default=3,
+    )
+    arg_parser.add_argument(
+        "--existing-rate",
+        help="Fraction of students requesting an existing group.",
+        type=float,
+        default=0.1,
+    )
+    arg_parser.add_argument(
+        "--seed", help="Roster generation seed.", type=int, default=0
+    )
+    arg_parser.add_argument(
+        "--repeat", help="Runs per scale (the fastest is kept).", type=int, default=1
+    )
+    arg_parser.add_argument(
+        "--trace-memory",
+        help="Record per-stage peak memory with tracemalloc (slows every stage down).",
+        action="store_true",
+    )
+    arg_parser.add_argument("--output", help="Path to write JSON results to.")
+    arg_parser.add_argument(
+        "--compare", help="Path to previous JSON results to compare to."
+    )
+    parsed_args = arg_parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            key: value
+            for key, value in vars(parsed_args).items()
+            if key not in ("output", "compare")
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_students in parsed_args.students:
+            csv_path = os.path.join(tmp_dir, f"roster-{num_students}.csv")
+            generate_roster(
+                csv_path,
+                num_students,
+                num_days=parsed_args.days,
+                num_times=parsed_args.times,
+                max_choices=parsed_args.max_choices,
+                existing_rate=parsed_args.existing_rate,
+                seed=parsed_args.seed,
+            )
+            best = None
+            for _ in range(parsed_args.repeat):
+                result = measure_in_subprocess(
+                    parsed_args.config, csv_path, parsed_args.trace_memory
+                )
+                total = sum(
+                    stage["seconds"]
+                    for name, stage in result["stages"].items()
+                    if name not in PARTITIONING_STAGES
+                )
+                if best is None or total < best[0]:
+                    best = (total, result)
+            result = best[1]
+            result["total_seconds"] = best[0]
+            results["runs"].append(result)
+
+            rss = result["max_rss_kb"]
+            print(
+                f"{num_students} students: {best[0]:.3f}s total"
+                + (f", {rss / 1024:.0f} MiB peak RSS" if rss is not None else "")
+            )
+            for stage in STAGES:
+                timing = result["stages"][stage]
+                memory = (
+                    f" (peak {timing['peak_bytes'] / 2 ** 20:.1f} MiB)"
+                    if "peak_bytes" in timing
+                    else ""
+                )
+                print(f"\t{stage:>24}: {timing['seconds']:8.3f}s{memory}")
+            if result["post_processing_error"]:
+                print(f"\tpost_processing failed: {result['post_processing_error']}")
+
+    if parsed_args.output:
+        with open(parsed_args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to '{parsed_args.output}'.")
+    if parsed_args.compare:
+        with open(parsed_args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    run()
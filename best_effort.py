@@ -1,123 +1,478 @@
 from models import *
+from local_search import GroupObjective, local_search, ITERATIONS_PER_NODE
 import random
 
-random.seed(100)
-
 """
 This function is responsible for splitting up subgroups that have *already* been formed
 via multi-partitioning. Uses what is effectively Monte Carlo Tree Search (MCTS) to split
 up nodes of variable size (effectively, approximates a solution to the problem of: given
 variable coin weights and amounts, split into amounts with value constrained by some
 range -- in this case, the range being [config.min_group_size, config.max_group_size].
+
+Whether a subgroup can be split at all, and into which group compositions, only depends on
+the multiset of its node sizes, so that question is answered once per size profile with
+dynamic programming and cached (see split_template). Both splitters fill in those templates:
+the default "sample" splitter with randomly shuffled members, and the "dp" splitter (set with
+CONSTRAINTS["Splitter"]) deterministically. Sampling is only used for profiles too large for
+the DP; profiles the DP proves to have no valid split fail straight away.
+
+If the configuration lists "Best-effort" feature columns and weights, the groups formed within
+each subgroup are then refined with a local search over that weighted objective (see
+local_search.py), tuned with the optional CONSTRAINTS["Search"] dictionary.
+
+Each subgroup can be split by several independently seeded restarts (CONSTRAINTS["Search"]
+"restarts"), which run in parallel alongside every other subgroup's when workers are used. The
+best feasible split is kept: lowest objective first, then the most balanced group sizes. All
+seeds derive from the configured one, so results are reproducible for any worker count.
 """
 
+# Default local search settings, overridable through CONSTRAINTS["Search"]. Local search runs
+# for a fixed number of iterations per node ("iterations"), so results only depend on the
+# seed. The optional
+# time limit is a total wall-clock budget in seconds on top of that, shared between subgroups
+# in proportion to their size and between each subgroup's restarts; it makes results depend on
+# machine load, so it's off by default.
+SEARCH_DEFAULTS = {
+    "iterations": ITERATIONS_PER_NODE,
+    "time_limit": None,
+    "temperature": 1.0,
+    "seed": 100,
+    "restarts": 1,
+}
+
+# Stats describing the chosen split of a subgroup (as opposed to counters summed over restarts).
+SPLIT_STATS = ("initial_score", "final_score", "imbalance")
+
+# Upper bound on the number of DP states (one per sub-multiset of node sizes) before the DP
+# splitter gives up and defers to the sampler.
+DP_MAX_STATES = 250_000
+
+
+def bin_compositions(sizes: list, counts: list, lo: int, hi: int) -> list:
+    """
+    Enumerate every way of filling a single group from the given distinct node sizes such
+    that the group's total size falls in [lo, hi].
+
+    Args:
+        sizes (list): Distinct node sizes
+        counts (list): Number of available nodes of each size (parallel to sizes)
+        lo (int): Minimum group size
+        hi (int): Maximum group size
+
+    Returns:
+        list: Tuples of per-size node counts, ordered by closeness to the middle of the range
+    """
+    out = []
+
+    def helper(k, picked, total):
+        if k == len(sizes):
+            if lo <= total <= hi:
+                out.append(tuple(picked))
+            return
+        num = 0
+        while num <= counts[k] and total + num * sizes[k] <= hi:
+            helper(k + 1, picked + [num], total + num * sizes[k])
+            num += 1
+
+    helper(0, [], 0)
+    mid = (lo + hi) / 2
+    return sorted(
+        out, key=lambda b: abs(sum(n * size for n, size in zip(b, sizes)) - mid)
+    )
+
+
+# Split templates computed so far, keyed on (size profile, lo, hi), most recently used last.
+# Only the most recent MAX_TEMPLATES are kept, so that long-running processes (e.g. the
+# matching server) don't pile them up.
+_TEMPLATES = {}
+MAX_TEMPLATES = 4096
+
+
+def remember_template(key: tuple, template):
+    while len(_TEMPLATES) >= MAX_TEMPLATES:
+        del _TEMPLATES[next(iter(_TEMPLATES))]
+    _TEMPLATES[key] = template
+    return template
 
-def run_best_effort(config: Configuration, subgroups: list) -> list:
-    hi, lo = config.max_group_size, config.min_group_size
 
-    def sample_subgroup_split(nodes, path=[]):
-        # Base case: no nodes left to pick, return our current path.
-        if not nodes:
-            return path
-
-        # Compute how many nodes we have left to pick from and
-        # return failure if we don't have enough.
-        num_left = sum(x.size for x in nodes)
-        if num_left < lo:
-            if num_left and num_left == lo - 1:
-                return path + [nodes]
-            return None
-
-        # If we have exactly enough, we're trivially done.
-        if lo <= num_left <= hi:
+def split_template(profile: tuple, lo: int, hi: int):
+    """
+    Work out (once per size profile and range) whether nodes with the given size profile can
+    be split into groups whose sizes all fall in [lo, hi], and with which group compositions.
+    Uses memoized search over sub-multisets of node sizes, so it is exact and deterministic.
+
+    Args:
+        profile (tuple): Sorted (node size, number of nodes of that size) pairs
+        lo (int): Minimum group size
+        hi (int): Maximum group size
+
+    Returns:
+        tuple: Tuples of per-size node counts, one per group, or None if no valid split exists,
+            or False if the size profile has too many states for the DP to be worthwhile
+    """
+    key = (profile, lo, hi)
+    if key in _TEMPLATES:
+        return remember_template(key, _TEMPLATES.pop(key))
+
+    sizes = [size for size, _ in profile]
+    counts = [count for _, count in profile]
+    num_states = 1
+    for count in counts:
+        num_states *= count + 1
+    if num_states > DP_MAX_STATES:
+        return remember_template(key, False)
+
+    # Search down from the full size profile, trying group compositions closest to the middle
+    # of the range first and remembering which remainders are (in)feasible, so each state is
+    # settled at most once and usually only a handful of states are ever visited.
+    compositions = bin_compositions(sizes, counts, lo, hi)
+    zero, full = tuple(0 for _ in sizes), tuple(counts)
+    choice = {zero: ()}
+    stack = [[full, 0]]
+    while stack:
+        frame = stack[-1]
+        state, k = frame
+        while k < len(compositions):
+            rest = tuple(c - n for c, n in zip(state, compositions[k]))
+            if min(rest) >= 0:
+                if rest not in choice:
+                    # Settle the remainder first, then come back to this composition.
+                    frame[1] = k
+                    stack.append([rest, 0])
+                    break
+                if choice[rest] is not None:
+                    choice[state] = compositions[k]
+                    break
+            k += 1
+        else:
+            choice[state] = None
+        if state in choice:
+            stack.pop()
+
+    # Replay the recorded choices into the list of group compositions.
+    template = None
+    state = full
+    if choice[state] is not None:
+        template = []
+        while any(state):
+            b = choice[state]
+            template.append(b)
+            state = tuple(c - n for c, n in zip(state, b))
+        template = tuple(template)
+    return remember_template(key, template)
+
+
+def dp_subgroup_split(nodes: list, lo: int, hi: int, rng=None):
+    """
+    Split nodes into groups whose sizes all fall in [lo, hi] by filling in the split template
+    for their size profile. Nodes of each size are handed out in order, or in a random order
+    if a random number generator is given.
+
+    Returns:
+        list: A list of groups (lists of nodes), or None if no valid split exists, or False if
+            the size profile has too many states for the DP to be worthwhile
+    """
+    by_size = {}
+    for node in nodes:
+        by_size.setdefault(node.size, []).append(node)
+    sizes = sorted(by_size)
+    template = split_template(
+        tuple((size, len(by_size[size])) for size in sizes), lo, hi
+    )
+    if not template:
+        return template
+
+    # Hand out actual nodes to each group composition.
+    if rng is not None:
+        for size in sizes:
+            rng.shuffle(by_size[size])
+    split = []
+    for b in template:
+        group = []
+        for size, n in zip(sizes, b):
+            group.extend(by_size[size][:n])
+            del by_size[size][:n]
+        split.append(group)
+    return split
+
+
+def sample_subgroup_split(nodes: list, lo: int, hi: int, rng, path=[], stats=None):
+    # Base case: no nodes left to pick, return our current path.
+    if not nodes:
+        return path
+
+    # Compute how many nodes we have left to pick from and
+    # return failure if we don't have enough.
+    num_left = sum(x.size for x in nodes)
+    if num_left < lo:
+        if num_left and num_left == lo - 1:
             return path + [nodes]
+        return None
 
-        # Sampling-based DFS (effectively MTCS / Monte Carlo Tree Search)
-        # to solve general, iterated change-making problem.
-        # Basically, each subgroup node can have variable size, and yet we need
-        # to group nodes together to achieve sizes tightly bounded by min
-        # and max group sizes specified in the class config.
-        num_samples = 0
-        sample = nodes
-        while num_samples <= 1000:
-            num_samples += 1
-            random.shuffle(sample)
-
-            # Pick first i nodes until total size of first i is within desired range bound.
-            cur_path = list(path)
-            cur_sample = sample
-            while cur_sample:
-                i = 1
-                while i <= len(cur_sample):
-                    # Compute sum of first i nodes' sizes and stop looping
-                    # if we have achieved our desired size.
-                    at = sum(x.size for x in cur_sample[:i])
-                    if lo <= at <= hi:
-                        if (i + 1 <= len(cur_sample)) and (
-                            at + sum(x.size for x in cur_sample[i : i + 1]) <= hi
-                        ):
-                            if random.choice((False, True)):
-                                break
-                        else:
-                            break
+    # If we have exactly enough, we're trivially done.
+    if lo <= num_left <= hi:
+        return path + [nodes]
 
-                    # Check if we were not able to achieve the desired change
-                    # and flag for re-sampling.
-                    if at > hi:
-                        i = -1
-                        break
+    # Sampling-based DFS (effectively MTCS / Monte Carlo Tree Search)
+    # to solve general, iterated change-making problem.
+    # Basically, each subgroup node can have variable size, and yet we need
+    # to group nodes together to achieve sizes tightly bounded by min
+    # and max group sizes specified in the class config.
+    num_samples = 0
+    sample = nodes
+    while num_samples <= 1000:
+        num_samples += 1
+        rng.shuffle(sample)
 
-                    # Otherwise, continue looping.
-                    i += 1
-                    if i > len(cur_sample):
-                        i -= 1
+        # Pick nodes from the front of the sample until the running total is within the
+        # desired range bound, then start the next group where that one ended.
+        cur_path = list(path)
+        start, num_sample = 0, len(sample)
+        while start < num_sample:
+            end, at = start, 0
+            while end < num_sample:
+                # Extend the running sum of the group's sizes and stop looping if we have
+                # achieved our desired size.
+                at += sample[end].size
+                end += 1
+                if lo <= at <= hi:
+                    if end < num_sample and at + sample[end].size <= hi:
+                        if rng.choice((False, True)):
+                            break
+                    else:
                         break
 
-                # If sample did not succeed, re-loop.
-                if i < 0 or at < lo:
-                    cur_path = None
+                # Check if we were not able to achieve the desired change
+                # and flag for re-sampling.
+                if at > hi:
+                    end = -1
                     break
 
-                cur_path.append(list(cur_sample[:i]))
-                cur_sample = cur_sample[i:]
+            # If sample did not succeed, re-loop.
+            if end < 0 or at < lo:
+                cur_path = None
+                break
 
-            if cur_path:
-                return cur_path
+            cur_path.append(sample[start:end])
+            start = end
 
-        # If no valid split found in this recursion branch, signal failure.
-        return None
+        if cur_path:
+            break
 
-    # For each subgroup, use sampling-based approach to compute split.
-    out = []
-    for subgroup in subgroups:
-        split = [subgroup[2]]
-
-        # Only use recursive method if we have enough nodes to even achieve a valid result.
-        if subgroup[3] >= lo:
-            split = sample_subgroup_split(subgroup[2], [])
-            if not split:
-                # Explain how to recover from this error state.
-                print(
-                    "Sampling-based subgroup splitting was unable to achieve a size result within bounds."
-                )
-                print(
-                    "Try either (1) running again and changing the seed, (2) increasing the number of iterations,"
-                    + " or (3) loosening the group range."
+    # Count the samples drawn, and how many of them had to be redrawn, for profiling.
+    if stats is not None:
+        stats["sampler_iterations"] = stats.get("sampler_iterations", 0) + num_samples
+        stats["sampler_retries"] = (
+            stats.get("sampler_retries", 0) + num_samples - (1 if cur_path else 0)
+        )
+
+    # If no valid split found in this recursion branch, signal failure.
+    return cur_path or None
+
+
+def split_subgroup(task: tuple) -> tuple:
+    """
+    Split a single subgroup into groups and refine them against the "Best-effort" objective.
+    Kept self-contained (and at module level) so that it can run in a worker process.
+
+    Args:
+        task (tuple): (compact_nodes, lo, hi, splitter, features, weights, search, seed,
+            time_limit), where compact_nodes holds a (size, feature values per student) pair
+            per node so that full props dicts never need to be sent to a worker
+
+    Returns:
+        tuple: (groups, stats), where groups is a list of lists of node positions within the
+            subgroup (or None if sampling failed) and stats holds objective, balance,
+            sampling and search counters for the subgroup
+    """
+    compact_nodes, lo, hi, splitter, features, weights, search, seed, time_limit = task
+    rng = random.Random(seed)
+    nodes = [
+        Node([dict(zip(features, values)) for values in props], size=size)
+        for size, props in compact_nodes
+    ]
+    position = {id(node): i for i, node in enumerate(nodes)}
+    num = sum(x.size for x in nodes)
+    stats = {
+        "initial_score": 0,
+        "final_score": 0,
+        "sampler_iterations": 0,
+        "sampler_retries": 0,
+    }
+
+    split = [nodes]
+
+    # Only use recursive method if we have enough nodes to even achieve a valid result.
+    if num >= lo:
+        # Fill in the (shared, cached) split template for this subgroup's size profile,
+        # deterministically for the DP splitter and with shuffled members for the sampler.
+        split = dp_subgroup_split(nodes, lo, hi, rng=rng if splitter == "sample" else None)
+        if split is None and splitter == "dp":
+            raise RuntimeError(
+                f"No subgroup split of size {num} comprised of {len(nodes)}"
+                + f" nodes exists that achieves range [{lo}, {hi}] inclusive."
+            )
+
+        # A template proves whether any split exists, so only fall back to sampling when the
+        # profile is too large for one.
+        if split is False:
+            stats["sampled_splits"] = 1
+            split = sample_subgroup_split(list(nodes), lo, hi, rng, [], stats=stats)
+        elif split is None:
+            stats["template_infeasible"] = 1
+        else:
+            stats["template_splits"] = 1
+        if not split:
+            # Leave it to the caller to decide whether another restart succeeded.
+            return None, stats
+
+    # Refine the split against the weighted "Best-effort" objective, if one was given.
+    if features:
+        objective = GroupObjective(features, weights, split)
+        stats["initial_score"] = objective.score
+        split = local_search(
+            objective,
+            lo,
+            hi,
+            rng,
+            time_limit=time_limit,
+            max_iterations=search["iterations"] * len(nodes),
+            temperature=search["temperature"],
+            stats=stats,
+        )
+        stats["final_score"] = GroupObjective(features, weights, split).score
+
+    # Measure how far group sizes stray from the middle of the range, to break ties on.
+    mid = (lo + hi) / 2
+    stats["imbalance"] = sum((sum(x.size for x in group) - mid) ** 2 for group in split)
+
+    return [[position[id(node)] for node in group] for group in split], stats
+
+
+def restart_seed(seed: int, i: int, restart: int) -> int:
+    # The first restart of every subgroup keeps the seed a single-restart run would use.
+    return seed * 1_000_003 + i + (restart << 40)
+
+
+def run_best_effort(
+    config: Configuration,
+    subgroups: list,
+    stats: dict = None,
+    workers: int = 1,
+    seed: int = None,
+    restarts: int = None,
+) -> list:
+    """
+    Split every subgroup into groups within the configured size range.
+
+    Args:
+        config (Configuration): Matching configuration
+        subgroups (list): Subgroup tuples from multi-partitioning
+        stats (dict, optional): If given, objective, balance, sampling and search counters
+            are added
+        workers (int, optional): Number of worker processes to spread restarts over
+        seed (int, optional): Overrides the configured search seed
+        restarts (int, optional): Overrides the configured number of restarts per subgroup
+
+    Returns:
+        list: Match objects, one per group
+    """
+    hi, lo = config.max_group_size, config.min_group_size
+    features, weights = (config.constraints.get("Best-effort") or [[], []])[:2]
+    search = {**SEARCH_DEFAULTS, **config.constraints.get("Search", {})}
+    if seed is not None:
+        search["seed"] = seed
+    if restarts is not None:
+        search["restarts"] = restarts
+    num_restarts = max(1, search["restarts"])
+    splitter = config.constraints.get("Splitter", "sample")
+    assert splitter in (
+        "sample",
+        "dp",
+    ), "Only sampling-based and dynamic programming splitters implemented for best-effort matching!"
+    total_size = sum(subgroup[3] for subgroup in subgroups) or 1
+    if stats is None:
+        stats = {}
+
+    # Restarts running side by side share the wall-clock budget, so each one may use as much
+    # of it as there are workers to run them concurrently.
+    concurrency = min(max(1, workers), num_restarts)
+
+    # Describe each restart of each subgroup as a compact, independent task. Every task gets
+    # its own seed derived from the configured one, so results don't depend on how many
+    # workers are used.
+    tasks = []
+    time_limit = search["time_limit"]
+    for i, subgroup in enumerate(subgroups):
+        compact_nodes = [
+            (x.size, [[prop.get(col) for col in features] for prop in x.props])
+            for x in subgroup[2]
+        ]
+        for restart in range(num_restarts):
+            tasks.append(
+                (
+                    compact_nodes,
+                    lo,
+                    hi,
+                    splitter,
+                    features,
+                    weights,
+                    search,
+                    restart_seed(search["seed"], i, restart),
+                    time_limit * subgroup[3] / total_size * concurrency / num_restarts
+                    if time_limit is not None
+                    else None,
                 )
+            )
 
-                # Halt execution of program.
-                raise RuntimeError(
-                    f"Unable to compute subgroup split of size {subgroup[3]}"
-                    + f" comprised of {len(subgroup[2])} nodes with num {sum(x.size for x in subgroup[2])} to achieve range"
-                    + f" [{config.min_group_size}, {config.max_group_size}] inclusive."
+    # For each subgroup restart, compute a split (in parallel if requested).
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(
+                    split_subgroup, tasks, chunksize=max(1, len(tasks) // (4 * workers))
                 )
+            )
+    else:
+        results = [split_subgroup(task) for task in tasks]
 
-        # Combine the grouped subgroup nodes into Match objects, one per grouped subgroup.
-        for group in split:
-            group_num = sum(x.size for x in group)
-            combined = Node(
-                sum((x.props for x in group), []), size=group_num, assigned=True
+    out = []
+    for g, subgroup in enumerate(subgroups):
+        attempts = results[g * num_restarts : (g + 1) * num_restarts]
+        for _, attempt_stats in attempts:
+            for key, value in attempt_stats.items():
+                if key not in SPLIT_STATS:
+                    stats[key] = stats.get(key, 0) + value
+
+        # Keep the best feasible restart: lowest objective, then most balanced sizes.
+        feasible = [attempt for attempt in attempts if attempt[0] is not None]
+        if not feasible:
+            # Explain how to recover from this error state.
+            print(
+                "Sampling-based subgroup splitting was unable to achieve a size result within bounds."
+            )
+            print(
+                "Try either (1) increasing the number of restarts, (2) using the \"dp\" splitter,"
+                + " or (3) loosening the group range."
             )
+
+            # Halt execution of program.
+            raise RuntimeError(
+                f"Unable to compute subgroup split of size {subgroup[3]}"
+                + f" comprised of {len(subgroup[2])} nodes to achieve range"
+                + f" [{lo}, {hi}] inclusive in {num_restarts} restart(s)."
+            )
+        split, split_stats = min(
+            feasible, key=lambda x: (x[1]["final_score"], x[1]["imbalance"])
+        )
+        for key in SPLIT_STATS:
+            stats[key] = stats.get(key, 0) + split_stats[key]
+
+        # Combine the grouped subgroup nodes into Match objects, one per grouped subgroup.
+        for positions in split:
+            combined = Node.combine([subgroup[2][i] for i in positions])
             out.append(Match(combined, source="path", path=subgroup[0]))
 
     # Return final matches.
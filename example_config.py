@@ -1,5 +1,4 @@
 from models import Row, Column, Node, Match
-import os
 
 
 def days_transformer(days_list):
@@ -260,8 +259,42 @@ ROW_CONFIG = Row(
     ]
 )
 
+
+def is_black(props):
+    return props["race"] is not None and props["race"] == 3
+
+
+def is_hispanic(props):
+    return props["race"] is not None and props["race"] == 2
+
+
+def is_islander(props):
+    return props["race"] is not None and props["race"] == 5
+
+
+def is_alaskan(props):
+    return props["race"] is not None and props["race"] == 4
+
+
+def is_female(props):
+    return props["gender"] is not None and props["gender"] == 0
+
+
+def is_nonmf(props):
+    return props["gender"] is not None and props["gender"] not in (0, 1)
+
+
+def is_underrepresented(props):
+    return (
+        props["race"] is not None
+        and 2 <= props["race"] <= 6
+        or (props["gender"] is not None and props["gender"] != 1)
+    )
+
+
 CONSTRAINTS = {
     "Partition": ["year", "remote", "meeting_days", "meeting_time"],
+    # "Plan": [["year"], ["remote", "meeting_days", "meeting_time"]],  # partition column order tiers
     "Existing": {
         "type": "explicit_keys",
         "flag": "is_existing",
@@ -279,6 +312,12 @@ CONSTRAINTS = {
         ["gender", "race"],
         [1, 1],
     ],  # column ID's for features followed by weights
+    "Rebalance": [
+        ["female", is_female],
+        ["hispanic", is_hispanic],
+        ["black", is_black],
+    ],  # category names and predicates; applied in post_processing
+    # "Search": {"iterations": 100, "time_limit": None, "temperature": 1.0, "seed": 100, "restarts": 1},  # best-effort local search tuning
 }
 
 MIN_GROUP_SIZE = 3
@@ -384,41 +423,10 @@ def postprocess_partitions(subgroups: list) -> list:
     return subgroups
 
 
-def is_black(props):
-    return props["race"] is not None and props["race"] == 3
-
-
-def is_hispanic(props):
-    return props["race"] is not None and props["race"] == 2
-
-
-def is_islander(props):
-    return props["race"] is not None and props["race"] == 5
-
-
-def is_alaskan(props):
-    return props["race"] is not None and props["race"] == 4
-
-
-def is_female(props):
-    return props["gender"] is not None and props["gender"] == 0
-
-
-def is_nonmf(props):
-    return props["gender"] is not None and props["gender"] not in (0, 1)
-
-
-def is_underrepresented(props):
-    return (
-        props["race"] is not None
-        and 2 <= props["race"] <= 6
-        or (props["gender"] is not None and props["gender"] != 1)
-    )
-
-
 def post_processing(matches: list):
     from collections import Counter
-    import pandas as pd
+    import rebalancing
+    import result_writer
 
     # TODO: fix that it's hardcoded for now, should generalize by partition criteria and type.
     def reconstruct_path(match: Match):
@@ -503,8 +511,8 @@ def post_processing(matches: list):
         if match.source == "existing":
             continue
         by_size[match.size] = by_size.get(match.size, []) + [match]
-    matches = [match for match in matches if match not in by_size[2]]
-    for arr in batch(by_size[2], n=2):
+    matches = [match for match in matches if match not in by_size.get(2, [])]
+    for arr in batch(by_size.get(2, []), n=2):
         props = sum((x.node.props for x in arr), [])
         node = Node(props, size=(len(arr) * 2), assigned=True)
         matches.append(Match(node=node, source="path", path="(manually fixed)"))
@@ -535,81 +543,20 @@ def post_processing(matches: list):
             )
         )
 
-    # For female students; find groups with only 1 female. Take females from half of them, and add to the other half (pair up).
-    # TODO: implement odd-number workaround
-    female_groups = []
-    for match in matches:
-        if match.source == "existing" or match.path == "(singleton manually fixed)":
-            continue
-        num_female_students = 0
-        for x in match.node.props:
-            if is_female(x):
-                num_female_students = num_female_students + 1
-        if num_female_students == 1:
-            female_groups.append(match)
-    female_groups = sorted(female_groups, key=lambda x: x.size, reverse=True)
-    if len(female_groups) % 2 == 1:
-        print(f"{len(female_groups)}, CANNOT pair all females")
-    for i in range(len(female_groups) // 2):
-        member = [x for x in female_groups[i].node.props if is_female(x)][0]
-        # if is_female(member):
-        #     continue
-        female_groups[i].node.size -= 1
-        female_groups[i].node.props.remove(member)
-        female_groups[i].path = "(gender modification singletons - 1)"
-        j = i + len(female_groups) // 2
-        female_groups[j].node.size += 1
-        female_groups[j].node.props.append(member)
-        female_groups[j].path = "(gender modification singletons + 1)"
-
-    # Pair up hispanic students
-    hispanic_groups = []
-    for match in matches:
-        if match.source == "existing" or match.path == "(singleton manually fixed)":
-            continue
-        num_hispanic_students = 0
-        for x in match.node.props:
-            if is_hispanic(x):
-                num_hispanic_students = num_hispanic_students + 1
-        if num_hispanic_students == 1:
-            hispanic_groups.append(match)
-    hispanic_groups = sorted(hispanic_groups, key=lambda x: x.size, reverse=True)
-    for i in range(len(hispanic_groups) // 2):
-        member = [x for x in hispanic_groups[i].node.props if is_hispanic(x)][0]
-        # if is_female(member):
-        #     continue
-        hispanic_groups[i].node.size -= 1
-        hispanic_groups[i].node.props.remove(member)
-        hispanic_groups[i].path = "(hispanic modification singletons - 1)"
-        j = i + len(hispanic_groups) // 2
-        hispanic_groups[j].node.size += 1
-        hispanic_groups[j].node.props.append(member)
-        hispanic_groups[j].path = "(hispanic modification singletons + 1)"
-
-    # Pair up black students
-    black_groups = []
-    for match in matches:
-        if match.source == "existing" or match.path == "(singleton manually fixed)":
-            continue
-        num_black_students = 0
-        for x in match.node.props:
-            if is_black(x):
-                num_black_students = num_black_students + 1
-        if num_black_students == 1:
-            black_groups.append(match)
-    black_groups = sorted(black_groups, key=lambda x: x.size, reverse=True)
-    print("BLACK: ", black_groups)
-    for i in range(len(black_groups) // 2):
-        member = [x for x in black_groups[i].node.props if is_black(x)][0]
-        # if is_female(member):
-        #     continue
-        black_groups[i].node.size -= 1
-        black_groups[i].node.props.remove(member)
-        black_groups[i].path = "(black modification singletons - 1)"
-        j = i + len(black_groups) // 2
-        black_groups[j].node.size += 1
-        black_groups[j].node.props.append(member)
-        black_groups[j].path = "(black modification singletons + 1)"
+    # Pair up female, hispanic and black students left as the only one in their group, now that
+    # group sizes have been fixed up (see CONSTRAINTS["Rebalance"]).
+    rebalance_report = {}
+    rebalancing.apply_rules(
+        matches,
+        CONSTRAINTS["Rebalance"],
+        MIN_GROUP_SIZE,
+        MAX_GROUP_SIZE,
+        skip=lambda match: match.path == "(singleton manually fixed)",
+        report=rebalance_report,
+    )
+    for name, counts in rebalance_report.items():
+        if counts["unpaired"]:
+            print(f"{counts['isolated']}, CANNOT pair all {name} students")
 
     total_num = 0
     minority_groups = [
@@ -649,14 +596,14 @@ def post_processing(matches: list):
             print("\n".join(counter[k]))
             print("******")
 
-    out = []
     for match in matches:
         added = [x["partner"] for x in match.node.props if "partner" in x]
         match.node.props += added
     match_depths = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
     for match in matches:
         reconstruct_path(match)
-    for (i, match) in enumerate(matches):
+    common_columns = []
+    for match in matches:
         if (
             match.path
             and str(match.path) != "(manually fixed)"
@@ -693,39 +640,63 @@ def post_processing(matches: list):
             common_meeting_time = " "
             common_section = " "
             curr_path = str(match.path)
-        for person in match.node.props:
-            out.append(
-                {
-                    "group_num": i,
-                    "email": person["email"],
-                    "sid": person["sid"],
-                    "first": person["first_name"],
-                    "last": person["last_name"],
-                    "incoming_partners": person.get("incoming_partners", "N/A"),
-                    "outgoing_partners": person.get("outgoing_partners", "N/A"),
-                    "race": person["race"],
-                    "gender": person["gender"],
-                    "had existing": person["is_existing"],
-                    "meeting days": person["meeting_days"],
-                    "meeting times": person["meeting_time"],
-                    "common_remoteness": common_remoteness,
-                    "common_meeting_day": common_meeting_day,
-                    "common_meeting_time": common_meeting_time,
-                    "common_section": common_section,
-                    "path": curr_path,
-                }
+        common_columns.append(
+            (
+                common_remoteness,
+                common_meeting_day,
+                common_meeting_time,
+                common_section,
+                curr_path,
             )
+        )
 
     print("*** Match Stats ***")
     print(match_depths)
     print("***")
-    df = pd.DataFrame(out)
-    out_fname = "out-private.csv"
-    out_fname_format = "out-private-{}.csv"
-    if os.path.isfile(out_fname):
-        i = 2
-        while os.path.isfile(out_fname_format.format(i)):
-            i += 1
-        out_fname = out_fname_format.format(i)
-    print(f"Outputting {len(out)} students to '{out_fname}'.")
-    df.to_csv(out_fname, encoding="utf-8", index=False)
+
+    # Stream one row per student straight to the output CSV.
+    columns = [
+        "group_num",
+        "email",
+        "sid",
+        "first",
+        "last",
+        "incoming_partners",
+        "outgoing_partners",
+        "race",
+        "gender",
+        "had existing",
+        "meeting days",
+        "meeting times",
+        "common_remoteness",
+        "common_meeting_day",
+        "common_meeting_time",
+        "common_section",
+        "path",
+    ]
+
+    def rows():
+        for (i, (match, common)) in enumerate(zip(matches, common_columns)):
+            for person in match.node.props:
+                yield [
+                    i,
+                    person["email"],
+                    person["sid"],
+                    person["first_name"],
+                    person["last_name"],
+                    person.get("incoming_partners", "N/A"),
+                    person.get("outgoing_partners", "N/A"),
+                    person["race"],
+                    person["gender"],
+                    person["is_existing"],
+                    person["meeting_days"],
+                    person["meeting_time"],
+                    *common,
+                ]
+
+    with result_writer.output_path() as out_fname:
+        print(
+            f"Outputting {sum(len(match.node.props) for match in matches)} students to '{out_fname}'."
+        )
+        result_writer.write_table(out_fname, columns, rows())
+    return matches
@@ -1,7 +1,40 @@
 from models import *
 
 
-def handle_existing(config: Configuration, nodes: list, debug: bool = False) -> list:
+class DisjointSet(object):
+    def __init__(self):
+        """
+        Create an empty disjoint-set (union-find) forest over arbitrary hashable keys.
+        """
+        self.parent = {}
+        self.size = {}
+
+    def add(self, key):
+        if key not in self.parent:
+            self.parent[key] = key
+            self.size[key] = 1
+
+    def find(self, key):
+        # Path halving: point every other node on the way up at its grandparent.
+        parent = self.parent
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def handle_existing(
+    config: Configuration, nodes: list, debug: bool = False, report: dict = None
+) -> list:
     # Grab relevant configuration parameters.
     assert config.constraints["Existing"]["type"] in (
         "min_sid",
@@ -9,6 +42,9 @@ def handle_existing(config: Configuration, nodes: list, debug: bool = False) ->
     ), "Only minimum / unique group SID and explicit group member keys implemented for group matching!"
     flag_key = config.constraints["Existing"]["flag"]
     groups = {}
+    if report is None:
+        report = {}
+    report.update(components=[], dangling=[])
 
     if config.constraints["Existing"]["type"] == "min_sid":
         data_key = config.constraints["Existing"]["data"][0]
@@ -16,12 +52,18 @@ def handle_existing(config: Configuration, nodes: list, debug: bool = False) ->
         # Go through each parsed node, group any which match the flag key into
         # their groups based on min/unique SID, and take them out of the
         # main matching pool.
-        for i in range(len(nodes) - 1, -1, -1):
-            curr_node = nodes[i].props[0]
-            if curr_node[flag_key] and nodes[i].size == 1:
+        remaining = []
+        for node in reversed(nodes):
+            curr_node = node.props[0]
+            if curr_node[flag_key] and node.size == 1:
                 groups.setdefault(curr_node[data_key], [])
                 groups[curr_node[data_key]].append(curr_node)
-                del nodes[i]
+            else:
+                remaining.append(node)
+        nodes[:] = remaining[::-1]
+        report["components"] = [
+            [prop[data_key] for prop in group] for group in groups.values()
+        ]
     elif config.constraints["Existing"]["type"] == "explicit_keys":
         data_keys = config.constraints["Existing"]["data"]
         id_key = config.constraints["Existing"]["id_key"]
@@ -29,15 +71,14 @@ def handle_existing(config: Configuration, nodes: list, debug: bool = False) ->
         successor_map = {}
         key_to_node = {}
 
-        # Go through each parsed node, group any which match the flag key into
-        # their groups based on min/unique SID, and take them out of the
-        # main matching pool.
-        num_deleted = 0
-        for i in range(len(nodes) - 1, -1, -1):
-            curr_node = nodes[i].props[0]
-            if curr_node[flag_key] and nodes[i].size == 1:
+        # Go through each parsed node, pick out any which match the flag key, and take them
+        # out of the main matching pool in a single filtering pass.
+        remaining = []
+        for node in reversed(nodes):
+            curr_node = node.props[0]
+            if curr_node[flag_key] and node.size == 1:
                 assert curr_node[id_key] not in key_to_node
-                key_to_node[curr_node[id_key]] = nodes[i]
+                key_to_node[curr_node[id_key]] = node
                 successor_map[curr_node[id_key]] = [
                     curr_node[key] for key in data_keys if curr_node[key]
                 ]
@@ -47,36 +88,28 @@ def handle_existing(config: Configuration, nodes: list, debug: bool = False) ->
                 for group_key in group_keys:
                     predecessor_map.setdefault(group_key, [])
                     predecessor_map[group_key].append(curr_node[id_key])
-                del nodes[i]
-                num_deleted += 1
-        # print(f"{num_deleted} students removed.")
+            else:
+                remaining.append(node)
+        nodes[:] = remaining[::-1]
 
-        # Another pass to merge groups since lots of them forget to list all other
-        # partners and only list a few
-        seen_ids = set()
-        for group_key in predecessor_map:
-            if group_key in seen_ids or group_key not in key_to_node:
-                continue
-            have = []
-            q = predecessor_map[group_key] + [group_key]
-            if debug:
-                print("\nstarting", group_key)
-            while q:
-                at = q.pop()
-                if at in seen_ids or at not in key_to_node:
-                    if debug:
-                        print("bye", at, at in seen_ids, at not in key_to_node)
-                        print(key_to_node)
-                    continue
-                if debug:
-                    print(at)
-                seen_ids.add(at)
-                have.append(at)
-                q.extend([k for k in predecessor_map[at] if k not in seen_ids])
-                q.extend([k for k in successor_map[at] if k not in seen_ids])
-            if debug:
-                print(group_key, len(have))
-            groups[group_key] = [key_to_node[k].props[0] for k in have]
+        # Merge everybody connected by a partner reference (in either direction) since lots
+        # of them forget to list all other partners and only list a few. References to people
+        # who aren't in the pool are dangling and don't connect anybody.
+        components = DisjointSet()
+        for key in key_to_node:
+            components.add(key)
+        for key, partners in successor_map.items():
+            for partner in partners:
+                if partner in key_to_node:
+                    components.union(key, partner)
+                else:
+                    report["dangling"].append((key, partner))
+        for key in key_to_node:
+            root = components.find(key)
+            groups.setdefault(root, []).append(key_to_node[key].props[0])
+        report["components"] = [
+            [prop[id_key] for prop in group] for group in groups.values()
+        ]
 
         # One last pass: annotate everybody with their incoming edges (people who put them as partners)
         for key in key_to_node:
@@ -92,6 +125,7 @@ def handle_existing(config: Configuration, nodes: list, debug: bool = False) ->
     if debug:
         print([(i, len(x)) for i, x in sorted(groups.items(), key=lambda x: x[0])])
         print(len(groups))
+        print(f"Dangling references: {report['dangling']}")
 
     # Combine groups into singular Nodes and form explicit Match objects.
     out = []
@@ -1,6 +1,43 @@
-import pandas as pd
-from email.utils import parseaddr
-from models import Row, Node
+import csv
+import os
+import re
+from models import Row, Node, always_valid, identity
+
+# Number of CSV rows read and converted at a time, which bounds parsing's peak memory use.
+CHUNK_SIZE = 10000
+
+# CSVs up to this many bytes (a few thousand responses) are parsed with the csv module, which
+# is quicker than importing Pandas in the first place.
+SMALL_CSV_BYTES = 1 << 20
+
+# Plain addresses (no display name, comments or quoting), which are always valid emails.
+PLAIN_EMAIL_PATTERN = r"[^\s\"(),:;<>@\[\]\\]+@[^\s\"(),:;<>@\[\]\\]+"
+PLAIN_EMAIL = re.compile(PLAIN_EMAIL_PATTERN)
+
+# Cell values Pandas reads as missing by default, which are treated as empty cells.
+NA_VALUES = frozenset(
+    [
+        "",
+        "#N/A",
+        "#N/A N/A",
+        "#NA",
+        "-1.#IND",
+        "-1.#QNAN",
+        "-NaN",
+        "-nan",
+        "1.#IND",
+        "1.#QNAN",
+        "<NA>",
+        "N/A",
+        "NA",
+        "NULL",
+        "NaN",
+        "None",
+        "n/a",
+        "nan",
+        "null",
+    ]
+)
 
 
 def is_all_digits(d):
@@ -16,12 +53,18 @@ def is_float(x):
 
 
 def is_valid_email(email):
+    if PLAIN_EMAIL.fullmatch(email):
+        return True
+
+    # Importing email.utils pulls in socket and friends, so only do it for unusual addresses.
+    from email.utils import parseaddr
+
     parsed_email = parseaddr(email)
     return len(parsed_email[0]) > 0 or len(parsed_email[1]) > 0
 
 
 class TypeValidator(object):
-    def __init__(self, validator=lambda x: True, transformer=lambda x: x):
+    def __init__(self, validator=always_valid, transformer=identity):
         self.validator = validator
         self.transformer = transformer
 
@@ -50,6 +93,59 @@ GLOBAL_TYPE_LIST = {
 }
 
 
+def check_all_valid(typ, series, valid):
+    # Raise the same error as the per-value TypeValidator for the first invalid value.
+    if not valid.all():
+        raise UserWarning(
+            f"Argument '{series[~valid].iloc[0]}' is not valid for type '{typ}'"
+        )
+
+
+def convert_digits(typ, series):
+    check_all_valid(typ, series, series.str.fullmatch(r"[0-9]*"))
+    return list(map(int, series.tolist()))
+
+
+def convert_float(typ, series):
+    try:
+        return list(map(float, series.tolist()))
+    except ValueError:
+        return [GLOBAL_TYPE_LIST[typ](typ, x) for x in series]
+
+
+def convert_email(typ, series):
+    # Plain addresses are always valid, so only hand unusual values to the email parser.
+    plain = series.str.fullmatch(PLAIN_EMAIL_PATTERN)
+    if not plain.all():
+        check_all_valid(typ, series, plain | series.map(is_valid_email).astype(bool))
+    return series.tolist()
+
+
+def convert_boolean(typ, series):
+    check_all_valid(typ, series, series.isin(["Yes", "No"]))
+    return (series == "Yes").tolist()
+
+
+# Column-at-a-time equivalents of GLOBAL_TYPE_LIST, each taking a type name and a Pandas Series
+# of strings and returning a list of converted values. Types not listed here fall back to
+# converting one value at a time.
+VECTORIZED_TYPE_LIST = {
+    "ignore": lambda typ, series: series.tolist(),
+    "text": lambda typ, series: series.str.strip().tolist(),
+    "sid": convert_digits,
+    "email": convert_email,
+    "boolean": convert_boolean,
+    "checkbox": lambda typ, series: [
+        [elem.strip() for elem in x.split(",")] for x in series.tolist()
+    ],
+    "radio": lambda typ, series: series.tolist(),
+    "dropdown": lambda typ, series: series.tolist(),
+    "scale": convert_digits,
+    "float": convert_float,
+    "int": convert_digits,
+}
+
+
 def parse_column(col, val):
     # If nil value and optional column, ignore.
     if col.is_optional and not val:
@@ -62,52 +158,201 @@ def parse_column(col, val):
     return col(type_transformed)
 
 
-def parse_from_csv(csv_path: str, row_config: Row, debug: bool = False) -> list:
-    # Parse given CSV into a Pandas DataFrame object
-    data = pd.read_csv(csv_path, dtype=str)
+def column_converter(col):
+    """
+    Build a function that converts a whole Pandas Series of raw strings for the given column
+    into a list of parsed values, with the type conversion and the column's own validator and
+    transformer bound ahead of time (and skipped entirely when they're the defaults).
+    """
+    vectorized = VECTORIZED_TYPE_LIST.get(col.col_type)
+    typ, is_optional = col.col_type, col.is_optional
+    if col.validator is always_valid and col.transformer is identity:
+        finish = None
+    elif col.validator is always_valid:
+        transformer = col.transformer
+        finish = lambda values: list(map(transformer, values))
+    else:
+        finish = lambda values: list(map(col, values))
+
+    def convert(series) -> list:
+        # Account for Pandas' interesting design choices when it comes to representing empty
+        # cells (as NaN floats) by treating them as empty strings.
+        series = series.fillna("")
+        if vectorized is None:
+            return [parse_column(col, val) for val in series.tolist()]
+
+        # Optional columns leave empty cells as None, so only convert the filled-in ones.
+        present = None
+        if is_optional:
+            present = (series != "").to_numpy()
+            series = series[present]
 
-    # Construct a mapping from column index to Column object
-    csv_columns = data.columns.values
+        values = vectorized(typ, series)
+        if finish is not None:
+            values = finish(values)
+
+        if present is None:
+            return values
+        out = [None] * len(present)
+        for i, value in zip(present.nonzero()[0], values):
+            out[i] = value
+        return out
+
+    return convert
+
+
+def map_columns(csv_columns: list, row_config: Row) -> dict:
+    # Construct a mapping from column index to Column object, preferring exact title matches
+    # over substring matches (and the first matching column either way).
     col_mapping = {x: None for x in range(len(csv_columns))}
+    exact = {}
+    for i, name in enumerate(csv_columns):
+        exact.setdefault(name, i)
     for col in row_config.cols:
-        match = None
-        matches = [name for name in csv_columns if col.col_title == name]
-        if not matches:
-            matches = [name for name in csv_columns if col.col_title in name]
+        match = exact.get(col.col_title)
+        if match is None:
+            match = next(
+                (i for i, name in enumerate(csv_columns) if col.col_title in name), None
+            )
             assert (
-                matches
+                match is not None
             ), f"No column title containing '{col.col_title}', as specified in the configuration file, was found in the given CSV!"
-        match = matches[0]
-        col_mapping[list(csv_columns).index(match)] = col
+        col_mapping[match] = col
+    return col_mapping
 
-    # Print debug info if requested.
-    if debug:
-        print(col_mapping)
 
-    # Parse each row properly into a Node object.
-    nodes = []
-    for row in data.itertuples(index=False, name=None):
-        props = {}
-
-        # Go through each column in the config file.
-        for row_idx in col_mapping:
-            # Figure out which column we're looking at.
-            col = col_mapping[row_idx]
-            if col is None:
+# Compiled parse plans, keyed on (CSV header, row configuration), most recently used last. Only
+# the most recent MAX_PLANS are kept, so that long-running processes reloading configurations
+# (and with them, new row configurations) don't pile them up.
+_PLANS = {}
+MAX_PLANS = 16
+
+
+def compile_plan(csv_columns: list, row_config: Row, debug: bool = False) -> list:
+    """
+    Compile (or reuse) the parse plan for a CSV header and row configuration: a list of
+    (CSV column index, column ID, converter) entries for mapped columns only, in CSV order.
+    """
+    key = (tuple(csv_columns), row_config)
+    plan = _PLANS.pop(key, None)
+    if plan is None:
+        col_mapping = map_columns(csv_columns, row_config)
+
+        # Print debug info if requested.
+        if debug:
+            print(col_mapping)
+
+        plan = [
+            (i, col.col_id, column_converter(col))
+            for i, col in col_mapping.items()
+            if col is not None
+        ]
+        while len(_PLANS) >= MAX_PLANS:
+            del _PLANS[next(iter(_PLANS))]
+    _PLANS[key] = plan
+    return plan
+
+
+def read_header(row: list) -> list:
+    # Name blank and repeated column titles the way Pandas does, so both parsers match columns
+    # the same way.
+    header, seen = [], {}
+    for i, name in enumerate(row):
+        name = name or f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def parse_with_csv(csv_path: str, row_config: Row, debug: bool = False) -> list:
+    # Read the given CSV row by row with the csv module, converting one value at a time. This
+    # has to give exactly the same props as parse_with_pandas, which tests/test_form_parser.py
+    # checks.
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = read_header(next(reader, []))
+        col_mapping = map_columns(header, row_config)
+
+        # Print debug info if requested.
+        if debug:
+            print(col_mapping)
+
+        plan = [(i, col) for i, col in col_mapping.items() if col is not None]
+        nodes = []
+        for row in reader:
+            # Pandas skips blank lines and pads short rows with empty cells.
+            if not row:
                 continue
+            props = {}
+            for i, col in plan:
+                val = row[i] if i < len(row) else ""
+                props[col.col_id] = parse_column(col, "" if val in NA_VALUES else val)
+            nodes.append(Node([props]))
+
+    return nodes
+
 
-            # Grab the value and account for Pandas' interesting design choices when it comes
-            # to automatically deducing data types (overeager float conversion).
-            value = row[row_idx]
-            if isinstance(value, float) and str(value) == "nan":
-                value = ""
+def parse_with_pandas(
+    csv_path: str, row_config: Row, debug: bool = False, chunksize: int = CHUNK_SIZE
+) -> list:
+    import pandas as pd
 
-            # Hand off the property to the column parser so it can be parsed with respect to
-            # its type.
-            props[col.col_id] = parse_column(col, value)
+    # Read just the header to compile the parse plan, then stream only the mapped columns of
+    # the given CSV in chunks of Pandas DataFrame objects.
+    header = pd.read_csv(csv_path, dtype=str, nrows=0).columns.values
+    plan = compile_plan(header, row_config, debug=debug)
+    col_ids = [col_id for _, col_id, _ in plan]
+    usecols = [i for i, _, _ in plan]
 
-        # Add the constructed node to our final list.
-        nodes.append(Node([props]))
+    nodes = []
+    for data in pd.read_csv(csv_path, dtype=str, usecols=usecols, chunksize=chunksize):
+        # Hand off each column to its converter so it can be parsed with respect to its type
+        # (usecols keeps the mapped columns in CSV order, matching the plan).
+        columns = [
+            convert(data.iloc[:, position])
+            for position, (_, _, convert) in enumerate(plan)
+        ]
+
+        # Stitch the parsed columns back together into one Node object per row.
+        for values in zip(*columns):
+            nodes.append(Node([dict(zip(col_ids, values))]))
 
     # And send off our result!
     return nodes
+
+
+def parse_from_csv(
+    csv_path: str,
+    row_config: Row,
+    debug: bool = False,
+    chunksize: int = CHUNK_SIZE,
+    engine: str = "auto",
+) -> list:
+    """
+    Parse the given CSV into one Node object per row.
+
+    Args:
+        csv_path (str): Path to the CSV file of people to match
+        row_config (Row): Column configuration to parse with
+        debug (bool, optional): Whether to print debugging info
+        chunksize (int, optional): Rows converted at a time by the Pandas parser
+        engine (str, optional): "csv", "pandas", or "auto" to use the csv module for small
+            files (up to SMALL_CSV_BYTES) and Pandas for anything bigger
+
+    Returns:
+        list: Node objects, in CSV row order
+    """
+    assert engine in (
+        "auto",
+        "csv",
+        "pandas",
+    ), "Only csv module and Pandas CSV parsing engines implemented!"
+    if engine == "auto":
+        engine = "csv" if os.path.getsize(csv_path) <= SMALL_CSV_BYTES else "pandas"
+    if engine == "csv":
+        return parse_with_csv(csv_path, row_config, debug=debug)
+    return parse_with_pandas(csv_path, row_config, debug=debug, chunksize=chunksize)
@@ -0,0 +1,317 @@
+import ast
+import csv
+import partitioning
+import existing_groups
+import best_effort
+from models import *
+
+"""
+Incremental re-matching for forms submitted after an initial matching run.
+
+Previous assignments (read back from a previous output CSV) are kept fixed, with their members'
+props taken from the updated roster; students no longer on it are dropped. Only students who
+are new, or whose partition column answers changed, are matched: those asking to be grouped
+with others are grouped as in a full run (joining the previous group of anybody they're
+connected to), and everybody else is slotted into the most specific compatible previous group
+(one whose partition path the student satisfies) that still has room. Previous groups that
+losing students left below MIN_GROUP_SIZE are dissolved and their members slotted in the same
+way, and only those that fit nowhere are matched amongst themselves into new groups.
+
+The result is a list of Match objects like a full run's, so it goes through the same output and
+validation. Only the groups formed from scratch are rebalanced and post-processed, though (see
+run.py): previous groups, including those new students were slotted into, keep their members
+and their group numbers.
+"""
+
+
+def parse_path(cell: str):
+    # Partition paths are written out as tuples of (column, value) pairs; anything else (e.g.
+    # student-requested groups or hand-fixed groups) is not open to new members.
+    try:
+        path = ast.literal_eval(cell)
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(path, tuple) or not all(
+        isinstance(x, tuple) and len(x) == 2 for x in path
+    ):
+        return None
+    return tuple((col, str(val)) for col, val in path)
+
+
+def previous_path(cell: str):
+    # Paths are written out with str(), so read them back the same way (student-requested
+    # groups have none), as tuples of (column, value) pairs like matching produces even if
+    # post-processing wrote them out as lists.
+    if not cell:
+        return None
+    try:
+        path = ast.literal_eval(cell)
+    except (ValueError, SyntaxError):
+        return cell
+    if isinstance(path, list) and all(
+        isinstance(x, (tuple, list)) and len(x) == 2 for x in path
+    ):
+        return tuple(tuple(x) for x in path)
+    return path
+
+
+def cell_values(value) -> set:
+    # Compare values as strings, since that's all a previous output CSV can give us back.
+    if value is None:
+        return {""}
+    if isinstance(value, list):
+        return {str(x) for x in value}
+    return {str(value)}
+
+
+def common_path(partition_cols: list, rows: list):
+    # Reconstruct a partition path for a group from the values all its members share.
+    path = []
+    for col in partition_cols:
+        shared = None
+        for row in rows:
+            cell = row.get(col, "")
+            try:
+                values = ast.literal_eval(cell) if cell.startswith("[") else cell
+            except (ValueError, SyntaxError):
+                values = cell
+            values = cell_values(values)
+            shared = values if shared is None else shared & values
+        if not shared:
+            break
+        path.append((col, sorted(shared)[0]))
+    return tuple(path)
+
+
+def is_compatible(node: Node, path: tuple) -> bool:
+    props = node.props[0]
+    return all(val in cell_values(props.get(col)) for col, val in path)
+
+
+def connected_flagged(config: Configuration, flagged: list, pool: list) -> list:
+    # The students asking to be grouped who are connected to somebody in the pool; every other
+    # requested group was kept whole, so these are the only ones handle_existing has to group.
+    existing = config.constraints["Existing"]
+    in_pool = {id(node.props[0]) for node in pool}
+    if existing["type"] == "min_sid":
+        data_key = existing["data"][0]
+        keys = {
+            node.props[0][data_key] for node in flagged if id(node.props[0]) in in_pool
+        }
+        return [node for node in flagged if node.props[0][data_key] in keys]
+
+    # Explicit keys link students both ways, so search out from the pool over the links each
+    # student gives as well as those naming them.
+    id_key = existing["id_key"]
+    by_id = {node.props[0][id_key]: node for node in flagged}
+    named_by = {}
+    for node in flagged:
+        for data_key in existing["data"]:
+            named_by.setdefault(node.props[0][data_key], []).append(node)
+    queue = [node for node in flagged if id(node.props[0]) in in_pool]
+    seen = {id(node) for node in queue}
+    while queue:
+        props = queue.pop().props[0]
+        linked = [by_id.get(props[data_key]) for data_key in existing["data"]]
+        for neighbor in linked + named_by.get(props[id_key], []):
+            if neighbor is not None and id(neighbor) not in seen:
+                seen.add(id(neighbor))
+                queue.append(neighbor)
+    return [node for node in flagged if id(node) in seen]
+
+
+def run_incremental(
+    config: Configuration,
+    previous_csv: str,
+    nodes: list,
+    key: str = "sid",
+    debug: bool = False,
+) -> tuple:
+    """
+    Slot new and changed students into a previous matching.
+
+    Args:
+        config (Configuration): Matching configuration
+        previous_csv (str): Path to a previous output CSV (one row per student with group_num)
+        nodes (list): Freshly parsed Node objects for the full, updated roster
+        key (str, optional): Column ID that uniquely identifies a student across both CSVs
+        debug (bool, optional): Whether to print debugging info
+
+    Returns:
+        tuple: (matches, group_nums, stats), where matches are Match objects covering the
+            whole roster (previous groups first, in their previous order), group_nums are
+            their group numbers (previous groups keep theirs) and stats counts the kept, new,
+            changed, removed and slotted students and the dissolved and newly formed groups,
+            and lists the partition columns missing from the previous output ("uncompared"),
+            changes to which can't be detected. The stats' "new_groups" are the last matches.
+    """
+    partition_cols = config.constraints["Partition"]
+    with open(previous_csv, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = [
+            col for col in (key, "group_num") if col not in (reader.fieldnames or [])
+        ]
+        if missing:
+            raise UserWarning(
+                f"The previous output '{previous_csv}' has no {' or '.join(missing)} column"
+                + " (use --key to identify students by another column)."
+            )
+        previous = list(reader)
+    if nodes and key not in nodes[0].props[0]:
+        raise UserWarning(
+            f"The roster has no column ID '{key}' to identify students by across runs"
+            + " (use --key to pick another column)."
+        )
+    by_key = {row[key]: row for row in previous}
+
+    # Find students who are new or whose partition answers changed (as far as the previous
+    # output's columns tell); everybody else keeps their previous group.
+    compared = [col for col in partition_cols if previous and col in previous[0]]
+    delta, changed, kept, group_of = [], set(), {}, {}
+    for node in nodes:
+        props = node.props[0]
+        row = by_key.get(str(props[key]))
+        if row is None:
+            delta.append(node)
+        elif any(
+            str("" if props.get(col) is None else props.get(col)) != row.get(col, "")
+            for col in compared
+        ):
+            delta.append(node)
+            changed.add(row[key])
+        else:
+            kept.setdefault(row["group_num"], []).append(node)
+            group_of[id(props)] = row["group_num"]
+    num_kept = sum(len(group) for group in kept.values())
+
+    # Rebuild the previous groups that still have members along with their partition paths.
+    rows_of = {}
+    for row in previous:
+        rows_of.setdefault(row["group_num"], []).append(row)
+    groups, paths = {}, {}
+    for group_num, rows in rows_of.items():
+        if group_num not in kept:
+            continue
+        if "path" in rows[0]:
+            cell = rows[0]["path"]
+            path = previous_path(cell)
+            match = Match(
+                Node.combine(kept[group_num]),
+                source="path" if path is not None else "existing",
+                path=path,
+            )
+            paths[group_num] = parse_path(cell)
+        else:
+            kept_keys = {str(node.props[0][key]) for node in kept[group_num]}
+            path = common_path(
+                partition_cols, [row for row in rows if row[key] in kept_keys]
+            )
+            match = Match(Node.combine(kept[group_num]), path=path)
+            paths[group_num] = path
+        groups[group_num] = match
+
+    # Dissolve groups left too small by students leaving them, to slot their members in again
+    # along with the new and changed students.
+    dissolved = [
+        group_num
+        for group_num, match in groups.items()
+        if match.source != "existing"
+        and match.node.size < config.min_group_size
+        and len(kept[group_num]) < len(rows_of[group_num])
+    ]
+    pool = []
+    for group_num in dissolved:
+        del groups[group_num]
+        pool.extend(kept[group_num])
+    pool.extend(delta)
+
+    # Group students asking to be grouped with others (and connected to the pool) as a full
+    # run would, and move those connected to a student who kept their group into that group.
+    new_existing = []
+    if "Existing" in config.constraints:
+        flag_key = config.constraints["Existing"]["flag"]
+        flagged = [node for node in nodes if node.props[0][flag_key] and node.size == 1]
+        flagged = connected_flagged(config, flagged, pool)
+        in_pool = {id(node.props[0]): node for node in pool}
+        for match in existing_groups.handle_existing(
+            config, list(flagged), debug=debug
+        ):
+            joining = [
+                in_pool[id(prop)] for prop in match.node.props if id(prop) in in_pool
+            ]
+            if not joining:
+                continue
+            home = next(
+                (
+                    group_of[id(prop)]
+                    for prop in match.node.props
+                    if group_of.get(id(prop)) in groups
+                ),
+                None,
+            )
+            if home is None:
+                new_existing.append(Match(Node.combine(joining), source="existing"))
+            else:
+                for node in joining:
+                    groups[home].node.merge(node)
+        joined = {id(node) for node in flagged}
+        pool = [node for node in pool if id(node) not in joined]
+
+    # Slot each remaining student into the most specific compatible group with room,
+    # preferring smaller groups among equally specific ones.
+    open_groups = [g for g in groups if paths[g] is not None]
+
+    def slot(node: Node) -> bool:
+        best = None
+        for group_num in open_groups:
+            size = groups[group_num].node.size
+            if size + node.size > config.max_group_size or not is_compatible(
+                node, paths[group_num]
+            ):
+                continue
+            rank = (-len(paths[group_num]), size)
+            if best is None or rank < best[0]:
+                best = (rank, group_num)
+        if best is None:
+            return False
+        groups[best[1]].node.merge(node)
+        return True
+
+    leftover = [node for node in pool if not slot(node)]
+    num_slotted = len(pool) - len(leftover)
+
+    # Match whoever is left over amongst themselves into brand new groups, folding any that
+    # come out too small (from too few leftover students) into compatible groups instead.
+    new_matches = []
+    if leftover:
+        subgroups = partitioning.run_multi_partitioning(config, leftover, debug=debug)
+        if config.postprocess_partitions:
+            subgroups = config.postprocess_partitions(subgroups)
+        for match in best_effort.run_best_effort(config, subgroups):
+            if match.node.size < config.min_group_size:
+                unslotted = [
+                    prop for prop in match.node.props if not slot(Node([prop]))
+                ]
+                num_slotted += match.node.size - len(unslotted)
+                if not unslotted:
+                    continue
+                match = Match(Node(unslotted, size=len(unslotted)), path=match.path)
+            new_matches.append(match)
+
+    next_group_num = 1 + max((int(row["group_num"]) for row in previous), default=-1)
+    matches = list(groups.values()) + new_existing + new_matches
+    group_nums = [int(group_num) for group_num in groups] + list(
+        range(next_group_num, next_group_num + len(new_existing) + len(new_matches))
+    )
+
+    stats = {
+        "kept": num_kept,
+        "new": len(delta) - len(changed),
+        "changed": len(changed),
+        "removed": len(by_key) - num_kept - len(changed),
+        "slotted": num_slotted,
+        "dissolved": len(dissolved),
+        "new_groups": len(new_existing) + len(new_matches),
+        "uncompared": [col for col in partition_cols if col not in compared],
+    }
+    return matches, group_nums, stats
@@ -0,0 +1,157 @@
+import contextlib
+import json
+import time
+import tracemalloc
+
+"""
+Lightweight instrumentation for the matching pipeline.
+
+Pipeline code marks its stages with `with instrumentation.stage("name"):` and bumps counters
+with `instrumentation.count("name", n)`. Both are no-ops until a Profiler is activated with
+enable(), so the hooks cost next to nothing on normal runs. Stages nest, and each one records
+wall time, CPU time, the peak RSS high-water mark (on Unix, the only platforms that report it)
+and (optionally, since tracing allocations distorts the timings) its tracemalloc peak.
+
+Reports are plain JSON, and can also be written in the collapsed-stack format understood by
+flamegraph.pl, speedscope and friends (one "outer;inner self-microseconds" line per stage).
+"""
+
+
+class Profiler(object):
+    def __init__(self, trace_memory: bool = False):
+        """
+        Create a profiler.
+
+        Args:
+            trace_memory (bool, optional): Whether to track per-stage peak Python memory usage
+                with tracemalloc (which slows everything down noticeably)
+        """
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.counters = {}
+        self._stack = []
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        parent = self._stack[-1] if self._stack else None
+        entry = {
+            "name": name,
+            "path": (parent["path"] + ";" if parent else "") + name,
+            "depth": len(self._stack),
+            "children_seconds": 0.0,
+        }
+        if self.trace_memory:
+            # Fold the peak so far into the parent before resetting it for this stage.
+            if parent:
+                parent["_peak"] = max(
+                    parent["_peak"], tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.reset_peak()
+            entry["_start_memory"] = tracemalloc.get_traced_memory()[0]
+            entry["_peak"] = 0
+        self.stages.append(entry)
+        self._stack.append(entry)
+        start_rss = max_rss_kb()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            entry["wall_seconds"] = time.perf_counter() - start_wall
+            entry["cpu_seconds"] = time.process_time() - start_cpu
+            entry["max_rss_kb"] = max_rss_kb()
+            if start_rss is not None:
+                entry["max_rss_growth_kb"] = entry["max_rss_kb"] - start_rss
+            if self.trace_memory:
+                peak = max(entry.pop("_peak"), tracemalloc.get_traced_memory()[1])
+                entry["peak_traced_bytes"] = peak - entry.pop("_start_memory")
+                if parent:
+                    parent["_peak"] = max(parent["_peak"], peak)
+                tracemalloc.reset_peak()
+            self._stack.pop()
+            if parent:
+                parent["children_seconds"] += entry["wall_seconds"]
+
+    def count(self, name: str, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        return {
+            "total_seconds": time.perf_counter() - self._start,
+            "stages": [
+                {k: v for k, v in stage.items() if not k.startswith("_")}
+                for stage in self.stages
+                if "wall_seconds" in stage
+            ],
+            "counters": dict(self.counters),
+        }
+
+    def collapsed_stacks(self) -> list:
+        # Flame graphs expect self time, i.e. each stage's time minus its children's.
+        lines = []
+        for stage in self.report()["stages"]:
+            self_time = stage["wall_seconds"] - stage["children_seconds"]
+            lines.append(f"{stage['path']} {max(0, round(self_time * 1e6))}")
+        return lines
+
+    def write(self, json_path: str, collapsed_path: str = None):
+        with open(json_path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        if collapsed_path:
+            with open(collapsed_path, "w") as f:
+                f.write("\n".join(self.collapsed_stacks()) + "\n")
+
+    def summary(self) -> str:
+        lines = []
+        for stage in self.report()["stages"]:
+            memory = ""
+            if "peak_traced_bytes" in stage:
+                memory = f", peak {stage['peak_traced_bytes'] / 2 ** 20:.1f} MiB"
+            lines.append(
+                f"{'  ' * stage['depth']}{stage['name']}: {1000 * stage['wall_seconds']:.0f} ms"
+                + f" wall, {1000 * stage['cpu_seconds']:.0f} ms CPU{memory}"
+            )
+        lines.extend(f"{name}: {value}" for name, value in self.counters.items())
+        return "\n".join(lines)
+
+
+def max_rss_kb() -> int:
+    # ru_maxrss is reported in kilobytes on Linux (and bytes on macOS). The resource module
+    # only exists on Unix, so there's no peak RSS to report elsewhere (e.g. on Windows).
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+_active = None
+
+
+def enable(trace_memory: bool = False) -> Profiler:
+    """
+    Start collecting stages and counters into a new, process-wide Profiler and return it.
+    """
+    global _active
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _active = Profiler(trace_memory=trace_memory)
+    return _active
+
+
+def disable():
+    global _active
+    if _active and _active.trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _active = None
+
+
+def stage(name: str):
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name)
+
+
+def count(name: str, value=1):
+    if _active is not None:
+        _active.count(name, value)
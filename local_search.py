@@ -0,0 +1,237 @@
+from models import *
+import math
+import time
+
+"""
+Objective-driven local search over the groups formed within a single partition subgroup.
+
+The objective is computed from the "Best-effort" constraint, which lists feature column IDs
+followed by their weights (e.g. [["gender", "race"], [1, 1]]). For every group and every
+feature, each value held by exactly one member of the group counts as an isolated member and
+costs that feature's weight, so lower scores mean fewer students who are the only one of
+their gender, race, etc. in their group. Students with no value for a feature are ignored, and
+checkbox (list) values count as a single value (the exact combination of checked boxes).
+
+Scores are maintained incrementally: the objective keeps per-group value counters so the
+change in score for moving or swapping members only touches the values those members hold.
+"""
+
+# Default iteration budget per node, which best-effort matching's CONSTRAINTS["Search"]
+# "iterations" setting also defaults to.
+ITERATIONS_PER_NODE = 100
+
+
+class GroupObjective(object):
+    def __init__(self, features: list, weights: list, groups: list):
+        """
+        Set up incremental scoring for the given groups.
+
+        Args:
+            features (list): Feature column IDs to score on
+            weights (list): Weight for each feature (parallel to features)
+            groups (list): List of groups, each a list of Node objects
+        """
+        self.features = features
+        self.weights = weights
+        self.nodes = [node for group in groups for node in group]
+        self.group_of = []
+        self.members = []
+        self.sizes = []
+        self.counts = []
+        for g, group in enumerate(groups):
+            self.members.append(
+                list(range(len(self.group_of), len(self.group_of) + len(group)))
+            )
+            self.group_of.extend(g for _ in group)
+            self.sizes.append(sum(node.size for node in group))
+            self.counts.append([{} for _ in features])
+
+        # Pre-compute each node's (feature, value, count) contributions once.
+        self.contributions = []
+        for i, node in enumerate(self.nodes):
+            contribution = {}
+            for f, col in enumerate(features):
+                for prop in node.props:
+                    value = prop.get(col)
+                    if isinstance(value, list):
+                        value = tuple(value)
+                    if value is not None:
+                        contribution[(f, value)] = contribution.get((f, value), 0) + 1
+            self.contributions.append(contribution)
+            for (f, value), count in contribution.items():
+                counts = self.counts[self.group_of[i]][f]
+                counts[value] = counts.get(value, 0) + count
+
+        self.score = sum(self.group_score(g) for g in range(len(groups)))
+
+    def group_score(self, g: int) -> float:
+        return sum(
+            weight * sum(1 for count in counts.values() if count == 1)
+            for weight, counts in zip(self.weights, self.counts[g])
+        )
+
+    def _delta(self, g: int, changes: dict) -> float:
+        # Score change for group g when each (feature, value) count shifts by the given amount.
+        delta = 0
+        for (f, value), change in changes.items():
+            if not change:
+                continue
+            before = self.counts[g][f].get(value, 0)
+            delta += self.weights[f] * ((before + change == 1) - (before == 1))
+        return delta
+
+    def _apply(self, g: int, changes: dict):
+        for (f, value), change in changes.items():
+            counts = self.counts[g][f]
+            counts[value] = counts.get(value, 0) + change
+            if not counts[value]:
+                del counts[value]
+
+    def _changes(self, leaving: list, joining: list) -> dict:
+        changes = {}
+        for i in leaving:
+            for key, count in self.contributions[i].items():
+                changes[key] = changes.get(key, 0) - count
+        for i in joining:
+            for key, count in self.contributions[i].items():
+                changes[key] = changes.get(key, 0) + count
+        return changes
+
+    def delta_move(self, i: int, h: int) -> float:
+        """
+        Score change from moving node i into group h.
+        """
+        g = self.group_of[i]
+        return self._delta(g, self._changes([i], [])) + self._delta(
+            h, self._changes([], [i])
+        )
+
+    def delta_swap(self, i: int, j: int) -> float:
+        """
+        Score change from swapping nodes i and j between their groups.
+        """
+        g, h = self.group_of[i], self.group_of[j]
+        return self._delta(g, self._changes([i], [j])) + self._delta(
+            h, self._changes([j], [i])
+        )
+
+    def move(self, i: int, h: int, delta: float):
+        g = self.group_of[i]
+        self._apply(g, self._changes([i], []))
+        self._apply(h, self._changes([], [i]))
+        self.sizes[g] -= self.nodes[i].size
+        self.sizes[h] += self.nodes[i].size
+        self.members[g].remove(i)
+        self.members[h].append(i)
+        self.group_of[i] = h
+        self.score += delta
+
+    def swap(self, i: int, j: int, delta: float):
+        g, h = self.group_of[i], self.group_of[j]
+        self._apply(g, self._changes([i], [j]))
+        self._apply(h, self._changes([j], [i]))
+        size_change = self.nodes[j].size - self.nodes[i].size
+        self.sizes[g] += size_change
+        self.sizes[h] -= size_change
+        self.members[g][self.members[g].index(i)] = j
+        self.members[h][self.members[h].index(j)] = i
+        self.group_of[i], self.group_of[j] = h, g
+        self.score += delta
+
+    def groups(self, group_of: list = None) -> list:
+        """
+        Materialize the current (or the given) assignment as lists of Node objects, dropping
+        any groups that have been emptied.
+        """
+        group_of = group_of if group_of is not None else self.group_of
+        out = [[] for _ in self.sizes]
+        for i, g in enumerate(group_of):
+            out[g].append(self.nodes[i])
+        return [group for group in out if group]
+
+
+def local_search(
+    objective: GroupObjective,
+    lo: int,
+    hi: int,
+    rng,
+    time_limit: float = None,
+    max_iterations: int = None,
+    temperature: float = 1.0,
+    stats: dict = None,
+) -> list:
+    """
+    Improve the objective with simulated annealing over move and swap neighborhoods, keeping
+    every touched group's size within [lo, hi].
+
+    Args:
+        objective (GroupObjective): Incremental objective holding the starting assignment
+        lo (int): Minimum group size
+        hi (int): Maximum group size
+        rng (random.Random): Random number generator to draw moves from
+        time_limit (float, optional): Wall-clock budget in seconds, on top of the iteration
+            budget (none by default, as stopping on the clock makes results depend on
+            machine load)
+        max_iterations (int, optional): Iteration budget (defaults to ITERATIONS_PER_NODE
+            per node)
+        temperature (float, optional): Starting annealing temperature (decays to ~1% of it)
+        stats (dict, optional): If given, "search_iterations" and "search_accepted" counters
+            are added to it
+
+    Returns:
+        list: The best assignment found, as lists of Node objects
+    """
+    num_nodes, num_groups = len(objective.nodes), len(objective.sizes)
+    if num_groups < 2 or not objective.score:
+        return objective.groups()
+    if max_iterations is None:
+        max_iterations = ITERATIONS_PER_NODE * num_nodes
+
+    best_score, best_group_of = objective.score, list(objective.group_of)
+    deadline = time.time() + time_limit if time_limit is not None else None
+    cooling = 0.01 ** (1 / max_iterations)
+    sizes, nodes, group_of = objective.sizes, objective.nodes, objective.group_of
+    iteration, accepted = 0, 0
+    while iteration < max_iterations and best_score > 0:
+        # Checking the clock is comparatively expensive, so only do it every so often.
+        if deadline is not None and not iteration % 256 and time.time() > deadline:
+            break
+        iteration += 1
+        temperature *= cooling
+
+        i = rng.randrange(num_nodes)
+        g = group_of[i]
+        h = rng.randrange(num_groups - 1)
+        h += h >= g
+        if rng.random() < 0.5:
+            # Move neighborhood: node i changes groups if both groups stay within bounds.
+            size = nodes[i].size
+            if not (lo <= sizes[g] - size and sizes[h] + size <= hi):
+                continue
+            delta = objective.delta_move(i, h)
+            if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+                objective.move(i, h, delta)
+                accepted += 1
+        else:
+            # Swap neighborhood: node i trades places with a random member of group h.
+            if not objective.members[h]:
+                continue
+            j = rng.choice(objective.members[h])
+            size_change = nodes[j].size - nodes[i].size
+            if not (
+                lo <= sizes[g] + size_change <= hi
+                and lo <= sizes[h] - size_change <= hi
+            ):
+                continue
+            delta = objective.delta_swap(i, j)
+            if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+                objective.swap(i, j, delta)
+                accepted += 1
+
+        if objective.score < best_score:
+            best_score, best_group_of = objective.score, list(group_of)
+
+    if stats is not None:
+        stats["search_iterations"] = stats.get("search_iterations", 0) + iteration
+        stats["search_accepted"] = stats.get("search_accepted", 0) + accepted
+    return objective.groups(best_group_of)
@@ -1,3 +1,14 @@
+import sys
+
+
+def always_valid(arg):
+    return True
+
+
+def identity(arg):
+    return arg
+
+
 class Column(object):
     def __init__(
         self,
@@ -5,8 +16,8 @@ class Column(object):
         col_id: str,
         col_type: str,
         is_optional: bool = False,
-        validator=lambda x: True,
-        transformer=lambda x: x,
+        validator=always_valid,
+        transformer=identity,
     ):
         """
         Create a column configuration object with the given parameters.
@@ -69,12 +80,56 @@ class Configuration(object):
 
 
 class Node(object):
+    __slots__ = ("props", "size", "assigned", "rows")
+
     def __init__(
-        self, props: list, size: int = 1, assigned: bool = False
+        self, props: list, size: int = 1, assigned: bool = False, rows: list = None
     ):
         self.props = props
         self.size = size
         self.assigned = assigned
+        self.rows = rows  # optional row indices into a StudentTable, parallel to props
+
+    @classmethod
+    def combine(cls, nodes: list, assigned: bool = True):
+        """
+        Combine the given nodes into a single new node in time linear in their total size
+        (instead of repeatedly concatenating props lists).
+        """
+        rows = None
+        if all(node.rows is not None for node in nodes):
+            rows = [row for node in nodes for row in node.rows]
+        return cls(
+            [prop for node in nodes for prop in node.props],
+            size=sum(node.size for node in nodes),
+            assigned=assigned,
+            rows=rows,
+        )
+
+    def merge(self, other_node):
+        """
+        Merge another node into this one in place, without copying this node's members.
+        """
+        self.props.extend(other_node.props)
+        self.size += other_node.size
+        self.assigned = self.assigned or other_node.assigned
+        if self.rows is not None and other_node.rows is not None:
+            self.rows.extend(other_node.rows)
+        else:
+            self.rows = None
+
+    def memory_footprint(self, deep: bool = False) -> int:
+        """
+        Approximate memory used by this node in bytes: the node itself plus its props and
+        rows lists, and (if deep) the props dicts as well, which are usually shared with the
+        rest of the pipeline.
+        """
+        total = sys.getsizeof(self) + sys.getsizeof(self.props)
+        if self.rows is not None:
+            total += sys.getsizeof(self.rows)
+        if deep:
+            total += sum(sys.getsizeof(prop) for prop in self.props)
+        return total
 
     def to_json(self, group_num=-1):
         return [{"group_num": group_num, **prop} for prop in self.props]
@@ -84,6 +139,9 @@ class Node(object):
             self.props + other_node.props,
             self.size + other_node.size,
             self.assigned or other_node.assigned,
+            rows=self.rows + other_node.rows
+            if self.rows is not None and other_node.rows is not None
+            else None,
         )
 
     def __str__(self):
@@ -94,6 +152,8 @@ class Node(object):
 
 
 class Match(object):
+    __slots__ = ("node", "source", "path")
+
     def __init__(self, node: Node, source="path", path=None):
         """
         Initialize a Match object with the given node and (optionally) source and path.
@@ -116,14 +176,15 @@ class Match(object):
         return self.node.size
 
     @size.setter
-    def set_size(self, new_size):
+    def size(self, new_size):
         assert new_size >= 0, "New size should be non-negative"
         self.node.size = new_size
 
     def merge_with(self, other_match):
-        self.size += other_match.size
-        self.node.size += other_match.node.size
-        self.node.props.extend(other_match.node.props)
+        self.node.merge(other_match.node)
+
+    def memory_footprint(self, deep: bool = False) -> int:
+        return sys.getsizeof(self) + self.node.memory_footprint(deep=deep)
 
     def __add__(self, other_match):
         return Match(
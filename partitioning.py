@@ -1,23 +1,55 @@
 from models import *
+import heapq
+import instrumentation
 
 
 def run_multi_partitioning(
-    config: Configuration, nodes: list, debug: bool = False
+    config: Configuration,
+    nodes: list,
+    debug: bool = False,
+    table=None,
+    report: dict = None,
 ) -> list:
-    col_set = [(x, dict()) for x in config.constraints["Partition"]]
-    for node in nodes:
-        for col, seen in col_set:
-            prop_values = node.props[0][col]
-            if isinstance(prop_values, list):
-                for val in prop_values:
-                    seen[val] = True
-            else:
-                seen[prop_values] = True
-    col_set = [(col, list(seen.keys())) for col, seen in col_set]
-    provisional = []
-    dfs(config, nodes, col_set, provisional)
-    tentative = uniquify_assignments(config, provisional)
-    finalized = bottom_up_merge(config, tentative)
+    partition_cols = config.constraints["Partition"]
+    with instrumentation.stage("build_partition_index"):
+        col_set, index = build_partition_index(partition_cols, nodes, table=table)
+
+    # Plan the partition column order if asked to (or just estimate the configured order's
+    # branches, if a report was asked for).
+    plan = None
+    tiers = config.constraints.get("Plan", False)
+    if tiers or report is not None:
+        import planner
+
+        with instrumentation.stage("plan_partition"):
+            stats = planner.gather_statistics(partition_cols, nodes, index)
+            plan = planner.plan_partition(
+                partition_cols, stats, config.min_partition_size, tiers=tiers
+            )
+        values = dict(col_set)
+        col_set = [(col, values[col]) for col in plan["order"]]
+
+    with instrumentation.stage("dfs"):
+        provisional = []
+        branch_counts = [0] * len(col_set)
+        dfs(
+            config,
+            nodes,
+            col_set,
+            provisional,
+            index=index,
+            branch_counts=branch_counts,
+        )
+    if plan:
+        plan["actual"] = branch_counts
+        if report is not None:
+            report["plan"] = plan
+    with instrumentation.stage("uniquify_assignments"):
+        tentative = uniquify_assignments(config, provisional)
+    with instrumentation.stage("bottom_up_merge"):
+        finalized = bottom_up_merge(config, tentative)
+    instrumentation.count("provisional_groups", len(provisional))
+    instrumentation.count("tentative_groups", len(tentative))
     return finalized
 
 
@@ -25,6 +57,41 @@ def list_elements_equal(a: list, b: list) -> bool:
     return len(a) == len(b) and all(a[i] == b[i] for i in range(len(a)))
 
 
+def build_partition_index(partition_cols: list, nodes: list, table=None) -> tuple:
+    """
+    Build an inverted index over the partition columns in a single pass over the nodes.
+
+    Args:
+        partition_cols (list): Column IDs to partition on, in partition order
+        nodes (list): Node objects to index (positions in this list are used as node indices)
+        table (StudentTable, optional): Columnar roster to build the index from with vectorized
+            column scans instead of per-node props lookups, if it holds every partition column
+
+    Returns:
+        tuple: (col_set, index), where col_set is a list of (col, values) pairs with values in
+            first-seen order and index maps each column to a dict of value -> set of node indices
+            whose column either is equal to or contains that value
+    """
+    if table is not None and all(col in table for col in partition_cols):
+        rows = table.first_rows(nodes)
+        index = {col: table.postings(col, rows) for col in partition_cols}
+        col_set = [(col, list(index[col].keys())) for col in partition_cols]
+        return col_set, index
+
+    index = {col: {} for col in partition_cols}
+    for i, node in enumerate(nodes):
+        for col in partition_cols:
+            postings = index[col]
+            prop_values = node.props[0][col]
+            if isinstance(prop_values, list):
+                for val in prop_values:
+                    postings.setdefault(val, set()).add(i)
+            else:
+                postings.setdefault(prop_values, set()).add(i)
+    col_set = [(col, list(index[col].keys())) for col in partition_cols]
+    return col_set, index
+
+
 # Phase 1 of multi-partitioning: forming provisional groups using partition criteria.
 def dfs(
     config: Configuration,
@@ -34,61 +101,68 @@ def dfs(
     path: tuple = (),
     level: int = 0,
     debug: bool = False,
+    index: dict = None,
+    candidates: set = None,
+    branch_counts: list = None,
 ):
-    # Compute the current group size
-    current_group_size = sum(x.size for x in nodes)
-
-    # Base case: stop recursing if we have reached the bottom of the partition tree or if our
-    # current group size is smaller than the minimum partition size (e.g. 4 students)
-    if level >= len(col_set) or current_group_size < config.min_partition_size:
-        output.append((path, level, list(nodes), current_group_size))
-        return
-
-    # This helper function curries a value into a nested function, and that
-    # nested function checks if a given node either is equal to the curried
-    # value or contains the curried value
-    def filter_helper(value):
-        def check_filtering(node: Node):
-            # Exclude this node if it's already been assigned somewhere.
-            if node.assigned:
-                return False
-
-            # Return true if the current node column contains the curried value
-            # or is equal to it
-            prop_values = node.props[0][col]
-            if isinstance(prop_values, list):
-                return value in prop_values
-            else:
-                return value == prop_values
+    # Build the inverted index on the first call if the caller didn't supply one, and start
+    # off with every node that hasn't already been assigned somewhere as a candidate.
+    if index is None:
+        _, index = build_partition_index([col for col, _ in col_set], nodes)
+    if candidates is None:
+        candidates = {i for i, node in enumerate(nodes) if not node.assigned}
+    ranks = [{val: r for r, val in enumerate(seen)} for _, seen in col_set]
+    sizes = [node.size for node in nodes]
+    unit_sizes = all(size == 1 for size in sizes)
 
-        return check_filtering
+    # The current path is shared by every branch below it, so it's kept as a single stack
+    # that's only copied when a branch becomes a provisional group.
+    prefix = list(path)
 
-    # Figure out which column we are on and extract the set of all possible values in that column
-    col, seen = col_set[level]
+    def branch(level: int, members: set, group_size: int):
+        if branch_counts is not None and level > 0:
+            branch_counts[level - 1] += 1
 
-    # Loop over all possible values of the current column
-    for val in seen:
-        # Filter current nodes and isolate elements which either include or contain val
-        filtered_vals = list(filter(filter_helper(val), nodes))
-        if not filtered_vals:
-            continue
+        # Base case: stop recursing if we have reached the bottom of the partition tree or if
+        # our current group size is smaller than the minimum partition size (e.g. 4 students),
+        # which cuts off everything below an undersized branch at once.
+        if level >= len(col_set) or group_size < config.min_partition_size:
+            output.append(
+                (tuple(prefix), level, [nodes[i] for i in sorted(members)], group_size)
+            )
+            return
 
-        # Set up our output array and new path tuple for recursive DFS call
-        children_output = []
-        new_path = tuple(list(path) + [(col, val)])
+        # Figure out which column we are on and which of its values to branch on: when the
+        # branch has fewer members than the column has values, only the values its members
+        # actually hold (in first-seen order) rather than every value ever seen in it.
+        col, seen = col_set[level]
+        postings = index[col]
+        if len(members) < len(seen):
+            present = set()
+            for i in members:
+                prop_values = nodes[i].props[0][col]
+                if isinstance(prop_values, list):
+                    present.update(prop_values)
+                else:
+                    present.add(prop_values)
+            seen = sorted(present, key=ranks[level].__getitem__)
 
-        # Recursively call DFS
-        dfs(
-            config,
-            filtered_vals,
-            col_set,
-            children_output,
-            new_path,
-            level + 1,
-            debug=debug,
-        )
+        for val in seen:
+            # Narrow the current members down to the nodes which either include or contain
+            # val by intersecting with that value's posting list.
+            filtered = members & postings[val]
+            if not filtered:
+                continue
+            if unit_sizes:
+                filtered_size = len(filtered)
+            else:
+                filtered_size = sum(sizes[i] for i in filtered)
 
-        output.extend(children_output)
+            prefix.append((col, val))
+            branch(level + 1, filtered, filtered_size)
+            prefix.pop()
+
+    branch(level, candidates, sum(sizes[i] for i in candidates))
 
 
 # Phase 2 of multi-partitioning: forming tentative group assignments that do not have
@@ -97,48 +171,90 @@ def uniquify_assignments(
     config: Configuration, groups: list, debug: bool = False
 ) -> list:
     output = []
-    phase_counter = 0
     phase_min_cutoffs = [config.min_group_size, config.min_group_size // 2, 1]
     phase_max_cutoffs = [config.max_group_size, config.max_group_size * 3, float("inf")]
-    while True:
-        min_so_far = float("inf")
-        groups = [group for group in groups if group[2]]
-        selected_group = None
-        for group in groups:
-            for i in range(len(group[2]) - 1, -1, -1):
-                node = group[2][i]
-                if node.assigned:
-                    del group[2][i]
-
-            min_group_size = phase_min_cutoffs[phase_counter]
-            max_group_size = phase_max_cutoffs[phase_counter]
-            group_count = sum(x.size for x in group[2])
-            if (
-                group_count < min_so_far
-                and min_group_size <= group_count <= max_group_size
-            ):
-                min_so_far = group_count
-                selected_group = group
-
-        if not selected_group:
-            if phase_counter == len(phase_min_cutoffs):
-                break
-            else:
-                phase_counter += 1
-                continue
 
-        for elem in selected_group[2]:
-            elem.assigned = True
+    # Track each group's live size (the total size of its not-yet-assigned nodes) along with
+    # which groups every node belongs to, so that assigning a node only touches its own groups.
+    live_sizes = []
+    node_groups = {}
+    for i, group in enumerate(groups):
+        live_sizes.append(sum(node.size for node in group[2] if not node.assigned))
+        for node in group[2]:
+            node_groups.setdefault(id(node), []).append(i)
+    selected = [False] * len(groups)
+
+    for min_group_size, max_group_size in zip(phase_min_cutoffs, phase_max_cutoffs):
+        # Each phase repeatedly picks the smallest live group within its size cutoffs (ties
+        # broken by original order). Live sizes only ever shrink, so heap entries with an
+        # outdated size are simply skipped, and groups that drop below the minimum can't be
+        # picked again until the next phase.
+        heap = [
+            (size, i)
+            for i, size in enumerate(live_sizes)
+            if size and not selected[i]
+        ]
+        heapq.heapify(heap)
+        while heap:
+            size, i = heap[0]
+            if selected[i] or size != live_sizes[i] or size < min_group_size:
+                heapq.heappop(heap)
+                continue
+            if size > max_group_size:
+                break
+            heapq.heappop(heap)
 
-        groups.remove(selected_group)
-        selected_group = list(selected_group)
-        selected_group[3] = sum(node.size for node in selected_group[2])
-        selected_group = tuple(selected_group)
-        output.append(selected_group)
+            # Assign every live node in the selected group and shrink the other groups
+            # they belong to.
+            selected[i] = True
+            nodes = [node for node in groups[i][2] if not node.assigned]
+            for node in nodes:
+                node.assigned = True
+                for j in node_groups[id(node)]:
+                    if j != i and not selected[j]:
+                        live_sizes[j] -= node.size
+                        if live_sizes[j]:
+                            heapq.heappush(heap, (live_sizes[j], j))
+            output.append((groups[i][0], groups[i][1], nodes, size))
 
     return output
 
 
+class PathTrie(object):
+    def __init__(self, parent=None):
+        """
+        Trie over partition paths, keyed on (col, val) pairs, where every trie node tracks the
+        total size of the groups left in its subtree and a heap of those groups ordered by
+        (size, position) for finding the smallest ones. Removed groups are skipped lazily.
+        """
+        self.parent = parent
+        self.children = {}
+        self.total = 0
+        self.heap = []
+
+    def insert(self, path: tuple, size: int, position: int):
+        at = self
+        at.total += size
+        at.heap.append((size, position))
+        for step in path:
+            at = at.children.setdefault(step, PathTrie(at))
+            at.total += size
+            at.heap.append((size, position))
+        return at
+
+    def heapify(self):
+        heapq.heapify(self.heap)
+        for child in self.children.values():
+            child.heapify()
+
+    def remove(self, size: int):
+        # Update subtree totals from the group's own trie node up to the root.
+        at = self
+        while at:
+            at.total -= size
+            at = at.parent
+
+
 # Phase 3 of multi-partitioning: finalizing group compositions to avoid group
 # size violations (by merging groups up the partition tree in order of edge-hop
 # distance).
@@ -147,10 +263,24 @@ def bottom_up_merge(config: Configuration, groups: list, debug: bool = False) ->
     merged_groups = []
     groups = sorted(groups, key=lambda x: len(x[0]))
 
-    # Keep merging groups as necessary until none remain.
-    while groups:
-        # Pick off the group at the end (the one with the longest path).
-        at = groups.pop()
+    # Index the groups by partition path so that finding siblings, cousins, etc. is a local
+    # query on the trie instead of a scan over every remaining group.
+    trie = PathTrie()
+    trie_nodes = [trie.insert(group[0], group[3], i) for i, group in enumerate(groups)]
+    trie.heapify()
+    removed = [False] * len(groups)
+
+    def remove(i):
+        removed[i] = True
+        trie_nodes[i].remove(groups[i][3])
+
+    # Keep merging groups as necessary until none remain, picking off the group at the end
+    # (the one with the longest path) each time.
+    for i in range(len(groups) - 1, -1, -1):
+        if removed[i]:
+            continue
+        at = groups[i]
+        remove(i)
 
         # If group is big enough, no need to merge
         if at[3] > config.min_group_size or at[3] >= config.max_group_size:
@@ -160,45 +290,36 @@ def bottom_up_merge(config: Configuration, groups: list, debug: bool = False) ->
         # Otherwise, find siblings and/or ancestors and/or aunts, uncles, etc. etc. and merge
         # Keep going up a partition tree level (edge-hops) and looking for ancestors until we find
         # enough that we can merge them all and no longer violate the minimum group size
-        # criteria.
+        # criteria (without going all the way up to the root).
         at_path = at[0]
-        next_at_path = at[0]
-        num_ancestors = 0
+        at_node = trie_nodes[i]
         if debug:
             print("Looking for ancestors...", end=" ")
-        while num_ancestors + at[3] <= config.min_group_size:
-            at_path = next_at_path
-            ancestors = []
-            for group in groups:
-                if list_elements_equal(at_path, group[0][: len(at_path)]):
-                    ancestors.append(group)
-            num_ancestors = sum(group[3] for group in ancestors)
+        while True:
+            num_ancestors = at_node.total
             if debug:
                 print(at_path, num_ancestors)
-                print(list(x[0] for x in ancestors))
-            next_at_path = tuple(list(at_path)[:-1])
-            if not next_at_path:
+            if num_ancestors + at[3] > config.min_group_size or len(at_path) <= 1:
                 break
+            at_path = at_path[:-1]
+            at_node = at_node.parent
         if debug:
             print(f"found {num_ancestors} ancestors.")
 
         # If we are small but we found tons of ancestor groups, let's only merge as many as are needed as
-        # to form a group of sufficient size instead of just merging all of them.
-        ancestors = sorted(ancestors, key=lambda x: x[3])
-        num_needed = 0
-        while at[3] + sum(
-            x[3] for x in ancestors[:num_needed]
-        ) <= config.min_group_size and num_needed <= len(ancestors):
-            num_needed += 1
-        num_ancestors = sum(x[3] for x in ancestors[:num_needed])
+        # to form a group of sufficient size instead of just merging all of them (smallest first).
+        ancestors = []
+        num_ancestors = 0
+        while at_node.heap and at[3] + num_ancestors <= config.min_group_size:
+            size, j = heapq.heappop(at_node.heap)
+            if removed[j]:
+                continue
+            remove(j)
+            ancestors.append(groups[j])
+            num_ancestors += size
         if debug:
             print(f"Only need {num_ancestors} ancestors to merge")
 
-        # Remove the merged groups' separate entries
-        ancestors = ancestors[:num_needed]
-        for ancestor in ancestors:
-            groups.remove(ancestor)
-
         # Create a big merged group and add it to the output list
         merged_group = (
             at_path,
@@ -0,0 +1,191 @@
+import itertools
+
+"""
+Planner for the order in which multi-partitioning applies its partition columns.
+
+The partition tree's size (and with it the work done by DFS, winnowing and merging) depends
+heavily on column order: a high-cardinality checkbox column applied early multiplies the
+number of branches every later column has to split. The planner gathers per-column
+cardinality and fan-out (values per student) along with pairwise co-occurrence counts from
+the roster, estimates the number of branches at each level of the tree for a candidate order,
+and picks the order with the smallest estimated tree.
+
+Planning is opt-in, as reordering changes which criteria take priority: setting
+CONSTRAINTS["Plan"] to True lets the planner reorder every partition column, while a list of
+tiers (lists of column IDs, e.g. [["year"], ["meeting_days", "meeting_time"]]) keeps the
+tiers in the author's order and only reorders columns within each tier.
+"""
+
+# Tiers with up to this many columns are planned exhaustively, and larger ones greedily.
+MAX_EXHAUSTIVE_TIER = 7
+
+
+def gather_statistics(partition_cols: list, nodes: list, index: dict) -> dict:
+    """
+    Gather the statistics the planner's estimates are based on.
+
+    Args:
+        partition_cols (list): Partition column IDs
+        nodes (list): Node objects being partitioned
+        index (dict): Partition index (see partitioning.build_partition_index)
+
+    Returns:
+        dict: Number of nodes, per-column "cardinality" and "fanout" and per-column-pair
+            "pairs" (the number of distinct value pairs held by a single node)
+    """
+    num_nodes = max(1, len(nodes))
+    values = {col: [node.props[0][col] for node in nodes] for col in partition_cols}
+    is_checkbox = {
+        col: any(isinstance(x, list) for x in values[col]) for col in partition_cols
+    }
+
+    # Count the distinct value pairs held by a single node for every pair of columns, which
+    # is a plain set of pairs unless a checkbox column is involved. A missing answer to an
+    # optional checkbox column is a single None value, as the partition index has it.
+    pairs = {}
+    for a, b in itertools.combinations(partition_cols, 2):
+        if not is_checkbox[a] and not is_checkbox[b]:
+            combos = set(zip(values[a], values[b]))
+        else:
+            combos = set()
+            for a_values, b_values in zip(values[a], values[b]):
+                combos.update(
+                    itertools.product(
+                        a_values if isinstance(a_values, list) else [a_values],
+                        b_values if isinstance(b_values, list) else [b_values],
+                    )
+                )
+        pairs[(a, b)] = pairs[(b, a)] = len(combos)
+
+    return {
+        "num_nodes": len(nodes),
+        "cardinality": {col: len(index[col]) for col in partition_cols},
+        "fanout": {
+            col: sum(len(x) for x in index[col].values()) / num_nodes
+            for col in partition_cols
+        },
+        "pairs": pairs,
+    }
+
+
+def estimate_branches(order: list, stats: dict, min_partition_size: int) -> list:
+    """
+    Estimate the number of branches at each level of the partition tree for a column order.
+
+    Each level multiplies the previous level's branches by the average number of distinct
+    values of the new column seen alongside a value of the previous one (from co-occurrence
+    counts), capped by how many values a branch of the average size could possibly hold.
+    Branches smaller than the minimum partition size on average stop splitting.
+    """
+    estimates = []
+    paths, branches, previous = stats["num_nodes"], 1, None
+    for col in order:
+        # Students with several values in a column sit in several branches at once.
+        fanout = max(stats["fanout"][col], 1e-9)
+        if paths / branches < min_partition_size:
+            estimates.append(0)
+            continue
+        if previous is None:
+            growth = stats["cardinality"][col]
+        else:
+            growth = stats["pairs"][(previous, col)] / max(
+                1, stats["cardinality"][previous]
+            )
+        growth = min(growth, paths / branches * fanout)
+        paths *= fanout
+        branches = min(branches * max(growth, 1), paths)
+        estimates.append(branches)
+        previous = col
+    return estimates
+
+
+def plan_cost(estimates: list) -> float:
+    # Tree size, plus the deepest level again for the provisional groups merging works on.
+    return sum(estimates) + next((x for x in reversed(estimates) if x), 0)
+
+
+def plan_tier(tier: list, prefix: list, stats: dict, min_partition_size: int) -> list:
+    # Try every order of small tiers (keeping the author's order on ties) and build larger
+    # ones greedily, one column at a time.
+    if len(tier) <= MAX_EXHAUSTIVE_TIER:
+        return list(
+            min(
+                itertools.permutations(tier),
+                key=lambda order: plan_cost(
+                    estimate_branches(prefix + list(order), stats, min_partition_size)
+                ),
+            )
+        )
+    order, left = [], list(tier)
+    while left:
+        best = min(
+            left,
+            key=lambda col: plan_cost(
+                estimate_branches(prefix + order + [col], stats, min_partition_size)
+            ),
+        )
+        order.append(best)
+        left.remove(best)
+    return order
+
+
+def plan_partition(
+    partition_cols: list, stats: dict, min_partition_size: int, tiers=True
+) -> dict:
+    """
+    Pick a partition column order.
+
+    Args:
+        partition_cols (list): Partition column IDs, in the author's order
+        stats (dict): Statistics from gather_statistics
+        min_partition_size (int): Minimum partition size
+        tiers (bool or list, optional): True to reorder freely, False to keep the author's
+            order, or a list of tiers (lists of column IDs) to reorder within
+
+    Returns:
+        dict: The plan, with the chosen "order" and its "estimated" branches per level,
+            along with the author's order and its estimates for comparison
+    """
+    if tiers is True:
+        tiers = [list(partition_cols)]
+    elif not tiers:
+        tiers = [[col] for col in partition_cols]
+    assert sorted(col for tier in tiers for col in tier) == sorted(
+        partition_cols
+    ), "Partition plan tiers must list every partition column exactly once!"
+
+    order = []
+    for tier in tiers:
+        order.extend(plan_tier(tier, order, stats, min_partition_size))
+    return {
+        "order": order,
+        "estimated": estimate_branches(order, stats, min_partition_size),
+        "author_order": list(partition_cols),
+        "author_estimated": estimate_branches(
+            partition_cols, stats, min_partition_size
+        ),
+        "stats": stats,
+        "actual": None,
+    }
+
+
+def explain(plan: dict) -> str:
+    """
+    Render a plan (with actual branch counts, once partitioning has filled them in) as text.
+    """
+    stats = plan["stats"]
+    lines = [
+        f"{'level':>5}  {'column':<24}{'values':>8}{'fanout':>8}{'estimated':>11}{'actual':>8}"
+    ]
+    for level, col in enumerate(plan["order"]):
+        actual = plan["actual"][level] if plan["actual"] else "-"
+        lines.append(
+            f"{level + 1:>5}  {col:<24}{stats['cardinality'][col]:>8}"
+            + f"{stats['fanout'][col]:>8.2f}{round(plan['estimated'][level]):>11}{actual:>8}"
+        )
+    lines.append(
+        f"Estimated cost {plan_cost(plan['estimated']):.0f} in this order versus"
+        + f" {plan_cost(plan['author_estimated']):.0f} in the configured order"
+        + f" ({', '.join(plan['author_order'])})."
+    )
+    return "\n".join(lines)
@@ -0,0 +1,163 @@
+from models import *
+
+"""
+Rebalancing of matched groups so that nobody is the only member of their category in a group.
+
+Rules are declared in the configuration as CONSTRAINTS["Rebalance"], a list of [name, predicate]
+pairs where the predicate takes a student's props, e.g. [["female", is_female], ["black",
+is_black]]. Rules are applied in order: the groups with exactly one member of the rule's category
+are sorted largest first, and the isolated members of the larger half are moved into the smaller
+half, pairing them up. A member only moves into a group whose partition path they're on (so that
+the group keeps its path, and validation still checks it), and unlike the hand-written loops this
+replaces, moves that would take a group outside of [MIN_GROUP_SIZE, MAX_GROUP_SIZE] are skipped.
+Isolated members with nowhere to go are counted as unpaired. Student-requested groups are left
+alone.
+
+run.py applies the rules right after best-effort matching for configurations without
+post_processing. Configurations with post_processing apply them themselves with apply_rules,
+wherever in their post-processing they belong (e.g. after fixing up group sizes).
+
+Every predicate is evaluated once per student up front, giving each student a bitmask of their
+categories, and per-rule category -> group counters (along with the set of groups each rule
+finds an isolated member in) are kept up to date as members move, so applying every rule takes
+a single pass over the students plus a scan of the waiting receivers per move.
+"""
+
+
+def move_member(source: Match, target: Match, k: int):
+    # Move the k-th member of one group to the end of another, keeping row indices in step.
+    prop = source.node.props.pop(k)
+    row = source.node.rows.pop(k) if source.node.rows is not None else None
+    source.node.size -= 1
+    target.node.props.append(prop)
+    if target.node.rows is not None and row is not None:
+        target.node.rows.append(row)
+    else:
+        target.node.rows = None
+    target.node.size += 1
+
+
+def on_path(prop: dict, path) -> bool:
+    # Whether a student satisfies every (column, value) step of a partition path (paths that
+    # aren't partition paths, like "(manually fixed)", accept anyone).
+    if not isinstance(path, (tuple, list)):
+        return True
+    for step in path:
+        if isinstance(step, (tuple, list)) and len(step) == 2:
+            value = prop.get(step[0])
+            if not (step[1] in value if isinstance(value, list) else value == step[1]):
+                return False
+    return True
+
+
+def rebalance(config: Configuration, matches: list, report: dict = None) -> list:
+    """
+    Apply the configuration's CONSTRAINTS["Rebalance"] rules to matched groups in place.
+    """
+    return apply_rules(
+        matches,
+        config.constraints.get("Rebalance", []),
+        config.min_group_size,
+        config.max_group_size,
+        report=report,
+    )
+
+
+def apply_rules(
+    matches: list, rules: list, lo: int, hi: int, skip=None, report: dict = None
+) -> list:
+    """
+    Apply rebalancing rules to matched groups in place.
+
+    Args:
+        matches (list): Match objects
+        rules (list): [name, predicate] rules
+        lo (int): Minimum group size
+        hi (int): Maximum group size
+        skip (function, optional): Takes a Match and returns whether to leave it alone (on
+            top of student-requested groups, which always are)
+        report (dict, optional): Filled in with per-rule "isolated" (groups found with a single
+            member of the category), "moved" and "unpaired" counts
+
+    Returns:
+        list: The given Match objects
+    """
+    if report is None:
+        report = {}
+    groups = [
+        match
+        for match in matches
+        if match.source != "existing" and not (skip and skip(match))
+    ]
+
+    # Evaluate every predicate once per student, counting each category per group.
+    masks = {}
+    counts = [[0] * len(groups) for _ in rules]
+    bits = [(1 << r, rule[1]) for r, rule in enumerate(rules)]
+    for g, match in enumerate(groups):
+        for prop in match.node.props:
+            mask = 0
+            for bit, predicate in bits:
+                if predicate(prop):
+                    mask |= bit
+            masks[id(prop)] = mask
+            r = 0
+            while mask:
+                if mask & 1:
+                    counts[r][g] += 1
+                mask >>= 1
+                r += 1
+    isolated = [
+        {g for g, count in enumerate(rule_counts) if count == 1} for rule_counts in counts
+    ]
+
+    def recount(g: int, mask: int, delta: int):
+        # Update every counter a moved member's categories touch.
+        r = 0
+        while mask:
+            if mask & 1:
+                counts[r][g] += delta
+                if counts[r][g] == 1:
+                    isolated[r].add(g)
+                else:
+                    isolated[r].discard(g)
+            mask >>= 1
+            r += 1
+
+    for r, rule in enumerate(rules):
+        name = rule[0]
+
+        # Largest groups give up their isolated member to the first group in the smaller half
+        # (in size then match order) that they fit on the path of.
+        candidates = sorted(isolated[r], key=lambda g: (-groups[g].size, g))
+        half = len(candidates) // 2
+        receivers = candidates[half:]
+        moved = 0
+        for donor in candidates[:half]:
+            if groups[donor].size <= lo:
+                continue
+            props = groups[donor].node.props
+            k = next(k for k, prop in enumerate(props) if masks[id(prop)] >> r & 1)
+            receiver = next(
+                (
+                    g
+                    for g in receivers
+                    if groups[g].size < hi and on_path(props[k], groups[g].path)
+                ),
+                None,
+            )
+            if receiver is None:
+                continue
+            receivers.remove(receiver)
+            mask = masks[id(props[k])]
+            move_member(groups[donor], groups[receiver], k)
+            recount(donor, mask, -1)
+            recount(receiver, mask, 1)
+            moved += 1
+        report[name] = {
+            "isolated": len(candidates),
+            "moved": moved,
+            "unpaired": len(candidates) - 2 * moved,
+        }
+
+    return matches
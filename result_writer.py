@@ -0,0 +1,267 @@
+import contextlib
+import csv
+import json
+import os
+
+"""
+Streaming writer for matching results.
+
+Rows are generated straight from the matches (one list of values per student, in a fixed
+column order) and written as they're generated, to CSV or, with pyarrow installed, to Parquet
+or Arrow IPC files in record batches, without building a dict per student or a DataFrame of
+the whole output. CSV values are written as str() gives them, as the csv module does, so integer
+columns with missing values stay integers (3, where a DataFrame's to_csv writes 3.0), which is
+also what incremental matching compares previous outputs against. Output files are written to
+a temporary file alongside their destination and moved into place once complete, so they never
+appear half-written, and default output names are claimed with an exclusive create so that
+concurrent runs can't pick the same one.
+
+The optional index file maps each group to its members in JSON Lines, one group per line:
+{"group_num": 0, "size": 4, "source": "path", "path": "...", "rows": [0, 4], "members": [...]},
+where "rows" is the group's [start, stop) range of data rows in the output and "members" are
+its students' key column values.
+"""
+
+# File extension of each output format.
+FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+# Number of rows per record batch for Parquet and Arrow output.
+BATCH_ROWS = 10000
+
+
+def claim_output_path(stem: str = "out-private", ext: str = ".csv") -> str:
+    """
+    Claim the first free output path of the form STEM.EXT, STEM-2.EXT, STEM-3.EXT, ... by
+    creating it (empty) exclusively, so that no other run can claim the same one.
+    """
+    path, i = f"{stem}{ext}", 2
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            path = f"{stem}-{i}{ext}"
+            i += 1
+
+
+@contextlib.contextmanager
+def output_path(path: str = None, ext: str = ".csv", stem: str = "out-private"):
+    """
+    Use the given output path, or claim a fresh one (see claim_output_path) that is removed
+    again if writing to it fails rather than being left behind empty.
+    """
+    if path:
+        yield path
+        return
+    path = claim_output_path(stem=stem, ext=ext)
+    try:
+        yield path
+    except BaseException:
+        if os.path.isfile(path) and not os.path.getsize(path):
+            os.unlink(path)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_output(path: str):
+    # Hand out a temporary path next to the destination (created with the usual permissions,
+    # unlike tempfile's), replacing the destination with it only once it's been written
+    # successfully.
+    directory, name = os.path.split(os.path.abspath(path))
+    while True:
+        tmp_path = os.path.join(directory, f".{name}.{os.urandom(4).hex()}.tmp")
+        try:
+            os.close(os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            break
+        except FileExistsError:
+            continue
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def scan_columns(matches: list, kinds: dict = None) -> list:
+    """
+    List the output columns for the given matches: "group_num", then every props key in the
+    order first seen, with "path" after the first student's keys (the same order as a
+    DataFrame of {"group_num": ..., **props, "path": ...} rows).
+
+    Args:
+        matches (list): Match objects
+        kinds (dict, optional): Filled in with the set of value types seen in each props
+            column (and "group_num")
+
+    Returns:
+        list: Column names
+    """
+    columns = {"group_num": None}
+    for match in matches:
+        for prop in match.node.props:
+            if kinds is None:
+                for key in prop:
+                    if key not in columns:
+                        columns[key] = None
+            else:
+                for key, value in prop.items():
+                    if key not in columns:
+                        columns[key] = None
+                        kinds[key] = set()
+                    kinds[key].add(type(value))
+            columns.setdefault("path", None)
+    columns.setdefault("path", None)
+    if kinds is not None:
+        kinds["group_num"] = {int}
+    return list(columns)
+
+
+def match_rows(matches: list, columns: list, group_nums: list = None):
+    """
+    Generate one list of values per student, in the given column order (missing values are
+    None), group by group. Groups are numbered in order unless group numbers are given.
+    """
+    group_index, path_index = columns.index("group_num"), columns.index("path")
+    for group_num, match in zip(group_nums or range(len(matches)), matches):
+        for prop in match.node.props:
+            row = [prop.get(col) for col in columns]
+            row[group_index] = group_num
+            row[path_index] = match.path
+            yield row
+
+
+def write_table(path: str, columns: list, rows, fmt: str = "csv", kinds: dict = None):
+    """
+    Stream rows (lists of values in column order) to an output file.
+
+    Args:
+        path (str): Output path, replaced atomically once written
+        columns (list): Column names
+        rows (iterable): Rows of values
+        fmt (str, optional): One of FORMATS
+        kinds (dict, optional): Value types seen in each column (see scan_columns), which
+            Parquet and Arrow output need to pick column types; other columns, and columns
+            holding more than one type besides None, are written as strings
+
+    Returns:
+        int: Number of rows written
+    """
+    assert fmt in FORMATS, f"Only {', '.join(FORMATS)} output formats implemented!"
+    num_rows = 0
+    with atomic_output(path) as tmp_path:
+        if fmt == "csv":
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerow(columns)
+                for row in rows:
+                    writer.writerow(row)
+                    num_rows += 1
+        else:
+            num_rows = write_arrow(tmp_path, columns, rows, fmt, kinds or {})
+    return num_rows
+
+
+def require_pyarrow(fmt: str):
+    # Parquet and Arrow output are optional, so only import pyarrow when they're asked for.
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(f"Writing {fmt} output requires pyarrow to be installed.") from e
+    return pyarrow
+
+
+def write_arrow(path: str, columns: list, rows, fmt: str, kinds: dict) -> int:
+    pa = require_pyarrow(fmt)
+
+    # Columns holding a single type keep it (checkbox lists become list columns), inferred
+    # from their first value, and anything else is written as strings.
+    rows = iter(rows)
+    batch = [row for _, row in zip(range(BATCH_ROWS), rows)]
+    fields, as_string = [], set()
+    for i, col in enumerate(columns):
+        sample = next((row[i] for row in batch if row[i] is not None), None)
+        if len(kinds.get(col, set()) - {type(None)}) == 1 and sample is not None:
+            fields.append(pa.field(col, pa.array([sample]).type))
+        else:
+            fields.append(pa.field(col, pa.string()))
+            as_string.add(i)
+    schema = pa.schema(fields)
+
+    def flush(batch: list, writer):
+        arrays = []
+        for i, values in enumerate(zip(*batch)):
+            if i in as_string:
+                values = [None if x is None else str(x) for x in values]
+            arrays.append(pa.array(values, type=fields[i].type))
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+    num_rows = 0
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    with writer:
+        while batch:
+            flush(batch, writer)
+            num_rows += len(batch)
+            batch = [row for _, row in zip(range(BATCH_ROWS), rows)]
+    return num_rows
+
+
+def write_index(path: str, matches: list, key: str = "sid", group_nums: list = None):
+    """
+    Write the group -> member index for matches written in the given order.
+    """
+    start = 0
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for group_num, match in zip(group_nums or range(len(matches)), matches):
+                stop = start + len(match.node.props)
+                entry = {
+                    "group_num": group_num,
+                    "size": match.node.size,
+                    "source": match.source,
+                    "path": match.path,
+                    "rows": [start, stop],
+                    "members": [prop.get(key) for prop in match.node.props],
+                }
+                f.write(json.dumps(entry, default=str) + "\n")
+                start = stop
+
+
+def write_matches(
+    matches: list,
+    path: str = None,
+    fmt: str = "csv",
+    index_path: str = None,
+    key: str = "sid",
+    group_nums: list = None,
+) -> str:
+    """
+    Write one row per student (their group number, props and group's partition path) for the
+    given matches.
+
+    Args:
+        matches (list): Match objects
+        path (str, optional): Output path (default: a freshly claimed out-private-IDX file)
+        fmt (str, optional): One of FORMATS
+        index_path (str, optional): Path to also write the group -> member index to
+        key (str, optional): Column identifying students in the index
+        group_nums (list, optional): Group number of each match (default: their positions)
+
+    Returns:
+        str: The output path
+    """
+    if fmt != "csv":
+        require_pyarrow(fmt)
+    with output_path(path, ext=FORMATS[fmt]) as path:
+        kinds = None if fmt == "csv" else {}
+        columns = scan_columns(matches, kinds=kinds)
+        rows = match_rows(matches, columns, group_nums=group_nums)
+        write_table(path, columns, rows, fmt=fmt, kinds=kinds)
+    if index_path:
+        write_index(index_path, matches, key=key, group_nums=group_nums)
+    return path
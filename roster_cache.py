@@ -0,0 +1,302 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import form_parser
+from models import Row, Node
+
+"""
+On-disk cache of parsed rosters, so that re-running the matcher on the same CSV with the same
+column configuration skips CSV parsing entirely.
+
+Cache entries are keyed on a hash of the CSV's bytes and of the ROW_CONFIG column definitions
+(titles, IDs, types, optionality, the source code of any validators/transformers and of the
+modules defining them, which covers module-level data they read), so that editing either one
+invalidates the entry. Entries are stored column-wise, Arrow-style, as a directory of plain .npy
+arrays (memory-mapped on load, and never unpickled) along with a JSON description of how to
+rebuild each column from them: fixed-width arrays for numbers and booleans, a character buffer
+and offsets for strings, offsets into a flattened column for lists and a mask for missing
+values. Columns holding anything else (e.g. a transformer returning custom objects) can't be
+cached, in which case the roster is simply parsed every time.
+
+run.py caches by default (--no-cache turns it off). Entries hold every student's parsed
+responses, so they're written to .group_matcher_cache/ in the working directory, readable by
+its owner only, and a cache directory that's a symlink, owned by another user or that anybody
+else can write to is never used.
+"""
+
+CACHE_DIR = ".group_matcher_cache"
+
+# Bump whenever parsing semantics (or the entry layout) change so that stale entries are ignored.
+CACHE_VERSION = 2
+
+
+def function_fingerprint(fn) -> str:
+    # Use the function's source (plus the source of any module-level functions it calls by
+    # name, e.g. a lambda deferring to a transformer helper) and fall back to its bytecode.
+    # Partials are described by their function and arguments, and anything else by its type,
+    # never by a repr that may hold a memory address.
+    if isinstance(fn, functools.partial):
+        return repr(
+            (
+                function_fingerprint(fn.func),
+                repr(fn.args),
+                repr(sorted(fn.keywords.items())),
+            )
+        )
+    parts = []
+    for at in [fn] + [
+        fn.__globals__[name]
+        for name in getattr(getattr(fn, "__code__", None), "co_names", ())
+        if inspect.isfunction(getattr(fn, "__globals__", {}).get(name))
+    ]:
+        try:
+            parts.append(inspect.getsource(at))
+        except (OSError, TypeError):
+            code = getattr(at, "__code__", None)
+            if code is not None:
+                parts.append(repr(code.co_code))
+            elif at is not None:
+                parts.append(f"{type(at).__module__}.{type(at).__qualname__}")
+    return "\n".join(parts)
+
+
+def module_fingerprint(fn) -> str:
+    # Use the source of the module defining a function (e.g. the configuration file), so that
+    # edits to module-level data it reads also change the key.
+    while isinstance(fn, functools.partial):
+        fn = fn.func
+    # (Configuration modules aren't in sys.modules, but their functions' globals have __file__.)
+    path = getattr(fn, "__globals__", {}).get("__file__")
+    if path is None:
+        module = sys.modules.get(getattr(fn, "__module__", None) or "")
+        path = getattr(module, "__file__", None)
+    if not path or not os.path.isfile(path):
+        return ""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def cache_key(csv_path: str, row_config: Row) -> str:
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    for col in row_config.cols:
+        digest.update(
+            repr(
+                (
+                    col.col_title,
+                    col.col_id,
+                    col.col_type,
+                    col.is_optional,
+                    function_fingerprint(col.validator),
+                    function_fingerprint(col.transformer),
+                    module_fingerprint(col.validator),
+                    module_fingerprint(col.transformer),
+                )
+            ).encode()
+        )
+    return digest.hexdigest()
+
+
+def encode_column(values: list, arrays: list) -> dict:
+    # Describe how to rebuild a column of parsed values, adding the arrays it needs to arrays.
+    def add(array) -> int:
+        arrays.append(array)
+        return len(arrays) - 1
+
+    spec = {}
+    present = [value for value in values if value is not None]
+    if len(present) < len(values):
+        spec["mask"] = add(np.array([value is None for value in values], dtype=bool))
+    kinds = {type(value) for value in present}
+    if not kinds:
+        spec["kind"] = "none"
+    elif kinds == {bool}:
+        spec["kind"] = "bool"
+        spec["values"] = add(np.array([bool(value) for value in values], dtype=bool))
+    elif kinds == {int}:
+        spec["kind"] = "int"
+        try:
+            spec["values"] = add(
+                np.array([value or 0 for value in values], dtype=np.int64)
+            )
+        except OverflowError:
+            raise TypeError("Integers outside of the 64-bit range can't be cached.")
+    elif kinds == {float}:
+        spec["kind"] = "float"
+        spec["values"] = add(
+            np.array([0.0 if v is None else v for v in values], dtype=np.float64)
+        )
+    elif kinds == {str}:
+        # One buffer of characters, sliced by character (not byte) offsets on load.
+        spec["kind"] = "str"
+        strings = [value or "" for value in values]
+        spec["offsets"] = add(
+            np.cumsum([0] + [len(x) for x in strings], dtype=np.int64)
+        )
+        spec["chars"] = add(
+            np.frombuffer("".join(strings).encode("utf-8"), dtype=np.uint8)
+        )
+    elif kinds == {list}:
+        spec["kind"] = "list"
+        lists = [value or [] for value in values]
+        spec["offsets"] = add(np.cumsum([0] + [len(x) for x in lists], dtype=np.int64))
+        spec["items"] = encode_column([x for items in lists for x in items], arrays)
+    else:
+        names = ", ".join(sorted(kind.__name__ for kind in kinds))
+        raise TypeError(f"Columns of {names} values can't be cached.")
+    return spec
+
+
+def decode_column(spec: dict, arrays: list, num_rows: int) -> list:
+    # Rebuild a column of parsed values from its description.
+    kind = spec["kind"]
+    if kind == "none":
+        values = [None] * num_rows
+    elif kind in ("bool", "int", "float"):
+        values = arrays[spec["values"]].tolist()
+    else:
+        offsets = arrays[spec["offsets"]].tolist()
+        if kind == "str":
+            chars = arrays[spec["chars"]].tobytes().decode("utf-8")
+            values = [chars[a:b] for a, b in zip(offsets, offsets[1:])]
+        else:
+            items = decode_column(spec["items"], arrays, offsets[-1])
+            values = [items[a:b] for a, b in zip(offsets, offsets[1:])]
+    if "mask" in spec:
+        mask = arrays[spec["mask"]].tolist()
+        values = [None if missing else value for value, missing in zip(values, mask)]
+    return values
+
+
+def safe_cache_dir(cache_dir: str) -> bool:
+    """
+    Make sure the cache directory exists and only its owner (who has to be us) can get at it,
+    tightening its permissions if need be.
+
+    Returns:
+        bool: Whether the directory is safe to cache student data in
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        info = os.lstat(cache_dir)
+    except OSError:
+        return False
+    if not os.path.isdir(cache_dir) or os.path.islink(cache_dir):
+        return False
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        return False
+    if info.st_mode & 0o077:
+        os.chmod(cache_dir, 0o700)
+    return True
+
+
+def read_entry(entry_path: str) -> list:
+    with open(os.path.join(entry_path, "columns.json"), encoding="utf-8") as f:
+        header = json.load(f)
+    arrays = [
+        np.load(os.path.join(entry_path, f"{i}.npy"), mmap_mode="r", allow_pickle=False)
+        for i in range(header["num_arrays"])
+    ]
+    columns = [
+        decode_column(spec, arrays, header["num_rows"]) for spec in header["columns"]
+    ]
+    return [Node([dict(zip(header["col_ids"], values))]) for values in zip(*columns)]
+
+
+def write_entry(entry_path: str, nodes: list):
+    # Encode every column before writing anything, so an uncacheable column leaves no trace.
+    col_ids = list(nodes[0].props[0].keys()) if nodes else []
+    arrays = []
+    columns = [
+        encode_column([node.props[0][col_id] for node in nodes], arrays)
+        for col_id in col_ids
+    ]
+    header = {
+        "num_rows": len(nodes),
+        "col_ids": col_ids,
+        "columns": columns,
+        "num_arrays": len(arrays),
+    }
+
+    # Write to a temporary directory (readable by its owner only) first and move it into
+    # place, so that concurrent runs never observe a partially-written entry.
+    tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, mode=0o700)
+    try:
+        for i, array in enumerate(arrays):
+            fd = os.open(
+                os.path.join(tmp_path, f"{i}.npy"),
+                os.O_CREAT | os.O_TRUNC | os.O_WRONLY,
+                0o600,
+            )
+            with open(fd, "wb") as f:
+                np.save(f, array, allow_pickle=False)
+        fd = os.open(
+            os.path.join(tmp_path, "columns.json"),
+            os.O_CREAT | os.O_TRUNC | os.O_WRONLY,
+            0o600,
+        )
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        try:
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # Another run may have put the same entry in place first, which is just as good.
+            if not os.path.isdir(entry_path):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_or_parse(
+    csv_path: str,
+    row_config: Row,
+    debug: bool = False,
+    use_cache: bool = False,
+    cache_dir: str = CACHE_DIR,
+) -> tuple:
+    """
+    Parse the given CSV into Node objects, reusing a cached parse when one exists.
+
+    Args:
+        csv_path (str): Path to the CSV file of people to match
+        row_config (Row): Column configuration to parse with
+        debug (bool, optional): Whether to print debugging info
+        use_cache (bool, optional): Whether to read from and write to the cache at all
+        cache_dir (str, optional): Directory holding cache entries
+
+    Returns:
+        tuple: (nodes, hit), where hit is True if the nodes came from the cache
+    """
+    if not use_cache:
+        return form_parser.parse_from_csv(csv_path, row_config, debug=debug), False
+    if not safe_cache_dir(cache_dir):
+        print(
+            f"Not caching the parsed roster: '{cache_dir}' isn't a directory only you can"
+            + " access."
+        )
+        return form_parser.parse_from_csv(csv_path, row_config, debug=debug), False
+
+    entry_path = os.path.join(cache_dir, cache_key(csv_path, row_config))
+    if os.path.isdir(entry_path):
+        try:
+            return read_entry(entry_path), True
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            if debug:
+                print(f"Replacing unreadable cache entry '{entry_path}'.")
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    nodes = form_parser.parse_from_csv(csv_path, row_config, debug=debug)
+    try:
+        write_entry(entry_path, nodes)
+    except (OSError, TypeError) as e:
+        # Caching is only ever an optimization, so carry on with the parse we have.
+        print(f"Not caching the parsed roster ({e}).")
+    return nodes, False
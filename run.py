@@ -1,12 +1,12 @@
 import os
 import argparse
-import config_parser
-import form_parser
-import partitioning
-import existing_groups
-import best_effort
+import json
+import instrumentation
 import time
-import pandas as pd
+
+# Rosters up to this many students are partitioned without a StudentTable, which isn't worth
+# importing NumPy for at that size.
+SMALL_ROSTER = 5000
 
 
 def run():
@@ -24,25 +24,103 @@ def run():
     arg_parser.add_argument(
         "--debug", help="Turn on debug logging.", action="store_true"
     )
+    arg_parser.add_argument(
+        "--workers",
+        help="Number of worker processes to use for best-effort matching.",
+        type=int,
+        default=1,
+    )
+    arg_parser.add_argument(
+        "--seed",
+        help="Random seed for best-effort matching (overrides the configuration's search seed).",
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--restarts",
+        help="Independently seeded restarts per subgroup, keeping the best (overrides the configuration).",
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--explain",
+        help="Print the partition column plan with estimated and actual branch counts.",
+        action="store_true",
+    )
+    arg_parser.add_argument(
+        "--no-cache",
+        help="Parse the CSV from scratch, rather than reusing (or making) a cached parse in .group_matcher_cache/, which holds student data.",
+        action="store_false",
+        dest="cache",
+    )
+    arg_parser.add_argument(
+        "--previous",
+        help="Path to a previous output CSV; keeps its groups fixed and only matches new or changed students.",
+    )
+    arg_parser.add_argument(
+        "--key",
+        help="Column ID identifying a student across the previous output and the CSV (default: sid).",
+        default="sid",
+    )
+    arg_parser.add_argument(
+        "--output",
+        help="Path to write the output to (default: a fresh out-private-IDX file).",
+    )
+    arg_parser.add_argument(
+        "--format",
+        help="Output format (parquet and arrow require pyarrow).",
+        choices=["csv", "parquet", "arrow"],
+        default="csv",
+    )
+    arg_parser.add_argument(
+        "--index",
+        help="Path to also write a group -> member index to, as JSON Lines.",
+    )
+    arg_parser.add_argument(
+        "--validation-report",
+        help="Path to write the hard-constraint validation report to, as JSON.",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        help="Record per-stage timing, memory and counters to a JSON report (default: profile.json)"
+        + " and a collapsed-stack file for flame graphs alongside it.",
+        nargs="?",
+        const="profile.json",
+    )
+    arg_parser.add_argument(
+        "--trace-memory",
+        help="With --profile, also record per-stage peak memory with tracemalloc (slows every stage down).",
+        action="store_true",
+    )
     parsed_args = arg_parser.parse_args()
     debug = parsed_args.debug
+    profiler = (
+        instrumentation.enable(trace_memory=parsed_args.trace_memory)
+        if parsed_args.profile
+        else None
+    )
+    try:
+        match(parsed_args, start_time)
+    except UserWarning as e:
+        # Problems with the inputs (rather than bugs) are reported without a traceback.
+        raise SystemExit(f"Error: {e}")
+    finally:
+        if profiler:
+            instrumentation.disable()
+            collapsed_path = os.path.splitext(parsed_args.profile)[0] + ".folded"
+            profiler.write(parsed_args.profile, collapsed_path)
+            print("\n~~Profile~~")
+            print(profiler.summary())
+            print(f"Profile written to '{parsed_args.profile}' and '{collapsed_path}'.")
 
-    # Dynamically import and verify configuration file
-    print("~~Parsing~~")
-    print("Parsing configuration file...", end=" ")
-    config = config_parser.import_config(parsed_args.config_file)
-    print("done.")
 
-    # Parse CSV using provided configuration
-    print(
-        "Parsing CSV rows and columns into model objects based on configuration file...",
-        end=" ",
-    )
-    parsed = form_parser.parse_from_csv(
-        parsed_args.csv_file, config.row_config, debug=debug
-    )
-    num_original = len(parsed)
-    print(f"{num_original} rows parsed.")
+def match_roster(parsed_args, config, parsed: list, table) -> list:
+    # Match a whole roster from scratch: student-requested groups, then partitioning, then
+    # best-effort matching within each partition.
+    import partitioning
+    import existing_groups
+    import best_effort
+    import rebalancing
+
+    debug = parsed_args.debug
 
     # Handle existing group matching, if present in configuration file.
     print("\n~~Matching~~")
@@ -51,10 +129,16 @@ def run():
         if debug:
             print(f"Size before removing existing: {sum(x.size for x in parsed)}")
         print("Handling students requesting explicit groupings...", end=" ")
-        existing = existing_groups.handle_existing(config, parsed, debug=debug)
+        existing_report = {}
+        with instrumentation.stage("handle_existing"):
+            existing = existing_groups.handle_existing(
+                config, parsed, debug=debug, report=existing_report
+            )
+        instrumentation.count("existing_groups", len(existing))
         matched.extend(existing)
         print(
-            f"formed {len(existing)} student-requested groups of {sum(x.node.size for x in existing)} students."
+            f"formed {len(existing)} student-requested groups of {sum(x.node.size for x in existing)} students"
+            + f" ({len(existing_report['dangling'])} references to students not in the pool)."
         )
         if debug:
             print(f"Size after removing existing: {sum(x.size for x in parsed)}")
@@ -64,11 +148,20 @@ def run():
         "Executing multi-partitioning (DFS-based multi-splitting, winnowing, and bottom-up merging)...",
         end=" ",
     )
-    subgroups = partitioning.run_multi_partitioning(config, parsed, debug=debug)
+    partition_report = {} if parsed_args.explain else None
+    with instrumentation.stage("partitioning"):
+        subgroups = partitioning.run_multi_partitioning(
+            config, parsed, debug=debug, table=table, report=partition_report
+        )
     num_subgroups = len(subgroups)
+    instrumentation.count("subgroups", num_subgroups)
     print(
         f"partitioned {sum(sum(x.size for x in subgroup[2]) for subgroup in subgroups)} students into {num_subgroups} subgroups."
     )
+    if parsed_args.explain:
+        import planner
+
+        print(planner.explain(partition_report["plan"]))
 
     # Run custom post-processing function on partitions if requested in the configuration
     if config.postprocess_partitions:
@@ -76,7 +169,8 @@ def run():
             "Running partitioning post-processing code...",
             end=" ",
         )
-        subgroups = config.postprocess_partitions(subgroups)
+        with instrumentation.stage("postprocess_partitions"):
+            subgroups = config.postprocess_partitions(subgroups)
         print(f"transformed {num_subgroups} subgroups into {len(subgroups)} subgroups.")
 
     # Display debugging information and check for malformed subgroups if debug enabled
@@ -92,9 +186,136 @@ def run():
 
     # Run best-effort matching on partitioned nodes
     print(f"Executing best-effort matching on each subgroup...", end=" ")
-    mcts_matched = best_effort.run_best_effort(config, subgroups)
+    best_effort_stats = {}
+    with instrumentation.stage("best_effort"):
+        mcts_matched = best_effort.run_best_effort(
+            config,
+            subgroups,
+            stats=best_effort_stats,
+            workers=parsed_args.workers,
+            seed=parsed_args.seed,
+            restarts=parsed_args.restarts,
+        )
     matched.extend(mcts_matched)
+    for key, value in best_effort_stats.items():
+        instrumentation.count(key, value)
+    instrumentation.count("groups", len(matched))
     print(f"formed {len(mcts_matched)} groups from {num_subgroups} subgroups.")
+    if config.constraints.get("Best-effort"):
+        print(
+            f"Best-effort objective improved from {best_effort_stats['initial_score']}"
+            + f" to {best_effort_stats['final_score']} (lower is better)."
+        )
+
+    # Pair up students left as the only member of a category in their group, if requested
+    # (configurations with post-processing do so themselves, see rebalancing.py).
+    if config.constraints.get("Rebalance") and not config.post_processing:
+        print("Rebalancing groups...", end=" ")
+        rebalance_report = {}
+        with instrumentation.stage("rebalance"):
+            rebalancing.rebalance(config, matched, report=rebalance_report)
+        print(
+            ", ".join(
+                f"moved {x['moved']} of {x['isolated']} isolated {name} students"
+                + (f" ({x['unpaired']} unpaired)" if x["unpaired"] else "")
+                for name, x in rebalance_report.items()
+            )
+            + "."
+        )
+
+    return matched
+
+
+def match(parsed_args, start_time: float):
+    # The matching modules (and through them Pandas and NumPy) are only imported once they're
+    # needed, so that the CLI starts up quickly for --help and small rosters.
+    import config_parser
+    import roster_cache
+    import validation
+    import result_writer
+
+    debug = parsed_args.debug
+
+    # Dynamically import and verify configuration file
+    print("~~Parsing~~")
+    print("Parsing configuration file...", end=" ")
+    with instrumentation.stage("import_config"):
+        config = config_parser.import_config(parsed_args.config_file)
+    print("done.")
+
+    # Configurations with post-processing write their own output (except when re-matching
+    # incrementally), so output options don't apply to them.
+    assert (
+        not config.post_processing
+        or parsed_args.previous
+        or (
+            parsed_args.format == "csv"
+            and not parsed_args.index
+            and not parsed_args.output
+        )
+    ), "--output, --format and --index don't apply to configurations with post_processing, which write their own output!"
+    if parsed_args.format != "csv":
+        result_writer.require_pyarrow(parsed_args.format)
+
+    # Parse CSV using provided configuration
+    print(
+        "Parsing CSV rows and columns into model objects based on configuration file...",
+        end=" ",
+    )
+    with instrumentation.stage("parse_csv"):
+        parsed, cache_hit = roster_cache.load_or_parse(
+            parsed_args.csv_file,
+            config.row_config,
+            debug=debug,
+            use_cache=parsed_args.cache,
+        )
+    num_original = len(parsed)
+    records = [node.props[0] for node in parsed]
+    instrumentation.count("nodes", num_original)
+    instrumentation.count("cache_hits", int(cache_hit))
+    table = None
+    if num_original > SMALL_ROSTER:
+        from student_table import StudentTable, table_columns
+
+        with instrumentation.stage("student_table"):
+            table = StudentTable.from_nodes(parsed, columns=table_columns(config))
+    print(f"{num_original} rows {'loaded from cache' if cache_hit else 'parsed'}.")
+
+    # In incremental mode, keep the previous matching fixed and only slot in the difference.
+    group_nums, num_fixed = None, 0
+    if parsed_args.previous:
+        import incremental
+        import rebalancing
+
+        print("\n~~Incremental matching~~")
+        print(
+            f"Slotting new and changed students into '{parsed_args.previous}'...",
+            end=" ",
+        )
+        with instrumentation.stage("incremental"):
+            matched, group_nums, stats = incremental.run_incremental(
+                config, parsed_args.previous, parsed, key=parsed_args.key, debug=debug
+            )
+        print(
+            f"kept {stats['kept']} students ({stats['removed']} no longer on the roster),"
+            + f" dissolved {stats['dissolved']} groups left too small, slotted {stats['slotted']}"
+            + f" of their members and the {stats['new']} new and {stats['changed']} changed"
+            + f" students, and formed {stats['new_groups']} new groups."
+        )
+        if stats["uncompared"]:
+            print(
+                f"Note: the previous output has no {', '.join(stats['uncompared'])} columns,"
+                + " so changes to them weren't detected."
+            )
+
+        # Previous groups (including those students were slotted into) stay as they were, so
+        # only rebalance (or below, post-process) the groups formed from scratch.
+        num_fixed = len(matched) - stats["new_groups"]
+        if config.constraints.get("Rebalance") and not config.post_processing:
+            with instrumentation.stage("rebalance"):
+                rebalancing.rebalance(config, matched[num_fixed:])
+    else:
+        matched = match_roster(parsed_args, config, parsed, table)
 
     # Display all matches if debug information turned on.
     if debug:
@@ -118,26 +339,67 @@ def run():
         num_accounted_for >= num_original
     ), f"Something went very wrong and we lost {num_original - num_accounted_for} student(s) somewhere!"
 
-    # Do any config-specific post-processing on matches.
-    if config.post_processing:
+    # Do any config-specific post-processing on matches (in incremental mode, only on new
+    # groups, which keep the fresh group numbers following the previous ones).
+    if config.post_processing and (
+        not parsed_args.previous or num_fixed < len(matched)
+    ):
         print("Running post-processing...", end=" ")
-        config.post_processing(matched)
+        with instrumentation.stage("post_processing"):
+            processed = config.post_processing(matched[num_fixed:])
         print("done.")
+
+        # Post-processing may return its final matches (rather than only changing the given
+        # ones in place), which are what gets validated.
+        if processed is not None:
+            matched = matched[:num_fixed] + processed
+            if group_nums is not None:
+                first = group_nums[num_fixed]
+                group_nums = group_nums[:num_fixed] + list(
+                    range(first, first + len(processed))
+                )
+    if not config.post_processing or parsed_args.previous:
+        # If no post-processing specified (or re-matching incrementally, where post-processing
+        # only sees the new groups), stream matches (along with their partition paths and
+        # group numbers, for incremental re-matching) to the output file
+        with result_writer.output_path(
+            parsed_args.output, ext=result_writer.FORMATS[parsed_args.format]
+        ) as out_fname:
+            print(f"Outputting {num_accounted_for} students to '{out_fname}'.")
+            with instrumentation.stage("write_output"):
+                result_writer.write_matches(
+                    matched,
+                    out_fname,
+                    fmt=parsed_args.format,
+                    index_path=parsed_args.index,
+                    key=parsed_args.key,
+                    group_nums=group_nums,
+                )
+        if parsed_args.index:
+            print(f"Group index written to '{parsed_args.index}'.")
+
+    # Check the final matching against its hard constraints (see validation.py).
+    print("Validating groups against hard constraints...", end=" ")
+    with instrumentation.stage("validate"):
+        validation_report = validation.validate_matches(
+            config, matched, records, table=table
+        )
+    for check, num in validation_report["counts"].items():
+        instrumentation.count(f"violations_{check}", num)
+    if validation_report["ok"]:
+        print("no violations.")
     else:
-        # If no post-processing specified, output matches to CSV of the form out-private-IDX.csv
-        # where IDX chosen to be a unique filename
-        df = pd.DataFrame(
-            sum([match.to_json(group_num=i) for i, match in enumerate(matched)], [])
+        print(
+            f"{len(validation_report['violations'])} violations ("
+            + ", ".join(f"{n} {check}" for check, n in validation_report["counts"].items())
+            + ")."
         )
-        out_fname = "out-private.csv"
-        out_fname_format = "out-private-{}.csv"
-        if os.path.isfile(out_fname):
-            i = 2
-            while os.path.isfile(out_fname_format.format(i)):
-                i += 1
-            out_fname = out_fname_format.format(i)
-        print(f"Outputting {num_accounted_for} students to '{out_fname}'.")
-        df.to_csv(out_fname, encoding="utf-8", index=False)
+        for violation in validation_report["violations"][: 10 if not debug else None]:
+            print(f"\t{violation}")
+    if parsed_args.validation_report:
+        with open(parsed_args.validation_report, "w") as f:
+            json.dump(validation_report, f, indent=2, default=str)
+        print(f"Validation report written to '{parsed_args.validation_report}'.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import collections
+import copy
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config_parser
+import roster_cache
+import partitioning
+import existing_groups
+import best_effort
+import rebalancing
+from models import Node, Configuration
+from student_table import StudentTable, table_columns
+
+"""
+Long-running matching service for interactive what-if queries.
+
+Rosters are parsed once (along with their StudentTable, from which partition indexes are
+built) and kept in memory, so re-running matching with modified constraints only pays for the
+matching itself. Results are cached on (roster, overrides). Requests are handled with asyncio
+and matching runs on a thread pool, so the server stays responsive while it works. Every query
+gets a fresh copy of the roster's nodes, so queries never affect one another.
+
+It speaks JSON over HTTP, and listens on localhost only unless told otherwise:
+
+GET  /health  -> {"status": "ok", "rosters": 1}
+GET  /rosters -> {"rosters": [{"roster": "...", "config": "...", "csv": "...", ...}]}
+POST /rosters {"config": "example_config.py", "csv": "responses.csv"}
+     -> {"roster": "...", "students": 1234, "seconds": 0.4}
+POST /match {"roster": "...", "overrides": {"MAX_GROUP_SIZE": 5,
+                                            "CONSTRAINTS": {"Partition": ["remote"]}},
+             "fields": ["email"]}
+     -> {"groups": [{"size": 4, "source": "path", "path": [...], "members": [...]}, ...],
+         "stats": {...}, "seconds": 0.2, "cached": false}
+
+Rosters loaded over HTTP must be .py configuration files and .csv files inside the roster
+directory (--roster-dir, the current directory by default), given relative to it. Loading a
+roster executes its configuration file, so POST /rosters is disabled when listening on anything
+but localhost unless --allow-remote-loading is given.
+
+Overrides use the configuration file's names. CONSTRAINTS overrides are merged key by key
+into the configuration's, and a null value drops that constraint. Members are given as row
+indices into the CSV, or as dicts of the requested fields.
+
+Example usage:
+
+python server.py --port 8765 --preload example_config.py responses.csv
+"""
+
+# Configuration fields that can be overridden per query.
+OVERRIDABLE_FIELDS = ["CONSTRAINTS", "MIN_GROUP_SIZE", "MAX_GROUP_SIZE", "MIN_PARTITION_SIZE"]
+
+# Default best-effort local search budget per query, in iterations per student, which keeps
+# interactive queries quick while their results stay reproducible (queries can still override it
+# through CONSTRAINTS["Search"]).
+QUERY_ITERATIONS = 25
+
+# Number of query results kept in memory, least recently used first out.
+RESULT_CACHE_SIZE = 256
+
+# Addresses that only accept connections from this machine.
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    500: "Internal Server Error",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class MatchingService(object):
+    def __init__(
+        self,
+        threads: int = 1,
+        iterations: int = QUERY_ITERATIONS,
+        time_limit: float = None,
+        roster_dir: str = None,
+    ):
+        """
+        Set up an empty service.
+
+        Args:
+            threads (int, optional): Number of queries to run matching for at once
+            iterations (int, optional): Default local search budget per query, in iterations
+                per student
+            time_limit (float, optional): Default local search wall-clock limit per query, in
+                seconds (none by default, as it makes results depend on the server's load)
+            roster_dir (str, optional): Directory that rosters loaded through POST /rosters
+                must live in (configuration files are executed as Python, so nothing outside
+                of it is loaded), or None to disable loading rosters over HTTP
+        """
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.roster_dir = os.path.realpath(roster_dir) if roster_dir else None
+        self.rosters = {}
+        self.results = collections.OrderedDict()
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def resolve_path(self, path: str, extensions: tuple) -> str:
+        # Only hand out files of the expected type that live inside the roster directory, as
+        # loading a configuration file runs it.
+        if self.roster_dir is None:
+            raise RequestError(403, "Loading rosters over HTTP is disabled.")
+        if not isinstance(path, str):
+            raise RequestError(400, "Roster paths must be strings.")
+        resolved = os.path.realpath(os.path.join(self.roster_dir, path))
+        if os.path.commonpath([resolved, self.roster_dir]) != self.roster_dir:
+            raise RequestError(403, f"'{path}' is outside of the roster directory.")
+        if not resolved.endswith(extensions):
+            raise RequestError(400, f"'{path}' is not a {' or '.join(extensions)} file.")
+        if not os.path.isfile(resolved):
+            raise RequestError(404, f"No file '{path}' in the roster directory.")
+        return resolved
+
+    def load_roster(self, config_path: str, csv_path: str) -> dict:
+        # Rosters are identified by the parse cache's hash of the CSV and columns along with
+        # the configuration file's path and contents, so reloading an unchanged roster is free
+        # and editing either file (or using another configuration with the same columns) gets
+        # it a new ID.
+        start_time = time.time()
+        config = config_parser.import_config(config_path)
+        digest = hashlib.sha256(
+            roster_cache.cache_key(csv_path, config.row_config).encode()
+        )
+        digest.update(os.path.realpath(config_path).encode())
+        with open(config_path, "rb") as f:
+            digest.update(f.read())
+        roster_id = digest.hexdigest()[:16]
+        if roster_id not in self.rosters:
+            nodes, _ = roster_cache.load_or_parse(csv_path, config.row_config)
+            table = StudentTable.from_nodes(nodes, columns=table_columns(config))
+            self.rosters[roster_id] = {
+                "config": config,
+                "records": [node.props[0] for node in nodes],
+                "table": table,
+                "info": {
+                    "roster": roster_id,
+                    "config": config_path,
+                    "csv": csv_path,
+                    "students": len(nodes),
+                },
+            }
+        return {**self.rosters[roster_id]["info"], "seconds": time.time() - start_time}
+
+    def configure(self, config, overrides: dict):
+        # Apply overrides to a copy of the roster's configuration.
+        if not isinstance(overrides, dict):
+            raise RequestError(400, "Overrides must be an object.")
+        unknown = set(overrides) - set(OVERRIDABLE_FIELDS)
+        if unknown:
+            raise RequestError(400, f"Cannot override {', '.join(sorted(unknown))}.")
+        config = copy.copy(config)
+        for field, value in overrides.items():
+            attr = Configuration.FIELDS[field]
+            if field == "CONSTRAINTS":
+                if not isinstance(value, dict):
+                    raise RequestError(400, "CONSTRAINTS overrides must be an object.")
+                value = {**config.constraints, **value}
+                value = {key: x for key, x in value.items() if x is not None}
+            setattr(config, attr, value)
+
+        # Use the per-query search budget unless the query asks for another one.
+        search = config.constraints.get("Search", {})
+        requested = (overrides.get("CONSTRAINTS") or {}).get("Search") or {}
+        defaults = {"iterations": self.iterations, "time_limit": self.time_limit}
+        for key, value in defaults.items():
+            if key not in requested:
+                search = {**search, key: value}
+        config.constraints = {**config.constraints, "Search": search}
+        return config
+
+    def match(self, roster_id: str, overrides: dict, fields: list) -> dict:
+        """
+        Run matching (minus the configuration's post-processing) on a copy of a roster.
+        """
+        start_time = time.time()
+        roster = self.rosters[roster_id]
+        config = self.configure(roster["config"], overrides)
+
+        # Hand the pipeline fresh nodes and props, which it mutates, keeping row indices so
+        # that the roster's StudentTable can still be used for partitioning.
+        nodes = [
+            Node([dict(record)], rows=[i]) for i, record in enumerate(roster["records"])
+        ]
+        row_of = {id(node.props[0]): i for i, node in enumerate(nodes)}
+
+        matched = []
+        if "Existing" in config.constraints:
+            matched.extend(existing_groups.handle_existing(config, nodes))
+        subgroups = partitioning.run_multi_partitioning(
+            config, nodes, table=roster["table"]
+        )
+        if config.postprocess_partitions:
+            subgroups = config.postprocess_partitions(subgroups)
+        stats = {}
+        matched.extend(best_effort.run_best_effort(config, subgroups, stats=stats))
+        if config.constraints.get("Rebalance") and not config.post_processing:
+            rebalancing.rebalance(config, matched)
+
+        groups = []
+        for match in matched:
+            if fields:
+                members = [{f: prop.get(f) for f in fields} for prop in match.node.props]
+            else:
+                members = [row_of.get(id(prop)) for prop in match.node.props]
+            groups.append(
+                {
+                    "size": match.node.size,
+                    "source": match.source,
+                    "path": match.path,
+                    "members": members,
+                }
+            )
+        stats["groups"] = len(groups)
+        stats["subgroups"] = len(subgroups)
+        stats["group_sizes"] = dict(
+            sorted(collections.Counter(group["size"] for group in groups).items())
+        )
+        return {"groups": groups, "stats": stats, "seconds": time.time() - start_time}
+
+    async def what_if(self, roster_id: str, overrides: dict, fields: list) -> dict:
+        if roster_id not in self.rosters:
+            raise RequestError(404, f"No roster '{roster_id}' is loaded.")
+        key = (
+            roster_id,
+            json.dumps(overrides, sort_keys=True),
+            json.dumps(fields),
+        )
+        if key in self.results:
+            self.results.move_to_end(key)
+            return {**self.results[key], "cached": True}
+
+        # Identical queries arriving while one is running share its result.
+        if key not in self._pending:
+            loop = asyncio.get_running_loop()
+            self._pending[key] = loop.run_in_executor(
+                self._executor, self.match, roster_id, overrides, fields
+            )
+        try:
+            result = await asyncio.shield(self._pending[key])
+        finally:
+            self._pending.pop(key, None)
+
+        self.results[key] = result
+        while len(self.results) > RESULT_CACHE_SIZE:
+            self.results.popitem(last=False)
+        return {**result, "cached": False}
+
+    async def handle(self, method: str, path: str, body: dict) -> dict:
+        if method == "GET" and path == "/health":
+            return {"status": "ok", "rosters": len(self.rosters)}
+        if method == "GET" and path == "/rosters":
+            return {"rosters": [roster["info"] for roster in self.rosters.values()]}
+        if method == "POST" and path == "/rosters":
+            if "config" not in body or "csv" not in body:
+                raise RequestError(400, "Both a 'config' and a 'csv' path are required.")
+            config_path = self.resolve_path(body["config"], (".py",))
+            csv_path = self.resolve_path(body["csv"], (".csv",))
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self.load_roster, config_path, csv_path
+            )
+        if method == "POST" and path == "/match":
+            if not isinstance(body.get("roster"), str):
+                raise RequestError(400, "A 'roster' ID is required.")
+            fields = body.get("fields", [])
+            if not isinstance(fields, list) or not all(
+                isinstance(field, str) for field in fields
+            ):
+                raise RequestError(400, "Fields must be a list of column IDs.")
+            return await self.what_if(body["roster"], body.get("overrides", {}), fields)
+        raise RequestError(404, f"No endpoint {method} {path}.")
+
+    async def serve_client(self, reader, writer):
+        status, response = 200, None
+        try:
+            # Read the request line, headers and (JSON) body of a single request.
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                raise RequestError(400, "Malformed request line.")
+            method, path = request_line[0], request_line[1].split("?")[0]
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                raise RequestError(400, "Content-Length is not a number.")
+            if length < 0:
+                raise RequestError(400, "Content-Length is negative.")
+            raw = await reader.readexactly(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                raise RequestError(400, "Request body is not valid JSON.")
+            if not isinstance(body, dict):
+                raise RequestError(400, "Request body must be a JSON object.")
+            response = await self.handle(method, path, body)
+        except RequestError as e:
+            status, response = e.status, {"error": str(e)}
+        except Exception as e:
+            status, response = 500, {"error": f"{type(e).__name__}: {e}"}
+
+        payload = json.dumps(response, default=str).encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                + "Content-Type: application/json\r\n"
+                + f"Content-Length: {len(payload)}\r\n"
+                + "Connection: close\r\n\r\n"
+            ).encode()
+            + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(service: MatchingService, host: str, port: int):
+    server = await asyncio.start_server(service.serve_client, host, port)
+    print(f"Serving what-if matching on http://{host}:{port}.")
+    async with server:
+        await server.serve_forever()
+
+
+def run():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--host", help="Address to listen on (default: localhost).", default="127.0.0.1"
+    )
+    arg_parser.add_argument(
+        "--port", help="Port to listen on.", type=int, default=8765
+    )
+    arg_parser.add_argument(
+        "--threads",
+        help="Number of queries to run matching for at once.",
+        type=int,
+        default=1,
+    )
+    arg_parser.add_argument(
+        "--iterations",
+        help="Default best-effort local search budget per query, in iterations per student.",
+        type=int,
+        default=QUERY_ITERATIONS,
+    )
+    arg_parser.add_argument(
+        "--time-limit",
+        help="Default best-effort local search wall-clock limit per query, in seconds (results then depend on load).",
+        type=float,
+    )
+    arg_parser.add_argument(
+        "--preload",
+        help="A configuration file and CSV to load as a roster at startup (repeatable).",
+        nargs=2,
+        action="append",
+        metavar=("CONFIG", "CSV"),
+        default=[],
+    )
+    arg_parser.add_argument(
+        "--roster-dir",
+        help="Directory that POST /rosters may load configuration files and CSVs from"
+        + " (default: the current directory).",
+        default=".",
+    )
+    arg_parser.add_argument(
+        "--allow-remote-loading",
+        help="Allow POST /rosters when listening on a non-loopback address (configuration"
+        + " files are executed, so only do this on a trusted network).",
+        action="store_true",
+    )
+    parsed_args = arg_parser.parse_args()
+
+    # Loading a roster runs its configuration file, so only allow it over the network if asked.
+    roster_dir = parsed_args.roster_dir
+    if parsed_args.host not in LOOPBACK_HOSTS and not parsed_args.allow_remote_loading:
+        print(
+            f"Listening on {parsed_args.host}, so POST /rosters is disabled (see --allow-remote-loading)."
+        )
+        roster_dir = None
+    service = MatchingService(
+        threads=parsed_args.threads,
+        iterations=parsed_args.iterations,
+        time_limit=parsed_args.time_limit,
+        roster_dir=roster_dir,
+    )
+    for config_path, csv_path in parsed_args.preload:
+        info = service.load_roster(config_path, csv_path)
+        print(f"Loaded {info['students']} students from '{csv_path}' as roster '{info['roster']}'.")
+    try:
+        asyncio.run(serve(service, parsed_args.host, parsed_args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
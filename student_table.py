@@ -0,0 +1,200 @@
+import numpy as np
+from models import Node
+
+"""
+Columnar view of the parsed roster's partition and feature columns. Scalar columns are
+dictionary-encoded as NumPy arrays of integer codes (one per distinct value, in first-seen
+order) and checkbox columns are stored as packed bitmasks, one bit per distinct checkbox value,
+so that filtering, posting lists and demographic counts can be done with vectorized operations
+instead of per-node dict lookups.
+
+Row i of the table corresponds to the i-th node the table was built from, and nodes record the
+rows of their students (Node.rows) so that the table can be indexed without touching props. The
+table is an index alongside the props dicts, not a replacement for them: configuration code
+(transformers, postprocess_partitions, post_processing), student-requested grouping and output
+all read and write props, so Node and Match keep holding them. The table therefore only encodes
+the columns matching needs (see table_columns), with codes as narrow as each column's number of
+distinct values allows, and costs a few bytes per student and column on top of the props. run.py
+only builds it for rosters large enough for the vectorized partitioning and validation to pay
+for that.
+"""
+
+
+def table_columns(config) -> list:
+    """
+    List the columns worth encoding for a configuration: its partition columns followed by its
+    "Best-effort" feature columns.
+    """
+    features = (config.constraints.get("Best-effort") or [[]])[0]
+    return list(dict.fromkeys([*config.constraints.get("Partition", []), *features]))
+
+
+class StudentTable(object):
+    def __init__(self, records: list, columns: list = None):
+        """
+        Build a columnar table from a list of per-student props dicts.
+
+        Args:
+            records (list): Props dicts, one per student (all sharing the same keys)
+            columns (list, optional): Columns to encode (default: every key)
+        """
+        self.num_rows = len(records)
+        self.codes = {}
+        self.vocabs = {}
+        self.masks = {}
+        self._records = records
+        self._row_by_id = None
+
+        if columns is None:
+            columns = list(records[0].keys()) if records else []
+        for key in columns:
+            values = [record.get(key) for record in records]
+            if any(isinstance(value, list) for value in values):
+                self._add_checkbox(key, values)
+            else:
+                self._add_scalar(key, values)
+
+    @classmethod
+    def from_nodes(cls, nodes: list, columns: list = None):
+        """
+        Build a table out of freshly-parsed single-student nodes and record each node's row
+        index on the node itself.
+        """
+        table = cls([node.props[0] for node in nodes], columns=columns)
+        for i, node in enumerate(nodes):
+            node.rows = [i]
+        return table
+
+    def _add_scalar(self, key, values):
+        vocab = {}
+        codes = [vocab.setdefault(value, len(vocab)) for value in values]
+        self.vocabs[key] = vocab
+        self.codes[key] = np.asarray(
+            codes, dtype=np.min_scalar_type(max(len(vocab) - 1, 0))
+        )
+
+    def _add_checkbox(self, key, values):
+        # Cells that aren't lists (e.g. None for an unanswered optional checkbox) are treated
+        # as holding that single value, the same as partitioning and planning treat them.
+        values = [value if isinstance(value, list) else [value] for value in values]
+        vocab = {}
+        for value in values:
+            for elem in value:
+                vocab.setdefault(elem, len(vocab))
+        mask = np.zeros(
+            (self.num_rows, max(1, (len(vocab) + 63) // 64)), dtype=np.uint64
+        )
+        for i, value in enumerate(values):
+            for elem in value:
+                word, bit = divmod(vocab[elem], 64)
+                mask[i, word] |= np.uint64(1) << np.uint64(bit)
+        self.vocabs[key] = vocab
+        self.masks[key] = mask
+
+    def __len__(self):
+        return self.num_rows
+
+    def __contains__(self, col: str) -> bool:
+        return col in self.vocabs
+
+    def is_checkbox(self, col: str) -> bool:
+        return col in self.masks
+
+    def row_of(self, prop: dict) -> int:
+        # Look up a student's row by their props, for nodes built without row indices.
+        if self._row_by_id is None:
+            self._row_by_id = {id(record): i for i, record in enumerate(self._records)}
+        return self._row_by_id[id(prop)]
+
+    def values(self, col: str) -> list:
+        """
+        Return the distinct values of a column, in first-seen order.
+        """
+        return list(self.vocabs[col].keys())
+
+    def has_value(self, col: str, value) -> np.ndarray:
+        """
+        Return a boolean mask over all rows that either are equal to or contain the given value.
+        """
+        if col in self.masks:
+            if value not in self.vocabs[col]:
+                return np.zeros(self.num_rows, dtype=bool)
+            word, bit = divmod(self.vocabs[col][value], 64)
+            return ((self.masks[col][:, word] >> np.uint64(bit)) & np.uint64(1)).astype(
+                bool
+            )
+        code = self.vocabs[col].get(value)
+        if code is None:
+            return np.zeros(self.num_rows, dtype=bool)
+        return self.codes[col] == code
+
+    def rows_of(self, node: Node) -> np.ndarray:
+        """
+        Return the row indices of every student in the given node. Falls back to looking up
+        the node's props when the node was built by configuration code without row indices.
+        """
+        rows = node.rows
+        if rows is None:
+            rows = [self.row_of(prop) for prop in node.props]
+        return np.asarray(rows, dtype=np.int64)
+
+    def first_rows(self, nodes: list) -> np.ndarray:
+        """
+        Return the row index of the first student of each of the given nodes.
+        """
+        return np.asarray(
+            [
+                node.rows[0] if node.rows else self.row_of(node.props[0])
+                for node in nodes
+            ],
+            dtype=np.int64,
+        )
+
+    def postings(self, col: str, rows: np.ndarray) -> dict:
+        """
+        Build a posting list for a column restricted to the given rows, mapping each value to
+        the set of positions (into rows) that either are equal to or contain that value. Values
+        are ordered by first occurrence within rows.
+        """
+        # Pair up every position with the code of each value it holds (in position order),
+        # then group positions by code with a single stable sort.
+        if col in self.masks:
+            words = self.masks[col][rows].astype("<u8").view(np.uint8)
+            bits = np.unpackbits(words, axis=1, bitorder="little")
+            positions, codes = np.nonzero(bits)
+        else:
+            codes = self.codes[col][rows]
+            positions = np.arange(len(rows))
+        order = np.argsort(codes, kind="stable")
+        codes, positions = codes[order], positions[order]
+        starts = np.flatnonzero(np.diff(codes)) + 1
+        groups = np.split(positions, starts) if len(codes) else []
+        group_codes = codes[np.concatenate(([0], starts))] if len(codes) else []
+
+        # Order values by the first position holding them, and checkbox values first held by
+        # the same position by where they appear in that student's cell.
+        values = list(self.vocabs[col].keys())
+        keys = [(int(group[0]), 0) for group in groups]
+        if col in self.masks:
+            for k, (group, code) in enumerate(zip(groups, group_codes)):
+                cell = self._records[rows[group[0]]].get(col)
+                if isinstance(cell, list):
+                    keys[k] = (keys[k][0], cell.index(values[code]))
+        out = sorted(zip(keys, groups, group_codes))
+        return {values[code]: set(group.tolist()) for _, group, code in out}
+
+    def count(self, col: str, value, rows=None) -> int:
+        """
+        Count how many rows (optionally restricted to the given row indices) either are equal
+        to or contain the given value.
+        """
+        mask = self.has_value(col, value)
+        if rows is not None:
+            mask = mask[rows]
+        return int(np.count_nonzero(mask))
+
+    def value_counts(self, col: str, rows=None) -> dict:
+        """
+        Count occurrences of every value of a column, optionally restricted to the given rows.
+        """
+        return {value: self.count(col, value, rows) for value in self.values(col)}
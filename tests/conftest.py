@@ -0,0 +1,25 @@
+import os
+import sys
+import types
+
+# The matcher's modules live at the top level of the repository rather than in a package.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from models import Configuration
+
+
+def make_config(constraints: dict = None, **fields) -> Configuration:
+    """
+    Build a Configuration without a configuration file, from CONSTRAINTS and upper-case
+    configuration fields (MIN_GROUP_SIZE=3, ...).
+    """
+    module = types.SimpleNamespace(
+        ROW_CONFIG=None,
+        CONSTRAINTS=constraints or {},
+        MIN_GROUP_SIZE=3,
+        MAX_GROUP_SIZE=6,
+        MIN_PARTITION_SIZE=3,
+    )
+    module.__dict__.update(fields)
+    return Configuration(module)
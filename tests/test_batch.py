@@ -0,0 +1,85 @@
+import json
+import os
+import pytest
+import batch
+import benchmark
+
+# The example configuration without its post-processing, so jobs write their output through
+# run.py.
+CONFIG = """
+from example_config import *
+
+post_processing = None
+"""
+
+
+def write_manifest(tmp_path):
+    (tmp_path / "config.py").write_text(CONFIG)
+    (tmp_path / "broken_config.py").write_text("raise ValueError('broken config')\n")
+    benchmark.generate_roster(str(tmp_path / "a.csv"), 120, seed=1)
+    benchmark.generate_roster(str(tmp_path / "b.csv"), 150, seed=2)
+    jobs = [
+        {"config": "config.py", "csv": "a.csv", "seed": 3},
+        {"name": "missing", "config": "config.py", "csv": "missing.csv"},
+        {"name": "broken", "config": "broken_config.py", "csv": "a.csv"},
+        {"config": "config.py", "csv": "b.csv"},
+    ]
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"jobs": jobs}))
+    return str(path)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failing_jobs_dont_affect_the_others(tmp_path, workers):
+    jobs = batch.load_manifest(write_manifest(tmp_path))
+    output_dir = tmp_path / "out"
+    reports = batch.run_batch(jobs, str(output_dir), workers=workers)
+
+    assert [report["name"] for report in reports] == ["a", "missing", "broken", "b"]
+    assert [report["status"] for report in reports] == ["ok", "failed", "failed", "ok"]
+    assert reports[1]["error"].startswith("FileNotFoundError")
+    assert reports[2]["error"] == "ValueError: broken config"
+    for report, num_students in ((reports[0], 120), (reports[3], 150)):
+        job_dir = output_dir / report["name"]
+        with open(job_dir / "out-private.csv") as f:
+            assert len(f.read().splitlines()) == num_students + 1
+        with open(job_dir / "report.json") as f:
+            assert json.load(f)["status"] == "ok"
+    assert os.getcwd() != str(output_dir / "broken")
+
+
+def test_load_manifest_names_and_paths(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"config": "c.py", "csv": "data/a.csv"},
+                {"config": "c.py", "csv": "other/a.csv", "previous": "prev.csv"},
+            ]
+        )
+    )
+    jobs = batch.load_manifest(str(path))
+    assert [job["name"] for job in jobs] == ["a", "a-2"]
+    assert jobs[0]["csv"] == str(tmp_path / "data" / "a.csv")
+    assert jobs[1]["previous"] == str(tmp_path / "prev.csv")
+    assert jobs[0]["previous"] is None and jobs[0]["key"] == "sid"
+
+
+def test_incremental_job_with_missing_key_fails_alone(tmp_path):
+    (tmp_path / "config.py").write_text(CONFIG)
+    benchmark.generate_roster(str(tmp_path / "a.csv"), 60, seed=1)
+    (tmp_path / "previous.csv").write_text("group_num,email\n0,a@berkeley.edu\n")
+    jobs = [
+        {
+            "name": "bad",
+            "config": "config.py",
+            "csv": "a.csv",
+            "previous": "previous.csv",
+        },
+        {"name": "good", "config": "config.py", "csv": "a.csv"},
+    ]
+    (tmp_path / "manifest.json").write_text(json.dumps(jobs))
+    jobs = batch.load_manifest(str(tmp_path / "manifest.json"))
+    reports = batch.run_batch(jobs, str(tmp_path / "out"))
+    assert [report["status"] for report in reports] == ["failed", "ok"]
+    assert reports[0]["error"].startswith("UserWarning: The previous output")
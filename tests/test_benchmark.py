@@ -0,0 +1,34 @@
+import csv
+import os
+import benchmark
+
+EXAMPLE_CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example_config.py"
+)
+
+
+def test_generate_roster(tmp_path):
+    path = tmp_path / "roster.csv"
+    benchmark.generate_roster(str(path), 50, num_days=9, max_choices=2, seed=1)
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == benchmark.HEADERS
+    assert len(rows) == 51
+    assert all(len(row) == len(benchmark.HEADERS) for row in rows)
+    days = benchmark.value_names(benchmark.DAYS, 9)
+    column = benchmark.HEADERS.index("What days of the week would you like to meet?")
+    for row in rows[1:]:
+        chosen = row[column].split(", ")
+        assert 1 <= len(chosen) <= 2 and set(chosen) <= set(days)
+
+
+def test_measure_in_subprocess(tmp_path):
+    # Every run happens in its own process, so each one reports its own peak memory.
+    path = tmp_path / "roster.csv"
+    benchmark.generate_roster(str(path), 200)
+    result = benchmark.measure_in_subprocess(EXAMPLE_CONFIG, str(path), trace_memory=True)
+    assert result["students"] == 200
+    assert result["max_rss_kb"] > 0
+    assert set(benchmark.STAGES) <= set(result["stages"])
+    assert all("peak_bytes" in stage for stage in result["stages"].values())
+    assert result["post_processing_error"] is None
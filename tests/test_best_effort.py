@@ -0,0 +1,169 @@
+import functools
+import itertools
+import random
+import pytest
+import best_effort
+from conftest import make_config
+from models import Node
+
+
+def brute_force_feasible(profile: tuple, lo: int, hi: int) -> bool:
+    # Whether the size profile can be split into groups within [lo, hi], trying every group
+    # composition for every remainder.
+    sizes = [size for size, _ in profile]
+
+    @functools.lru_cache(maxsize=None)
+    def feasible(counts):
+        if not any(counts):
+            return True
+        for b in itertools.product(*(range(count + 1) for count in counts)):
+            total = sum(n * size for n, size in zip(b, sizes))
+            if lo <= total <= hi and feasible(tuple(c - n for c, n in zip(counts, b))):
+                return True
+        return False
+
+    return feasible(tuple(count for _, count in profile))
+
+
+def random_profile(rng):
+    sizes = sorted(rng.sample(range(1, 8), rng.randint(1, 3)))
+    return tuple((size, rng.randint(1, 6)) for size in sizes)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_split_template_matches_brute_force(seed):
+    rng = random.Random(seed)
+    profile = random_profile(rng)
+    lo = rng.randint(2, 6)
+    hi = lo + rng.randint(0, 3)
+    template = best_effort.split_template(profile, lo, hi)
+    assert (template is not None) == brute_force_feasible(profile, lo, hi)
+    if template is None:
+        return
+
+    # Every group is within range and every node is used exactly once.
+    sizes = [size for size, _ in profile]
+    for b in template:
+        assert lo <= sum(n * size for n, size in zip(b, sizes)) <= hi
+    assert [sum(column) for column in zip(*template)] == [c for _, c in profile]
+
+
+def test_split_template_gives_up_on_large_profiles(monkeypatch):
+    monkeypatch.setattr(best_effort, "DP_MAX_STATES", 10)
+    monkeypatch.setattr(best_effort, "_TEMPLATES", {})
+    assert best_effort.split_template(((1, 5), (2, 5)), 3, 5) is False
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_dp_subgroup_split_covers_every_node(seed):
+    rng = random.Random(seed)
+    nodes = [Node([{"i": i}], size=rng.choice([1, 1, 2, 3])) for i in range(30)]
+    for shuffle in (None, random.Random(seed)):
+        split = best_effort.dp_subgroup_split(nodes, 3, 5, rng=shuffle)
+        assert split
+        assert all(3 <= sum(x.size for x in group) <= 5 for group in split)
+        assert sorted(id(x) for group in split for x in group) == sorted(
+            id(x) for x in nodes
+        )
+
+
+def split_task(sizes, lo, hi, splitter="sample", seed=0):
+    compact_nodes = [(size, [[]] * size) for size in sizes]
+    search = dict(best_effort.SEARCH_DEFAULTS)
+    return (compact_nodes, lo, hi, splitter, [], [], search, seed, None)
+
+
+def test_split_subgroup_fails_fast_on_infeasible_profile():
+    # Three nodes of size 4 can't be split into groups of 5 to 7.
+    groups, stats = best_effort.split_subgroup(split_task([4, 4, 4], 5, 7))
+    assert groups is None
+    assert stats["template_infeasible"] == 1 and "sampled_splits" not in stats
+    with pytest.raises(RuntimeError):
+        best_effort.split_subgroup(split_task([4, 4, 4], 5, 7, splitter="dp"))
+
+
+def test_split_subgroup_samples_when_template_is_too_large(monkeypatch):
+    monkeypatch.setattr(best_effort, "DP_MAX_STATES", 1)
+    monkeypatch.setattr(best_effort, "_TEMPLATES", {})
+    groups, stats = best_effort.split_subgroup(split_task([1] * 12, 3, 4))
+    assert stats["sampled_splits"] == 1
+    assert sorted(i for group in groups for i in group) == list(range(12))
+    assert all(3 <= len(group) <= 4 for group in groups)
+
+
+def make_subgroups(rng, num_subgroups=4):
+    genders = ["F", "M", "X"]
+    races = ["A", "B", "C", "D"]
+    subgroups = []
+    for s in range(num_subgroups):
+        nodes = [
+            Node(
+                [
+                    {"gender": rng.choice(genders), "race": rng.choice(races)}
+                    for _ in range(size)
+                ],
+                size=size,
+            )
+            for size in (rng.choice([1, 1, 1, 2]) for _ in range(rng.randint(10, 25)))
+        ]
+        path = (("year", s),)
+        subgroups.append((path, 1, nodes, sum(x.size for x in nodes)))
+    return subgroups
+
+
+def match_signature(matches):
+    return [
+        (m.path, sorted((p["gender"], p["race"]) for p in m.node.props))
+        for m in matches
+    ]
+
+
+def test_run_best_effort_is_deterministic_and_within_bounds():
+    config = make_config(
+        {"Best-effort": [["gender", "race"], [1, 1]], "Search": {"restarts": 2}},
+        MIN_GROUP_SIZE=3,
+        MAX_GROUP_SIZE=5,
+    )
+    subgroups = make_subgroups(random.Random(0))
+    runs = []
+    for workers in (1, 1, 2):
+        stats = {}
+        matches = best_effort.run_best_effort(config, subgroups, stats, workers=workers)
+        assert all(3 <= m.node.size <= 5 for m in matches)
+        assert sum(m.node.size for m in matches) == sum(s[3] for s in subgroups)
+        assert stats["final_score"] <= stats["initial_score"]
+        runs.append(match_signature(matches))
+    assert runs[0] == runs[1] == runs[2]
+
+
+def test_split_templates_are_bounded(monkeypatch):
+    monkeypatch.setattr(best_effort, "MAX_TEMPLATES", 2)
+    monkeypatch.setattr(best_effort, "_TEMPLATES", {})
+    best_effort.split_template(((1, 6),), 3, 5)
+    best_effort.split_template(((1, 7),), 3, 5)
+
+    # Reusing a template keeps it, so the least recently used one is evicted instead.
+    best_effort.split_template(((1, 6),), 3, 5)
+    best_effort.split_template(((1, 8),), 3, 5)
+    assert list(best_effort._TEMPLATES) == [(((1, 6),), 3, 5), (((1, 8),), 3, 5)]
+
+
+def test_sampler_counts_iterations_and_retries():
+    nodes = [Node([{}], size=size) for size in [2, 2, 2, 1, 1, 3, 3, 2]]
+    stats = {}
+    split = best_effort.sample_subgroup_split(
+        list(nodes), 3, 4, random.Random(0), [], stats=stats
+    )
+    assert split and stats["sampler_iterations"] >= 1
+    assert stats["sampler_retries"] == stats["sampler_iterations"] - 1
+
+    # An impossible split exhausts every sample.
+    stats = {}
+    nodes = [Node([{}], size=4) for _ in range(3)]
+    assert (
+        best_effort.sample_subgroup_split(
+            nodes, 5, 7, random.Random(0), [], stats=stats
+        )
+        is None
+    )
+    assert stats["sampler_iterations"] == stats["sampler_retries"] == 1001
@@ -0,0 +1,132 @@
+import random
+import pytest
+from conftest import make_config
+from existing_groups import DisjointSet, handle_existing
+from models import Node
+
+
+def explicit_keys_config():
+    return make_config(
+        {
+            "Existing": {
+                "type": "explicit_keys",
+                "flag": "has_group",
+                "data": ["partner1", "partner2"],
+                "id_key": "email",
+            }
+        }
+    )
+
+
+def random_pool(rng, num_students=80):
+    # Students with a group list up to two partners, some of whom aren't in the pool at all.
+    emails = [f"s{i}@example.com" for i in range(num_students)]
+    nodes = []
+    for email in emails:
+        has_group = rng.random() < 0.6
+        partners = [
+            rng.choice(emails + ["gone@example.com"]) if has_group else None
+            for _ in range(2)
+        ]
+        partners = [p if rng.random() < 0.7 else None for p in partners]
+        nodes.append(
+            Node(
+                [
+                    {
+                        "email": email,
+                        "has_group": has_group,
+                        "partner1": partners[0],
+                        "partner2": partners[1],
+                    }
+                ]
+            )
+        )
+    return nodes
+
+
+def reference_components(nodes):
+    # Components of the undirected partner graph over flagged students, by searching from
+    # every unvisited student.
+    props = [node.props[0] for node in nodes]
+    pool = {prop["email"]: prop for prop in props if prop["has_group"]}
+    neighbors = {key: set() for key in pool}
+    for key, prop in pool.items():
+        for partner in (prop["partner1"], prop["partner2"]):
+            if partner in pool:
+                neighbors[key].add(partner)
+                neighbors[partner].add(key)
+    seen, components = set(), set()
+    for key in pool:
+        if key in seen:
+            continue
+        component, queue = set(), [key]
+        while queue:
+            at = queue.pop()
+            if at in seen:
+                continue
+            seen.add(at)
+            component.add(at)
+            queue.extend(neighbors[at] - seen)
+        components.add(frozenset(component))
+    return components
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_explicit_keys_components_match_graph_search(seed):
+    nodes = random_pool(random.Random(seed))
+    expected = reference_components(nodes)
+    unflagged = [node for node in nodes if not node.props[0]["has_group"]]
+
+    report = {}
+    matches = handle_existing(explicit_keys_config(), nodes, report=report)
+    components = {frozenset(p["email"] for p in m.node.props) for m in matches}
+    assert components == expected
+    assert {frozenset(c) for c in report["components"]} == expected
+    assert all(m.source == "existing" and m.node.assigned for m in matches)
+
+    # Unflagged students stay in the pool, in their original order.
+    assert nodes == unflagged
+
+
+def test_explicit_keys_annotations_and_dangling():
+    nodes = [
+        Node([{"email": "a", "has_group": True, "partner1": "b", "partner2": "x"}]),
+        Node([{"email": "b", "has_group": True, "partner1": None, "partner2": None}]),
+        Node([{"email": "c", "has_group": False, "partner1": None, "partner2": None}]),
+    ]
+    report = {}
+    matches = handle_existing(explicit_keys_config(), nodes, report=report)
+    assert len(matches) == 1 and matches[0].node.size == 2
+    assert report["dangling"] == [("a", "x")]
+    a, b = sorted(matches[0].node.props, key=lambda p: p["email"])
+    assert a["incoming_partners"] == ["a"] and b["incoming_partners"] == ["b", "a"]
+    assert a["outgoing_partners"][0] == "b"
+    assert a["outgoing_partners"][1].startswith("x (this person did not fill out")
+
+
+def test_min_sid_groups_by_key():
+    config = make_config(
+        {"Existing": {"type": "min_sid", "flag": "has_group", "data": ["group_sid"]}}
+    )
+    nodes = [
+        Node([{"sid": i, "has_group": i % 3 != 0, "group_sid": i % 2}])
+        for i in range(9)
+    ]
+    matches = handle_existing(config, nodes)
+    assert sorted(sorted(p["sid"] for p in m.node.props) for m in matches) == [
+        [1, 5, 7],
+        [2, 4, 8],
+    ]
+    assert [node.props[0]["sid"] for node in nodes] == [0, 3, 6]
+
+
+def test_disjoint_set():
+    components = DisjointSet()
+    for key in range(6):
+        components.add(key)
+    components.union(0, 1)
+    components.union(2, 3)
+    components.union(1, 3)
+    assert len({components.find(key) for key in range(4)}) == 1
+    assert components.find(4) != components.find(5)
+    assert components.size[components.find(0)] == 4
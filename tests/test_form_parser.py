@@ -0,0 +1,95 @@
+import pytest
+import form_parser
+from models import Column, Row
+
+CSV = """Timestamp,SID,Email,Year,Remote,Days,Days,Hours,Score,Notes,
+t,3030000000,a@berkeley.edu,Senior,Yes,"Monday, Tuesday",Monday,3,1.5, hi ,
+t,3030000001,b@berkeley.edu,Junior,No,,Friday,,NA,,
+
+t,3030000002,"Carol <c@berkeley.edu>",Junior,No,Sunday,,N/A,2,null
+t,3030000003,d@berkeley.edu,Freshman,Yes,"Monday",Tuesday,10,,x,y
+"""
+
+YEARS = {"Freshman": 1, "Sophomore": 2, "Junior": 3, "Senior": 4}
+
+ROW_CONFIG = Row(
+    [
+        Column("SID", "sid", "sid"),
+        Column("Email", "email", "email"),
+        Column("Year", "year", "radio", transformer=lambda x: YEARS[x]),
+        Column("Remote", "remote", "boolean"),
+        Column("Days", "days", "checkbox", is_optional=True),
+        Column("Days.1", "other_days", "checkbox", is_optional=True),
+        Column("Hours", "hours", "int", is_optional=True),
+        Column("Score", "score", "float", is_optional=True),
+        Column("Notes", "notes", "text", is_optional=True),
+        Column("Unnamed: 10", "blank", "text", is_optional=True),
+    ]
+)
+
+
+def parse(path, engine):
+    return [
+        node.props[0]
+        for node in form_parser.parse_from_csv(path, ROW_CONFIG, engine=engine)
+    ]
+
+
+def test_engines_agree(tmp_path):
+    # The csv module engine stands in for Pandas on small files, so it has to give exactly
+    # the same props, down to the types of missing and numeric values.
+    pytest.importorskip("pandas")
+    path = tmp_path / "roster.csv"
+    path.write_text(CSV)
+    with_csv, with_pandas = parse(path, "csv"), parse(path, "pandas")
+    assert with_csv == with_pandas
+    for a, b in zip(with_csv, with_pandas):
+        assert [type(x) for x in a.values()] == [type(x) for x in b.values()]
+
+
+def test_csv_engine_values(tmp_path):
+    path = tmp_path / "roster.csv"
+    path.write_text(CSV)
+    props = parse(path, "csv")
+    assert len(props) == 4
+    assert props[0]["days"] == ["Monday", "Tuesday"]
+    assert props[0]["other_days"] == ["Monday"]
+    assert props[0]["hours"] == 3 and props[1]["hours"] is None
+    assert props[1]["score"] is None and props[2]["hours"] is None
+    assert props[0]["notes"] == "hi" and props[2]["notes"] is None
+    assert props[3]["blank"] == "y"
+    assert [x["year"] for x in props] == [4, 3, 3, 1]
+
+
+def test_auto_engine_uses_csv_module_for_small_files(tmp_path, monkeypatch):
+    path = tmp_path / "roster.csv"
+    path.write_text(CSV)
+    monkeypatch.setattr(
+        form_parser,
+        "parse_with_pandas",
+        lambda *args, **kwargs: pytest.fail("Pandas used for a small file"),
+    )
+    assert parse(path, "auto") == parse(path, "csv")
+
+
+def test_compile_plan_reuses_and_evicts_plans(monkeypatch):
+    monkeypatch.setattr(form_parser, "_PLANS", {})
+    monkeypatch.setattr(form_parser, "MAX_PLANS", 2)
+    header = ["SID", "Email", "Year"]
+    row_configs = [
+        Row([Column("SID", "sid", "sid")]),
+        Row([Column("Email", "email", "email")]),
+        Row([Column("Year", "year", "radio")]),
+    ]
+    first = form_parser.compile_plan(header, row_configs[0])
+    assert [(i, col_id) for i, col_id, _ in first] == [(0, "sid")]
+    assert form_parser.compile_plan(list(header), row_configs[0]) is first
+
+    # Reusing a plan keeps it, so the least recently used one is evicted instead.
+    form_parser.compile_plan(header, row_configs[1])
+    form_parser.compile_plan(header, row_configs[0])
+    form_parser.compile_plan(header, row_configs[2])
+    assert [key[1] for key in form_parser._PLANS] == [row_configs[0], row_configs[2]]
+    assert form_parser.compile_plan(header, row_configs[0]) is first
+    assert form_parser.compile_plan(header, row_configs[1]) is not None
+    assert len(form_parser._PLANS) == 2
@@ -0,0 +1,227 @@
+import csv
+import random
+import pytest
+import best_effort
+import incremental
+import partitioning
+import result_writer
+from conftest import make_config
+from models import Match, Node
+from validation import validate_matches
+
+
+def make_config_for_years():
+    return make_config(
+        {"Partition": ["year", "remote"]}, MIN_GROUP_SIZE=3, MAX_GROUP_SIZE=5
+    )
+
+
+def make_roster(seed, num_students=60, first_sid=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "sid": first_sid + i,
+            "year": rng.choice(["2025", "2026"]),
+            "remote": rng.choice([True, False]),
+        }
+        for i in range(num_students)
+    ]
+
+
+def nodes_of(records):
+    return [Node([dict(record)]) for record in records]
+
+
+def full_run(config, records, path):
+    nodes = nodes_of(records)
+    subgroups = partitioning.run_multi_partitioning(config, nodes)
+    matches = best_effort.run_best_effort(config, subgroups)
+    result_writer.write_matches(matches, path=str(path))
+    return matches
+
+
+def group_of(matches, group_nums):
+    return {
+        prop["sid"]: group_num
+        for group_num, match in zip(group_nums, matches)
+        for prop in match.node.props
+    }
+
+
+def check_coverage(config, matches, nodes):
+    records = [node.props[0] for node in nodes]
+    result = validate_matches(config, matches, records)
+    assert "coverage" not in result["counts"]
+
+
+def test_identical_roster_keeps_every_group(tmp_path):
+    config = make_config_for_years()
+    records = make_roster(0)
+    previous = full_run(config, records, tmp_path / "out.csv")
+    nodes = nodes_of(records)
+    matches, group_nums, stats = incremental.run_incremental(
+        config, str(tmp_path / "out.csv"), nodes
+    )
+    assert group_of(matches, group_nums) == group_of(previous, range(len(previous)))
+    assert stats["kept"] == len(records)
+    assert (
+        stats["new"] == stats["changed"] == stats["removed"] == stats["new_groups"] == 0
+    )
+    assert stats["uncompared"] == []
+    assert [m.path for m in matches] == [m.path for m in previous]
+    check_coverage(config, matches, nodes)
+
+
+def test_new_changed_and_removed_students(tmp_path):
+    config = make_config_for_years()
+    records = make_roster(1)
+    previous = full_run(config, records, tmp_path / "out.csv")
+    before = group_of(previous, range(len(previous)))
+
+    # Drop a few students, change one student's year and add a batch of new ones.
+    updated = [dict(record) for record in records[3:]]
+    updated[0]["year"] = "2025" if updated[0]["year"] == "2026" else "2026"
+    updated += make_roster(2, num_students=12, first_sid=1000)
+    nodes = nodes_of(updated)
+    matches, group_nums, stats = incremental.run_incremental(
+        config, str(tmp_path / "out.csv"), nodes
+    )
+    assert stats["removed"] == 3 and stats["changed"] == 1 and stats["new"] == 12
+    check_coverage(config, matches, nodes)
+
+    # Everybody who wasn't changed stays in their previous group unless it was dissolved.
+    after = group_of(matches, group_nums)
+    moved = {
+        sid
+        for sid, group_num in after.items()
+        if sid in before and before[sid] != group_num
+    }
+    assert moved <= {updated[0]["sid"]} | {
+        prop["sid"]
+        for group_num, match in enumerate(previous)
+        if group_num not in group_nums
+        for prop in match.node.props
+    }
+
+    # New and changed students only join groups whose partition path they satisfy.
+    for match in matches:
+        if isinstance(match.path, tuple):
+            for prop in match.node.props:
+                assert incremental.is_compatible(
+                    Node([prop]), tuple((col, str(val)) for col, val in match.path)
+                )
+
+
+def write_previous(path, groups):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group_num", "sid", "year", "remote", "path"])
+        for group_num, (group_path, sids) in enumerate(groups):
+            for sid in sids:
+                writer.writerow([group_num, sid, "2025", "True", str(group_path)])
+
+
+def test_groups_left_too_small_are_dissolved(tmp_path):
+    config = make_config({"Partition": ["year", "remote"]}, MIN_GROUP_SIZE=3)
+    path = (("year", "2025"), ("remote", True))
+    write_previous(tmp_path / "out.csv", [(path, [0, 1, 2]), (path, [3, 4, 5, 6])])
+    records = [
+        {"sid": sid, "year": "2025", "remote": True} for sid in [0, 1, 3, 4, 5, 6]
+    ]
+    nodes = nodes_of(records)
+    matches, group_nums, stats = incremental.run_incremental(
+        config, str(tmp_path / "out.csv"), nodes
+    )
+    assert stats["dissolved"] == 1 and stats["slotted"] == 2 and stats["removed"] == 1
+    assert group_nums == [1] and matches[0].node.size == 6
+    check_coverage(config, matches, nodes)
+
+
+def test_previous_path():
+    assert incremental.previous_path("") is None
+    assert incremental.previous_path("(manually fixed)") == "(manually fixed)"
+    assert incremental.previous_path("[['year', '2025']]") == (("year", "2025"),)
+    assert incremental.parse_path("(('year', 2025),)") == (("year", "2025"),)
+    assert incremental.parse_path("None") is None
+
+
+def test_missing_key_columns(tmp_path):
+    config = make_config_for_years()
+    records = make_roster(3, num_students=10)
+    full_run(config, records, tmp_path / "out.csv")
+    with pytest.raises(UserWarning, match="has no email column"):
+        incremental.run_incremental(
+            config, str(tmp_path / "out.csv"), nodes_of(records), key="email"
+        )
+    with pytest.raises(UserWarning, match="roster has no column ID 'sid'"):
+        incremental.run_incremental(
+            config,
+            str(tmp_path / "out.csv"),
+            [Node([{"id": 0, "year": "2025", "remote": True}])],
+        )
+
+
+def explicit_keys_config():
+    return make_config(
+        {
+            "Partition": ["year", "remote"],
+            "Existing": {
+                "type": "explicit_keys",
+                "flag": "has_group",
+                "data": ["partner"],
+                "id_key": "email",
+            },
+        }
+    )
+
+
+def flagged_node(email, partner):
+    return Node([{"email": email, "has_group": True, "partner": partner}])
+
+
+def test_connected_flagged_follows_links_both_ways():
+    # a -> b <- c and d -> e; only the requested group with somebody in the pool (c) matters.
+    nodes = [
+        flagged_node("a", "b"),
+        flagged_node("b", None),
+        flagged_node("c", "b"),
+        flagged_node("d", "e"),
+        flagged_node("e", None),
+    ]
+    connected = incremental.connected_flagged(explicit_keys_config(), nodes, [nodes[2]])
+    assert [node.props[0]["email"] for node in connected] == ["a", "b", "c"]
+    assert incremental.connected_flagged(explicit_keys_config(), nodes, []) == []
+
+    config = make_config(
+        {"Existing": {"type": "min_sid", "flag": "has_group", "data": ["group_sid"]}}
+    )
+    nodes = [Node([{"has_group": True, "group_sid": i % 3}]) for i in range(9)]
+    connected = incremental.connected_flagged(config, nodes, [nodes[4]])
+    assert connected == nodes[1::3]
+
+
+def test_new_student_joins_partner_group(tmp_path):
+    # A new student naming a student who kept their group joins it, and the other requested
+    # group is left alone.
+    path = (("year", "2025"), ("remote", True))
+    with open(tmp_path / "out.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group_num", "email", "year", "remote", "path"])
+        for group_num, emails in enumerate([["a", "b", "c"], ["d", "e", "f"]]):
+            for email in emails:
+                writer.writerow([group_num, email, "2025", "True", str(path)])
+    records = [
+        {"email": email, "year": "2025", "remote": True, "has_group": True}
+        for email in "abcdefg"
+    ]
+    for record, partner in zip(records, ["b", "c", "a", "e", "f", "d", "e"]):
+        record["partner"] = partner
+    matches, group_nums, stats = incremental.run_incremental(
+        explicit_keys_config(),
+        str(tmp_path / "out.csv"),
+        nodes_of(records),
+        key="email",
+    )
+    members = [sorted(p["email"] for p in m.node.props) for m in matches]
+    assert members == [["a", "b", "c"], ["d", "e", "f", "g"]] and group_nums == [0, 1]
+    assert stats["new"] == 1 and stats["new_groups"] == 0
@@ -0,0 +1,61 @@
+import json
+import sys
+import instrumentation
+
+
+def test_stages_nest_and_count():
+    profiler = instrumentation.enable()
+    try:
+        with instrumentation.stage("outer"):
+            with instrumentation.stage("inner"):
+                instrumentation.count("nodes", 3)
+            instrumentation.count("nodes")
+    finally:
+        instrumentation.disable()
+    report = profiler.report()
+    assert [stage["path"] for stage in report["stages"]] == ["outer", "outer;inner"]
+    assert report["counters"] == {"nodes": 4}
+    assert all(stage["max_rss_kb"] > 0 for stage in report["stages"])
+    assert [line.split()[0] for line in profiler.collapsed_stacks()] == [
+        "outer",
+        "outer;inner",
+    ]
+
+
+def test_stages_without_resource_module(monkeypatch):
+    # Platforms without the resource module (e.g. Windows) get no RSS figures.
+    monkeypatch.setitem(sys.modules, "resource", None)
+    assert instrumentation.max_rss_kb() is None
+    profiler = instrumentation.Profiler()
+    with profiler.stage("parse"):
+        pass
+    (stage,) = profiler.report()["stages"]
+    assert stage["max_rss_kb"] is None and "max_rss_growth_kb" not in stage
+
+
+def test_hooks_are_noops_when_disabled():
+    with instrumentation.stage("anything") as entry:
+        instrumentation.count("nodes")
+    assert entry is None
+
+
+def test_profile_reports_sampler_counters(tmp_path):
+    from test_run import run_cli
+    import benchmark
+
+    benchmark.generate_roster(str(tmp_path / "roster.csv"), 200, seed=6)
+    (tmp_path / "config.py").write_text(
+        "from example_config import *\n\npost_processing = None\n"
+    )
+    result = run_cli(
+        "config.py", "roster.csv", "--profile", "profile.json", cwd=tmp_path
+    )
+    assert result.returncode == 0, result.stderr
+    with open(tmp_path / "profile.json") as f:
+        report = json.load(f)
+    counters = report["counters"]
+    assert counters["sampler_retries"] <= counters["sampler_iterations"]
+    assert counters["nodes"] == 200
+    assert {"import_config", "parse_csv", "best_effort"} <= {
+        stage["name"] for stage in report["stages"]
+    }
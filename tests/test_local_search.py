@@ -0,0 +1,114 @@
+import random
+import pytest
+from local_search import GroupObjective, local_search
+from models import Node
+
+FEATURES = ["gender", "race", "days"]
+WEIGHTS = [1, 2, 0.5]
+
+
+def random_groups(rng, num_groups=6):
+    groups = []
+    for _ in range(num_groups):
+        group = []
+        for _ in range(rng.randint(3, 5)):
+            size = rng.choice([1, 1, 2])
+            props = [
+                {
+                    "gender": rng.choice(["F", "M", None]),
+                    "race": rng.choice(["A", "B", "C"]),
+                    "days": rng.choice([["Mon"], ["Mon", "Tue"], ["Tue"]]),
+                }
+                for _ in range(size)
+            ]
+            group.append(Node(props, size=size))
+        groups.append(group)
+    return groups
+
+
+def score(groups):
+    # Recompute the objective from scratch: every value held by exactly one member of a group
+    # costs its feature's weight.
+    total = 0
+    for group in groups:
+        for col, weight in zip(FEATURES, WEIGHTS):
+            counts = {}
+            for node in group:
+                for prop in node.props:
+                    value = prop[col]
+                    if value is not None:
+                        value = tuple(value) if isinstance(value, list) else value
+                        counts[value] = counts.get(value, 0) + 1
+            total += weight * sum(1 for count in counts.values() if count == 1)
+    return total
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_deltas_match_recomputed_scores(seed):
+    rng = random.Random(seed)
+    objective = GroupObjective(FEATURES, WEIGHTS, random_groups(rng))
+    assert objective.score == pytest.approx(score(objective.groups()))
+    num_groups = len(objective.sizes)
+    for _ in range(200):
+        i = rng.randrange(len(objective.nodes))
+        if rng.random() < 0.5:
+            h = rng.choice([g for g in range(num_groups) if g != objective.group_of[i]])
+            delta = objective.delta_move(i, h)
+            before = objective.score
+            objective.move(i, h, delta)
+        else:
+            j = rng.randrange(len(objective.nodes))
+            if objective.group_of[i] == objective.group_of[j]:
+                continue
+            delta = objective.delta_swap(i, j)
+            before = objective.score
+            objective.swap(i, j, delta)
+        expected = score(objective.groups())
+        assert objective.score == pytest.approx(expected)
+        assert before + delta == pytest.approx(expected)
+        for g in range(num_groups):
+            members = objective.members[g]
+            assert objective.sizes[g] == sum(objective.nodes[i].size for i in members)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_local_search_improves_within_bounds(seed):
+    groups = random_groups(random.Random(seed))
+    initial = score(groups)
+    objective = GroupObjective(FEATURES, WEIGHTS, groups)
+    stats = {}
+    result = local_search(
+        objective, 3, 8, random.Random(seed), max_iterations=2000, stats=stats
+    )
+    assert score(result) <= initial
+    assert all(3 <= sum(node.size for node in group) <= 8 for group in result)
+    assert sorted(id(node) for group in result for node in group) == sorted(
+        id(node) for group in groups for node in group
+    )
+    assert 0 < stats["search_iterations"] <= 2000
+
+
+def test_local_search_is_deterministic():
+    runs = []
+    for _ in range(2):
+        objective = GroupObjective(FEATURES, WEIGHTS, random_groups(random.Random(3)))
+        position = {id(node): i for i, node in enumerate(objective.nodes)}
+        result = local_search(objective, 3, 8, random.Random(7), max_iterations=500)
+        runs.append([[position[id(node)] for node in group] for group in result])
+    assert runs[0] == runs[1]
+
+
+def test_default_iteration_budget_matches_search_defaults():
+    from best_effort import SEARCH_DEFAULTS
+    from local_search import ITERATIONS_PER_NODE
+
+    # A lone "X" is isolated wherever it goes, so the search never stops early.
+    groups = [
+        [Node([{"gender": g}]) for g in "FFM"],
+        [Node([{"gender": g}]) for g in "MMX"],
+    ]
+    objective = GroupObjective(["gender"], [1], groups)
+    stats = {}
+    local_search(objective, 1, 6, random.Random(0), stats=stats)
+    assert SEARCH_DEFAULTS["iterations"] == ITERATIONS_PER_NODE
+    assert stats["search_iterations"] == ITERATIONS_PER_NODE * 6
@@ -0,0 +1,47 @@
+import sys
+import pytest
+from models import Match, Node
+
+
+def test_nodes_and_matches_have_no_instance_dict():
+    node = Node([{"sid": 1}])
+    match = Match(node)
+    for obj in (node, match):
+        assert not hasattr(obj, "__dict__")
+        with pytest.raises(AttributeError):
+            obj.extra = True
+
+
+def test_combine():
+    a = Node([{"sid": 1}, {"sid": 2}], size=2, rows=[0, 1])
+    b = Node([{"sid": 3}], rows=[2])
+    combined = Node.combine([a, b])
+    assert [prop["sid"] for prop in combined.props] == [1, 2, 3]
+    assert combined.size == 3 and combined.assigned and combined.rows == [0, 1, 2]
+
+    # Props dicts are shared rather than copied, and the inputs are left alone.
+    assert combined.props[0] is a.props[0] and a.size == 2 and len(a.props) == 2
+
+    # Row indices are only kept if every input has them.
+    assert Node.combine([a, Node([{"sid": 4}])], assigned=False).rows is None
+
+
+def test_merge_and_add_keep_rows_in_step():
+    a = Node([{"sid": 1}], rows=[0])
+    a.merge(Node([{"sid": 2}], rows=[1], assigned=True))
+    assert a.size == 2 and a.assigned and a.rows == [0, 1]
+    assert (a + Node([{"sid": 3}], rows=[2])).rows == [0, 1, 2]
+    a.merge(Node([{"sid": 3}]))
+    assert a.rows is None and len(a.props) == 3
+
+
+def test_memory_footprint():
+    props = [{"sid": i, "name": f"student {i}"} for i in range(10)]
+    node = Node(props, size=10)
+    shallow = sys.getsizeof(node) + sys.getsizeof(props)
+    assert node.memory_footprint() == shallow
+    assert node.memory_footprint(deep=True) == shallow + sum(map(sys.getsizeof, props))
+    with_rows = Node(props, size=10, rows=list(range(10)))
+    assert with_rows.memory_footprint() == shallow + sys.getsizeof(with_rows.rows)
+    match = Match(node)
+    assert match.memory_footprint() == sys.getsizeof(match) + node.memory_footprint()
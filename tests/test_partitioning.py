@@ -0,0 +1,203 @@
+import random
+import pytest
+import partitioning
+from conftest import make_config
+from models import Node
+
+
+def reference_uniquify_assignments(config, groups):
+    # uniquify_assignments as it was before selecting groups from a heap: a scan over every
+    # remaining group per selection.
+    output = []
+    phase_counter = 0
+    phase_min_cutoffs = [config.min_group_size, config.min_group_size // 2, 1]
+    phase_max_cutoffs = [config.max_group_size, config.max_group_size * 3, float("inf")]
+    while True:
+        min_so_far = float("inf")
+        groups = [group for group in groups if group[2]]
+        selected_group = None
+        for group in groups:
+            for i in range(len(group[2]) - 1, -1, -1):
+                if group[2][i].assigned:
+                    del group[2][i]
+            min_group_size = phase_min_cutoffs[phase_counter]
+            max_group_size = phase_max_cutoffs[phase_counter]
+            group_count = sum(x.size for x in group[2])
+            if (
+                group_count < min_so_far
+                and min_group_size <= group_count <= max_group_size
+            ):
+                min_so_far = group_count
+                selected_group = group
+        if not selected_group:
+            if phase_counter == len(phase_min_cutoffs):
+                break
+            phase_counter += 1
+            continue
+        for elem in selected_group[2]:
+            elem.assigned = True
+        groups.remove(selected_group)
+        selected_group = list(selected_group)
+        selected_group[3] = sum(node.size for node in selected_group[2])
+        output.append(tuple(selected_group))
+    return output
+
+
+def reference_bottom_up_merge(config, groups):
+    # bottom_up_merge as it was before indexing groups in a PathTrie: a scan over every
+    # remaining group for each level of ancestors.
+    merged_groups = []
+    groups = sorted(groups, key=lambda x: len(x[0]))
+    while groups:
+        at = groups.pop()
+        if at[3] > config.min_group_size or at[3] >= config.max_group_size:
+            merged_groups.append(at)
+            continue
+        at_path = next_at_path = at[0]
+        num_ancestors = 0
+        while num_ancestors + at[3] <= config.min_group_size:
+            at_path = next_at_path
+            ancestors = [
+                group for group in groups if tuple(group[0][: len(at_path)]) == at_path
+            ]
+            num_ancestors = sum(group[3] for group in ancestors)
+            next_at_path = at_path[:-1]
+            if not next_at_path:
+                break
+        ancestors = sorted(ancestors, key=lambda x: x[3])
+        num_needed = 0
+        while at[3] + sum(
+            x[3] for x in ancestors[:num_needed]
+        ) <= config.min_group_size and num_needed <= len(ancestors):
+            num_needed += 1
+        ancestors = ancestors[:num_needed]
+        for ancestor in ancestors:
+            groups.remove(ancestor)
+        merged_groups.append(
+            (
+                at_path,
+                len(at_path) - 1,
+                sum((x[2] for x in ancestors), []) + at[2],
+                sum(x[3] for x in ancestors) + at[3],
+            )
+        )
+    return merged_groups
+
+
+def random_provisional_groups(rng, num_nodes=60, num_groups=40):
+    # Overlapping groups of nodes (as DFS produces for checkbox columns) with random paths.
+    nodes = [Node([{"i": i}], size=rng.choice([1, 1, 1, 2])) for i in range(num_nodes)]
+    groups = []
+    for _ in range(num_groups):
+        members = rng.sample(nodes, rng.randint(1, 12))
+        path = tuple(("c", rng.randrange(3)) for _ in range(rng.randint(1, 3)))
+        groups.append((path, len(path), members, sum(x.size for x in members)))
+    return nodes, groups
+
+
+def signature(groups):
+    return [(g[0], g[1], [x.props[0]["i"] for x in g[2]], g[3]) for g in groups]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_uniquify_assignments_matches_reference(seed):
+    config = make_config(MIN_GROUP_SIZE=3, MAX_GROUP_SIZE=5)
+    results = []
+    for uniquify in (partitioning.uniquify_assignments, reference_uniquify_assignments):
+        _, groups = random_provisional_groups(random.Random(seed))
+        results.append(signature(uniquify(config, groups)))
+    assert results[0] == results[1]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_uniquify_assignments_assigns_every_node_once(seed):
+    config = make_config(MIN_GROUP_SIZE=3, MAX_GROUP_SIZE=5)
+    nodes, groups = random_provisional_groups(random.Random(seed))
+    output = partitioning.uniquify_assignments(config, groups)
+    assigned = [x.props[0]["i"] for group in output for x in group[2]]
+    in_groups = {x.props[0]["i"] for group in groups for x in group[2]}
+    assert sorted(assigned) == sorted(in_groups)
+    assert all(group[3] == sum(x.size for x in group[2]) for group in output)
+
+
+def random_tentative_groups(rng, num_groups=50):
+    groups = []
+    for i in range(num_groups):
+        path = tuple(("c", rng.randrange(2)) for _ in range(rng.randint(1, 4)))
+        size = rng.randint(1, 7)
+        groups.append((path, len(path), [Node([{"i": i}], size=size)], size))
+    return groups
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_bottom_up_merge_matches_reference(seed):
+    config = make_config(MIN_GROUP_SIZE=3, MAX_GROUP_SIZE=6)
+    groups = random_tentative_groups(random.Random(seed))
+    expected = signature(reference_bottom_up_merge(config, list(groups)))
+    assert signature(partitioning.bottom_up_merge(config, list(groups))) == expected
+
+
+def test_path_trie_totals():
+    trie = partitioning.PathTrie()
+    a = trie.insert((("x", 1), ("y", 2)), 3, 0)
+    b = trie.insert((("x", 1),), 4, 1)
+    trie.insert((("x", 2),), 5, 2)
+    assert trie.total == 12 and b.total == 7 and a.total == 3
+    a.remove(3)
+    assert trie.total == 9 and b.total == 4 and a.total == 0
+
+
+def test_build_partition_index():
+    nodes = [
+        Node([{"year": 1, "days": ["Mon", "Tue"]}]),
+        Node([{"year": 2, "days": ["Tue"]}]),
+        Node([{"year": 1, "days": None}]),
+    ]
+    col_set, index = partitioning.build_partition_index(["year", "days"], nodes)
+    assert col_set == [("year", [1, 2]), ("days", ["Mon", "Tue", None])]
+    assert index["year"] == {1: {0, 2}, 2: {1}}
+    assert index["days"] == {"Mon": {0}, "Tue": {0, 1}, None: {2}}
+
+
+def random_roster(rng, num_students=300):
+    years = ["2024", "2025", "2026", None]
+    days = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+    return [
+        Node(
+            [
+                {
+                    "year": rng.choice(years),
+                    "online": rng.choice([True, False]),
+                    "days": rng.sample(days, rng.randint(0, 3)) or None,
+                }
+            ]
+        )
+        for _ in range(num_students)
+    ]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_build_partition_index_from_table_matches_props(seed):
+    from student_table import StudentTable
+
+    rng = random.Random(seed)
+    nodes = random_roster(rng)
+    table = StudentTable.from_nodes(nodes)
+
+    # Index a subset, in a shuffled order, to exercise the row mapping too.
+    subset = rng.sample(nodes, 200)
+    cols = ["days", "year", "online"]
+    expected = partitioning.build_partition_index(cols, subset)
+    assert partitioning.build_partition_index(cols, subset, table=table) == expected
+
+
+def test_build_partition_index_ignores_partial_table():
+    from student_table import StudentTable
+
+    nodes = random_roster(random.Random(0), 50)
+    table = StudentTable.from_nodes(nodes, columns=["year"])
+    expected = partitioning.build_partition_index(["year", "days"], nodes)
+    assert (
+        partitioning.build_partition_index(["year", "days"], nodes, table=table)
+        == expected
+    )
@@ -0,0 +1,98 @@
+import itertools
+import random
+import pytest
+import planner
+from partitioning import build_partition_index
+from models import Node
+
+
+def random_nodes(rng, num_students=200):
+    days = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+    return [
+        Node(
+            [
+                {
+                    "year": rng.choice(["2024", "2025", "2026"]),
+                    "remote": rng.choice([True, False]),
+                    "days": (
+                        rng.sample(days, rng.randint(1, 3))
+                        if rng.random() < 0.9
+                        else None
+                    ),
+                    "time": rng.choice(["AM", "PM", "Evening", None]),
+                }
+            ]
+        )
+        for _ in range(num_students)
+    ]
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_gather_statistics_matches_brute_force(seed):
+    cols = ["year", "days", "remote", "time"]
+    nodes = random_nodes(random.Random(seed))
+    _, index = build_partition_index(cols, nodes)
+    stats = planner.gather_statistics(cols, nodes, index)
+
+    assert stats["num_nodes"] == len(nodes)
+    for col in cols:
+        held = [as_list(node.props[0][col]) for node in nodes]
+        assert stats["cardinality"][col] == len({v for values in held for v in values})
+        assert stats["fanout"][col] == pytest.approx(
+            sum(len(set(values)) for values in held) / len(nodes)
+        )
+    for a, b in itertools.permutations(cols, 2):
+        combos = {
+            (x, y)
+            for node in nodes
+            for x in as_list(node.props[0][a])
+            for y in as_list(node.props[0][b])
+        }
+        assert stats["pairs"][(a, b)] == len(combos)
+
+
+def test_plan_partition_picks_cheapest_order():
+    cols = ["year", "days", "remote", "time"]
+    nodes = random_nodes(random.Random(0))
+    _, index = build_partition_index(cols, nodes)
+    stats = planner.gather_statistics(cols, nodes, index)
+    plan = planner.plan_partition(cols, stats, 4)
+
+    cheapest = min(
+        planner.plan_cost(planner.estimate_branches(list(order), stats, 4))
+        for order in itertools.permutations(cols)
+    )
+    assert planner.plan_cost(plan["estimated"]) == cheapest
+    assert plan["author_order"] == cols
+    assert plan["estimated"] == planner.estimate_branches(plan["order"], stats, 4)
+
+
+def test_plan_partition_respects_tiers():
+    cols = ["year", "days", "remote", "time"]
+    nodes = random_nodes(random.Random(1))
+    _, index = build_partition_index(cols, nodes)
+    stats = planner.gather_statistics(cols, nodes, index)
+
+    assert planner.plan_partition(cols, stats, 4, tiers=False)["order"] == cols
+    plan = planner.plan_partition(
+        cols, stats, 4, tiers=[["days", "year"], ["time", "remote"]]
+    )
+    assert sorted(plan["order"][:2]) == ["days", "year"]
+    assert sorted(plan["order"][2:]) == ["remote", "time"]
+    with pytest.raises(AssertionError):
+        planner.plan_partition(cols, stats, 4, tiers=[["year"], ["days"]])
+
+
+def test_plan_tier_greedy_for_large_tiers(monkeypatch):
+    cols = ["year", "days", "remote", "time"]
+    nodes = random_nodes(random.Random(2))
+    _, index = build_partition_index(cols, nodes)
+    stats = planner.gather_statistics(cols, nodes, index)
+    monkeypatch.setattr(planner, "MAX_EXHAUSTIVE_TIER", 1)
+    order = planner.plan_tier(cols, [], stats, 4)
+    assert sorted(order) == sorted(cols)
+    assert "Estimated cost" in planner.explain(planner.plan_partition(cols, stats, 4))
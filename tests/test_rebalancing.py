@@ -0,0 +1,198 @@
+import random
+import pytest
+import rebalancing
+from conftest import make_config
+from models import Match, Node
+from validation import Validator
+
+
+def is_female(prop):
+    return prop["gender"] == "F"
+
+
+def is_hispanic(prop):
+    return "Hispanic" in prop["race"]
+
+
+def is_black(prop):
+    return "Black" in prop["race"]
+
+
+RULES = [
+    ["female", is_female],
+    ["hispanic", is_hispanic],
+    ["black", is_black],
+]
+
+
+def reference_apply_rules(matches, rules, skip):
+    # The hand-written pairing loops apply_rules replaced, generalized to any list of rules:
+    # rescan every group for each rule and move isolated members from the larger half of the
+    # groups into the smaller half, without any bounds on group sizes (or partition paths).
+    for rule in rules:
+        predicate = rule[1]
+        isolated = [
+            match
+            for match in matches
+            if match.source != "existing"
+            and not skip(match)
+            and sum(1 for x in match.node.props if predicate(x)) == 1
+        ]
+        isolated = sorted(isolated, key=lambda x: x.size, reverse=True)
+        half = len(isolated) // 2
+        for i in range(half):
+            member = [x for x in isolated[i].node.props if predicate(x)][0]
+            isolated[i].node.size -= 1
+            isolated[i].node.props.remove(member)
+            isolated[i + half].node.size += 1
+            isolated[i + half].node.props.append(member)
+    return matches
+
+
+def random_matches(rng, num_groups=40, num_years=1):
+    genders = ["F", "M", "X"]
+    races = [["Hispanic"], ["Black"], ["Asian"], ["White"], ["Black", "Hispanic"]]
+    matches = []
+    for g in range(num_groups):
+        year = rng.randrange(num_years)
+        props = [
+            {
+                "sid": (g, k),
+                "year": year,
+                "gender": rng.choice(genders),
+                "race": rng.choice(races),
+            }
+            for k in range(rng.randint(2, 7))
+        ]
+        source = "existing" if rng.random() < 0.1 else "path"
+        path = "(singleton manually fixed)" if rng.random() < 0.1 else (("year", year),)
+        matches.append(Match(Node(props, size=len(props)), source=source, path=path))
+    return matches
+
+
+def signature(matches):
+    return [
+        (m.source, m.path, m.size, [p["sid"] for p in m.node.props]) for m in matches
+    ]
+
+
+def skip_fixed(match):
+    return match.path == "(singleton manually fixed)"
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_apply_rules_matches_hand_written_loops(seed):
+    expected = reference_apply_rules(
+        random_matches(random.Random(seed)), RULES, skip_fixed
+    )
+    matches = rebalancing.apply_rules(
+        random_matches(random.Random(seed)), RULES, 0, float("inf"), skip=skip_fixed
+    )
+    assert signature(matches) == signature(expected)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_apply_rules_keeps_group_sizes_within_bounds(seed):
+    matches = random_matches(random.Random(seed))
+    before = sum(m.size for m in matches)
+    report = {}
+    rebalancing.apply_rules(matches, RULES, 3, 6, report=report)
+    assert sum(m.size for m in matches) == before
+    for m, old in zip(matches, random_matches(random.Random(seed))):
+        assert m.size == len(m.node.props)
+        if m.size != old.size:
+            assert 3 <= m.size <= 6
+    for counts in report.values():
+        assert counts["isolated"] - 2 * counts["moved"] == counts["unpaired"] >= 0
+
+
+def test_apply_rules_skips_moves_out_of_bounds():
+    def group(genders, rows):
+        props = [{"gender": g, "race": []} for g in genders]
+        return Match(Node(props, size=len(props), rows=rows))
+
+    # The largest group would have to drop below the minimum size to give up its member.
+    matches = [group("FMM", [0, 1, 2]), group("FMM", [3, 4, 5])]
+    report = {}
+    rebalancing.apply_rules(matches, RULES[:1], 3, 6, report=report)
+    assert [m.size for m in matches] == [3, 3]
+    assert report["female"] == {"isolated": 2, "moved": 0, "unpaired": 2}
+
+    matches = [group("FMMM", [0, 1, 2, 3]), group("FMM", [4, 5, 6])]
+    rebalancing.apply_rules(matches, RULES[:1], 3, 6, report=report)
+    assert [m.node.rows for m in matches] == [[1, 2, 3], [4, 5, 6, 0]]
+    assert report["female"] == {"isolated": 2, "moved": 1, "unpaired": 0}
+
+
+def test_rebalance_reads_configured_rules():
+    config = make_config({"Rebalance": RULES[:1]}, MIN_GROUP_SIZE=2, MAX_GROUP_SIZE=6)
+    props = [{"gender": g, "race": []} for g in "FMMFMM"]
+    matches = [
+        Match(Node(props[:3], size=3)),
+        Match(Node(props[3:], size=3)),
+    ]
+    rebalancing.rebalance(config, matches)
+    assert sorted(sum(map(is_female, m.node.props)) for m in matches) == [0, 2]
+
+
+def roster_matches(rng, num_students=400):
+    # Students partitioned by (year, first meeting day), chunked into groups of three to
+    # five, with isolated students of every category spread over every path.
+    days = ["Mon", "Tue", "Wed"]
+    by_path = {}
+    for i in range(num_students):
+        prop = {
+            "sid": i,
+            "year": rng.choice(["2025", "2026"]),
+            "days": rng.sample(days, rng.randint(1, 2)),
+            "gender": rng.choice("FMM"),
+            "race": rng.choice([["Hispanic"], ["Black"], ["White"], ["Asian"]]),
+            "has_group": False,
+        }
+        path = (("year", prop["year"]), ("days", prop["days"][0]))
+        by_path.setdefault(path, []).append(prop)
+    matches = []
+    for path, props in by_path.items():
+        k = 0
+        while k < len(props):
+            size = rng.randint(3, 5)
+            chunk = props[k : k + size]
+            matches.append(Match(Node(chunk, size=len(chunk)), path=path))
+            k += size
+    return matches
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_rebalance_keeps_members_on_partition_paths(seed):
+    matches = roster_matches(random.Random(seed))
+    records = sorted((p for m in matches for p in m.node.props), key=lambda p: p["sid"])
+    paths = [m.path for m in matches]
+    config = make_config(
+        {"Partition": ["year", "days"], "Rebalance": RULES},
+        MIN_GROUP_SIZE=1,
+        MAX_GROUP_SIZE=6,
+    )
+    report = {}
+    rebalancing.rebalance(config, matches, report=report)
+    assert sum(counts["moved"] for counts in report.values()) > 0
+
+    # Groups keep their partition paths, and every member is still on their group's path.
+    assert [m.path for m in matches] == paths
+    result = Validator(config, records).check(matches)
+    assert result["counts"].get("partition_path", 0) == 0
+    assert all(rebalancing.on_path(p, m.path) for m in matches for p in m.node.props)
+
+
+def test_apply_rules_only_moves_members_onto_their_path():
+    def group(year, genders):
+        props = [{"year": year, "gender": g, "race": []} for g in genders]
+        return Match(Node(props, size=len(props)), path=(("year", year),))
+
+    # The largest group's isolated member can only go to the group in their own year, even
+    # though the other year's group comes first.
+    matches = [group(1, "FMMM"), group(1, "FMMMM"), group(2, "FMM"), group(1, "FMM")]
+    report = {}
+    rebalancing.apply_rules(matches, RULES[:1], 3, 6, report=report)
+    assert [m.size for m in matches] == [4, 4, 3, 4]
+    assert [sum(map(is_female, m.node.props)) for m in matches] == [1, 0, 1, 2]
+    assert report["female"] == {"isolated": 4, "moved": 1, "unpaired": 2}
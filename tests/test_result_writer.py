@@ -0,0 +1,130 @@
+import json
+import os
+import random
+import pytest
+import result_writer
+from models import Match, Node
+
+
+def random_matches(rng, num_groups=12):
+    matches = []
+    for g in range(num_groups):
+        props = [
+            {
+                "sid": rng.randrange(10**8),
+                "email": f"s{g}.{k}@example.com",
+                "remote": rng.choice([True, False]),
+                "days": rng.sample(["Mon", "Tue", "Wed"], rng.randint(1, 2)),
+                "score": rng.choice([0.5, 1.25, None]),
+                "name": rng.choice(["Ada", "Lin, Mei", 'Quote "Q"', None]),
+            }
+            for k in range(rng.randint(1, 5))
+        ]
+        if g == 3:
+            props[0]["incoming_partners"] = ["a", "b"]
+        path = rng.choice(
+            [(("year", "2025"), ("remote", True)), "(manually fixed)", None]
+        )
+        matches.append(Match(Node(props, size=len(props)), path=path))
+    return matches
+
+
+def dataframe_csv(matches, path):
+    # What matching wrote before the streaming writer: a DataFrame of one dict per student.
+    import pandas as pd
+
+    rows = [
+        {"group_num": i, **prop, "path": match.path}
+        for i, match in enumerate(matches)
+        for prop in match.node.props
+    ]
+    pd.DataFrame(rows).to_csv(path, encoding="utf-8", index=False)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_csv_is_byte_identical_to_dataframe_output(tmp_path, seed):
+    pytest.importorskip("pandas")
+    matches = random_matches(random.Random(seed))
+    expected = tmp_path / "expected.csv"
+    dataframe_csv(matches, expected)
+    out = result_writer.write_matches(matches, path=str(tmp_path / "out.csv"))
+    with open(out, "rb") as f, open(expected, "rb") as g:
+        assert f.read() == g.read()
+
+
+def test_ints_with_missing_values_stay_ints(tmp_path):
+    matches = [Match(Node([{"sid": 3}, {"sid": None}], size=2), path=None)]
+    out = result_writer.write_matches(matches, path=str(tmp_path / "out.csv"))
+    with open(out) as f:
+        assert f.read() == "group_num,sid,path\n0,3,\n0,,\n"
+
+
+def test_group_nums_and_index(tmp_path):
+    matches = random_matches(random.Random(0), num_groups=4)
+    group_nums = [7, 3, 9, 1]
+    index = tmp_path / "index.jsonl"
+    out = result_writer.write_matches(
+        matches,
+        path=str(tmp_path / "out.csv"),
+        index_path=str(index),
+        group_nums=group_nums,
+    )
+    with open(out) as f:
+        data_rows = f.read().splitlines()[1:]
+    entries = [json.loads(line) for line in index.read_text().splitlines()]
+    assert [entry["group_num"] for entry in entries] == group_nums
+    for entry, match in zip(entries, matches):
+        start, stop = entry["rows"]
+        assert entry["members"] == [prop["sid"] for prop in match.node.props]
+        assert entry["size"] == match.node.size and entry["source"] == "path"
+        assert all(
+            row.startswith(f"{entry['group_num']},") for row in data_rows[start:stop]
+        )
+    assert entries[-1]["rows"][1] == len(data_rows)
+
+
+def test_claimed_paths_are_unique_and_removed_on_failure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = result_writer.claim_output_path()
+    assert first == "out-private.csv"
+    assert result_writer.claim_output_path() == "out-private-2.csv"
+
+    class Broken(Match):
+        @property
+        def node(self):
+            raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        result_writer.write_matches([Broken.__new__(Broken)])
+    assert sorted(os.listdir(tmp_path)) == ["out-private-2.csv", "out-private.csv"]
+
+
+def test_failed_write_keeps_previous_output(tmp_path):
+    path = tmp_path / "out.csv"
+    path.write_text("previous\n")
+
+    def rows():
+        yield [1, 2]
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        result_writer.write_table(str(path), ["a", "b"], rows())
+    assert path.read_text() == "previous\n"
+    assert os.listdir(tmp_path) == ["out.csv"]
+
+
+def test_other_formats_need_pyarrow(tmp_path):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        with pytest.raises(ImportError, match="requires pyarrow"):
+            result_writer.write_matches([], path=str(tmp_path / "out"), fmt="parquet")
+        return
+    matches = random_matches(random.Random(1))
+    out = result_writer.write_matches(
+        matches, path=str(tmp_path / "out.parquet"), fmt="parquet"
+    )
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(out)
+    assert table.num_rows == sum(len(m.node.props) for m in matches)
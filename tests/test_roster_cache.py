@@ -0,0 +1,190 @@
+import functools
+import os
+import stat
+import numpy as np
+import pytest
+import config_parser
+import roster_cache
+
+CONFIG = """
+from models import Column, Row
+
+SUFFIX = "{suffix}"
+
+
+def add_suffix(value):
+    return value + SUFFIX
+
+
+ROW_CONFIG = Row(
+    [
+        Column("Student ID", "sid", "sid"),
+        Column("Name", "name", "text", transformer=add_suffix),
+    ]
+)
+CONSTRAINTS = {{"Partition": []}}
+MIN_GROUP_SIZE = 3
+MAX_GROUP_SIZE = 6
+MIN_PARTITION_SIZE = 3
+"""
+
+
+def write_files(tmp_path, suffix="!"):
+    config_path = tmp_path / "config.py"
+    config_path.write_text(CONFIG.format(suffix=suffix))
+    csv_path = tmp_path / "roster.csv"
+    csv_path.write_text("Student ID,Name\n1,Ada\n2,Lin\n")
+    return str(config_path), str(csv_path)
+
+
+def props(nodes):
+    return [node.props[0] for node in nodes]
+
+
+def test_cache_is_opt_in(tmp_path):
+    config_path, csv_path = write_files(tmp_path)
+    row_config = config_parser.import_config(config_path).row_config
+    cache_dir = tmp_path / "cache"
+    nodes, hit = roster_cache.load_or_parse(
+        csv_path, row_config, cache_dir=str(cache_dir)
+    )
+    assert not hit and not cache_dir.exists()
+    assert props(nodes) == [{"sid": 1, "name": "Ada!"}, {"sid": 2, "name": "Lin!"}]
+
+
+def test_cache_round_trip_and_permissions(tmp_path):
+    config_path, csv_path = write_files(tmp_path)
+    row_config = config_parser.import_config(config_path).row_config
+    cache_dir = str(tmp_path / "cache")
+    parsed, hit = roster_cache.load_or_parse(
+        csv_path, row_config, use_cache=True, cache_dir=cache_dir
+    )
+    assert not hit
+    cached, hit = roster_cache.load_or_parse(
+        csv_path, row_config, use_cache=True, cache_dir=cache_dir
+    )
+    assert hit and props(cached) == props(parsed)
+
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+    (entry,) = os.listdir(cache_dir)
+    entry = os.path.join(cache_dir, entry)
+    assert stat.S_IMODE(os.stat(entry).st_mode) == 0o700
+    for name in os.listdir(entry):
+        assert stat.S_IMODE(os.stat(os.path.join(entry, name)).st_mode) == 0o600
+
+
+def test_key_changes_with_config_module_source(tmp_path):
+    config_path, csv_path = write_files(tmp_path)
+    before = roster_cache.cache_key(
+        csv_path, config_parser.import_config(config_path).row_config
+    )
+    assert before == roster_cache.cache_key(
+        csv_path, config_parser.import_config(config_path).row_config
+    )
+
+    # Only module-level data the transformer reads changes, not the transformer itself.
+    write_files(tmp_path, suffix="?")
+    after = roster_cache.cache_key(
+        csv_path, config_parser.import_config(config_path).row_config
+    )
+    assert after != before
+
+
+def test_partial_fingerprints_are_stable():
+    def scale(value, factor=1):
+        return value * factor
+
+    a = roster_cache.function_fingerprint(functools.partial(scale, factor=2))
+    b = roster_cache.function_fingerprint(functools.partial(scale, factor=2))
+    c = roster_cache.function_fingerprint(functools.partial(scale, factor=3))
+    assert a == b != c
+    assert "0x" not in roster_cache.function_fingerprint(str.strip)
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["a", "", None, "\u00e9\u2713"],
+        [["x"], [], None, ["\u00e9", "y"]],
+        [[[1, 2]], [[]], None, [[3], None]],
+        [None, None, None, None],
+        [1.5, None, 2.0, float("inf")],
+        [True, False, None, True],
+        [1, None, -(2**40), 0],
+    ],
+)
+def test_columns_round_trip_through_npy(tmp_path, values):
+    arrays = []
+    spec = roster_cache.encode_column(values, arrays)
+    loaded = []
+    for i, array in enumerate(arrays):
+        np.save(tmp_path / f"{i}.npy", array, allow_pickle=False)
+        loaded.append(np.load(tmp_path / f"{i}.npy", mmap_mode="r", allow_pickle=False))
+    decoded = roster_cache.decode_column(spec, loaded, len(values))
+    assert decoded == values
+    assert [type(x) for x in decoded] == [type(x) for x in values]
+
+
+def test_uncacheable_columns_are_parsed_every_time(tmp_path, capsys):
+    config_path, csv_path = write_files(tmp_path)
+    row_config = config_parser.import_config(config_path).row_config
+    row_config.cols[1].transformer = lambda value: {"name": value}
+    cache_dir = tmp_path / "cache"
+    for _ in range(2):
+        nodes, hit = roster_cache.load_or_parse(
+            csv_path, row_config, use_cache=True, cache_dir=str(cache_dir)
+        )
+        assert not hit and props(nodes)[0]["name"] == {"name": "Ada"}
+    assert os.listdir(cache_dir) == []
+    assert (
+        "Not caching the parsed roster (Columns of dict values"
+        in capsys.readouterr().out
+    )
+
+
+def test_unsafe_cache_directories(tmp_path):
+    config_path, csv_path = write_files(tmp_path)
+    row_config = config_parser.import_config(config_path).row_config
+
+    # An existing directory others can get at is locked down before anything goes in it.
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir(mode=0o777)
+    os.chmod(cache_dir, 0o777)
+    roster_cache.load_or_parse(
+        csv_path, row_config, use_cache=True, cache_dir=str(cache_dir)
+    )
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+    assert len(os.listdir(cache_dir)) == 1
+
+    # A symlink (which could point anywhere) is never used.
+    link = tmp_path / "link"
+    link.symlink_to(cache_dir)
+    assert not roster_cache.safe_cache_dir(str(link))
+    (tmp_path / "elsewhere").mkdir()
+    link.unlink()
+    link.symlink_to(tmp_path / "elsewhere")
+    nodes, hit = roster_cache.load_or_parse(
+        csv_path, row_config, use_cache=True, cache_dir=str(link)
+    )
+    assert not hit and len(nodes) == 2
+    assert os.listdir(tmp_path / "elsewhere") == []
+
+
+def test_unreadable_entries_are_replaced(tmp_path):
+    config_path, csv_path = write_files(tmp_path)
+    row_config = config_parser.import_config(config_path).row_config
+    cache_dir = str(tmp_path / "cache")
+    parsed, _ = roster_cache.load_or_parse(
+        csv_path, row_config, use_cache=True, cache_dir=cache_dir
+    )
+    (entry,) = os.listdir(cache_dir)
+    with open(os.path.join(cache_dir, entry, "0.npy"), "wb") as f:
+        f.write(b"not an array")
+    nodes, hit = roster_cache.load_or_parse(
+        csv_path, row_config, use_cache=True, cache_dir=cache_dir
+    )
+    assert not hit and props(nodes) == props(parsed)
+    nodes, hit = roster_cache.load_or_parse(
+        csv_path, row_config, use_cache=True, cache_dir=cache_dir
+    )
+    assert hit and props(nodes) == props(parsed)
@@ -0,0 +1,86 @@
+import csv
+import os
+import subprocess
+import sys
+import benchmark
+from conftest import REPO_DIR
+
+
+def run_cli(*args, cwd=None):
+    return subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "run.py"), *args],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_output_options_rejected_with_post_processing(tmp_path):
+    config = os.path.join(REPO_DIR, "example_config.py")
+    roster = tmp_path / "roster.csv"
+    roster.write_text("")
+    for option in (["--output", "out.csv"], ["--index", "index.jsonl"]):
+        result = run_cli(config, str(roster), *option, cwd=tmp_path)
+        assert result.returncode != 0
+        assert "don't apply to configurations with post_processing" in result.stderr
+    assert os.listdir(tmp_path) == ["roster.csv"]
+
+
+def group_members(path):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return {row["sid"]: row["group_num"] for row in rows}
+
+
+def test_incremental_run_keeps_previous_groups_and_numbers(tmp_path):
+    # A full run of the example configuration (with its post-processing) over the first 250
+    # students, then an incremental one with 50 more students.
+    config = os.path.join(REPO_DIR, "example_config.py")
+    benchmark.generate_roster(str(tmp_path / "full.csv"), 300, seed=4)
+    lines = (tmp_path / "full.csv").read_text().splitlines(keepends=True)
+    (tmp_path / "first.csv").write_text("".join(lines[:251]))
+    assert run_cli(config, "first.csv", cwd=tmp_path).returncode == 0
+    os.rename(tmp_path / "out-private.csv", tmp_path / "previous.csv")
+
+    result = run_cli(
+        config,
+        "full.csv",
+        "--previous",
+        "previous.csv",
+        "--output",
+        "updated.csv",
+        cwd=tmp_path,
+    )
+    assert result.returncode == 0, result.stderr
+    before = group_members(tmp_path / "previous.csv")
+    after = group_members(tmp_path / "updated.csv")
+    assert len(before) == 250 and len(after) == 300
+    assert all(after[sid] == group_num for sid, group_num in before.items())
+    new_groups = {after[sid] for sid in after if sid not in before} - set(
+        before.values()
+    )
+    assert all(int(n) > max(map(int, before.values())) for n in new_groups)
+
+
+def test_incremental_run_reports_missing_key_column(tmp_path):
+    config = os.path.join(REPO_DIR, "example_config.py")
+    benchmark.generate_roster(str(tmp_path / "roster.csv"), 20, seed=5)
+    (tmp_path / "previous.csv").write_text("group_num,email\n0,a@berkeley.edu\n")
+    result = run_cli(config, "roster.csv", "--previous", "previous.csv", cwd=tmp_path)
+    assert result.returncode != 0
+    assert "has no sid column" in result.stderr
+    assert "Traceback" not in result.stderr
+
+
+def test_parses_are_cached_by_default(tmp_path):
+    benchmark.generate_roster(str(tmp_path / "roster.csv"), 30, seed=7)
+    (tmp_path / "config.py").write_text(
+        "from example_config import *\n\npost_processing = None\n"
+    )
+    result = run_cli("config.py", "roster.csv", "--no-cache", cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert not (tmp_path / ".group_matcher_cache").exists()
+    for loaded in ("30 rows parsed.", "30 rows loaded from cache."):
+        result = run_cli("config.py", "roster.csv", cwd=tmp_path)
+        assert result.returncode == 0, result.stderr
+        assert loaded in result.stdout
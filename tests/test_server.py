@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import pytest
+import benchmark
+import server
+from conftest import REPO_DIR
+
+
+@pytest.fixture
+def roster_dir(tmp_path):
+    with open(os.path.join(REPO_DIR, "example_config.py")) as f:
+        (tmp_path / "config.py").write_text(f.read())
+    benchmark.generate_roster(str(tmp_path / "roster.csv"), 120, seed=1)
+    (tmp_path / "notes.txt").write_text("")
+    return tmp_path
+
+
+def test_resolve_path(roster_dir, tmp_path_factory):
+    service = server.MatchingService(roster_dir=str(roster_dir))
+    assert service.resolve_path("config.py", (".py",)) == str(roster_dir / "config.py")
+
+    outside = tmp_path_factory.mktemp("outside")
+    (outside / "evil.py").write_text("")
+    os.symlink(outside / "evil.py", roster_dir / "link.py")
+    cases = [
+        ("../outside/evil.py", (".py",), 403),
+        (str(outside / "evil.py"), (".py",), 403),
+        ("link.py", (".py",), 403),
+        ("notes.txt", (".py",), 400),
+        ("missing.py", (".py",), 404),
+        (["config.py"], (".py",), 400),
+    ]
+    for path, extensions, status in cases:
+        with pytest.raises(server.RequestError) as e:
+            service.resolve_path(path, extensions)
+        assert e.value.status == status, path
+
+    with pytest.raises(server.RequestError) as e:
+        server.MatchingService().resolve_path("config.py", (".py",))
+    assert e.value.status == 403
+
+
+def test_configure_overrides(roster_dir):
+    service = server.MatchingService(roster_dir=str(roster_dir), iterations=5)
+    info = service.load_roster(
+        str(roster_dir / "config.py"), str(roster_dir / "roster.csv")
+    )
+    original = service.rosters[info["roster"]]["config"]
+    constraints = dict(original.constraints)
+
+    config = service.configure(
+        original,
+        {
+            "MAX_GROUP_SIZE": 5,
+            "CONSTRAINTS": {"Partition": ["remote"], "Existing": None},
+        },
+    )
+    assert config.max_group_size == 5 and config.constraints["Partition"] == ["remote"]
+    assert "Existing" not in config.constraints
+    assert config.constraints["Search"]["iterations"] == 5
+    assert config.constraints["Search"]["time_limit"] is None
+    assert original.constraints == constraints and original.max_group_size == 6
+
+    requested = service.configure(
+        original, {"CONSTRAINTS": {"Search": {"iterations": 9}}}
+    )
+    assert requested.constraints["Search"]["iterations"] == 9
+
+    for overrides in ({"ROW_CONFIG": None}, {"CONSTRAINTS": []}, []):
+        with pytest.raises(server.RequestError) as e:
+            service.configure(original, overrides)
+        assert e.value.status == 400
+
+
+def test_what_if_results_are_cached(roster_dir, monkeypatch):
+    service = server.MatchingService(roster_dir=str(roster_dir), iterations=5)
+    info = service.load_roster(
+        str(roster_dir / "config.py"), str(roster_dir / "roster.csv")
+    )
+    assert (
+        service.load_roster(
+            str(roster_dir / "config.py"), str(roster_dir / "roster.csv")
+        )["roster"]
+        == info["roster"]
+    )
+
+    calls = []
+    match = service.match
+    monkeypatch.setattr(
+        service, "match", lambda *args: calls.append(args) or match(*args)
+    )
+
+    async def queries():
+        overrides = {"MIN_PARTITION_SIZE": 4}
+        first = await service.what_if(info["roster"], overrides, [])
+        again = await service.what_if(info["roster"], dict(overrides), [])
+        other = await service.what_if(info["roster"], {}, ["email"])
+        return first, again, other
+
+    first, again, other = asyncio.run(queries())
+    assert len(calls) == 2
+    assert not first["cached"] and again["cached"] and not other["cached"]
+    assert again["groups"] == first["groups"]
+    members = sorted(i for group in first["groups"] for i in group["members"])
+    assert members == list(range(120))
+    assert all(
+        "email" in member for group in other["groups"] for member in group["members"]
+    )
+
+
+def request(service, raw: bytes) -> tuple:
+    # Send a raw HTTP request to the service on an ephemeral port, returning the status and
+    # decoded JSON response.
+    async def exchange():
+        listener = await asyncio.start_server(service.serve_client, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    return asyncio.run(exchange())
+
+
+def post(path: str, body: bytes, length=None) -> bytes:
+    length = len(body) if length is None else length
+    return f"POST {path} HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode() + body
+
+
+def test_bad_requests_get_400(roster_dir):
+    service = server.MatchingService(roster_dir=str(roster_dir))
+    assert request(service, b"GET /health HTTP/1.1\r\n\r\n") == (
+        200,
+        {"status": "ok", "rosters": 0},
+    )
+    bad = [
+        post("/match", b"{}", length="ten"),
+        post("/match", b"{}", length=-1),
+        post("/match", b"not json"),
+        post("/match", b"[1, 2]"),
+        post("/match", b'"roster"'),
+        post("/match", b'{"roster": ["a"]}'),
+        post("/match", b'{"roster": "a", "fields": "email"}'),
+        post("/rosters", b'{"config": "config.py"}'),
+        b"\r\n\r\n",
+    ]
+    for raw in bad:
+        status, response = request(service, raw)
+        assert status == 400, raw
+        assert "error" in response
+    assert request(service, post("/match", b'{"roster": "a"}'))[0] == 404
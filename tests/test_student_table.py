@@ -0,0 +1,78 @@
+import random
+import pytest
+from conftest import make_config
+from models import Node
+from student_table import StudentTable, table_columns
+
+
+def make_records(rng, num_students=200):
+    # Enough checkbox values to need more than one 64-bit word per student.
+    options = [f"option {k}" for k in range(70)]
+    return [
+        {
+            "year": rng.choice(["2025", "2026", None]),
+            "topics": (
+                rng.sample(options, rng.randint(1, 4)) if rng.random() < 0.9 else None
+            ),
+            "name": f"student {i}",
+        }
+        for i in range(num_students)
+    ]
+
+
+def holds(value, val):
+    return val in value if isinstance(value, list) else value == val
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_counts_match_props(seed):
+    rng = random.Random(seed)
+    records = make_records(rng)
+    table = StudentTable(records, columns=["year", "topics"])
+    rows = sorted(rng.sample(range(len(records)), 50))
+    for col in ["year", "topics"]:
+        for val in table.values(col):
+            expected = [holds(record[col], val) for record in records]
+            assert table.has_value(col, val).tolist() == expected
+            assert table.count(col, val, rows) == sum(expected[i] for i in rows)
+        assert table.count(col, "missing value") == 0
+    assert "name" not in table and table.is_checkbox("topics")
+    assert None in table.values("topics")
+
+
+def test_postings_follow_props_order():
+    records = [
+        {"days": ["Tue", "Mon"]},
+        {"days": None},
+        {"days": ["Mon", "Wed"]},
+    ]
+    table = StudentTable(records)
+    postings = table.postings("days", [2, 1, 0])
+    assert list(postings) == ["Mon", "Wed", None, "Tue"]
+    assert postings == {"Mon": {0, 2}, "Wed": {0}, None: {1}, "Tue": {2}}
+
+
+def test_rows_of_nodes_without_row_indices():
+    records = make_records(random.Random(0), 10)
+    nodes = [Node([record]) for record in records]
+    table = StudentTable.from_nodes(nodes, columns=["year"])
+    assert [node.rows for node in nodes] == [[i] for i in range(10)]
+    combined = Node([records[4], records[2]], size=2)
+    assert table.rows_of(combined).tolist() == [4, 2]
+    assert table.first_rows([combined, nodes[7]]).tolist() == [4, 7]
+
+
+def test_table_columns():
+    config = make_config(
+        {"Partition": ["year", "remote"], "Best-effort": [["gender", "year"], [1, 1]]}
+    )
+    assert table_columns(config) == ["year", "remote", "gender"]
+    assert table_columns(make_config({"Partition": ["year"]})) == ["year"]
+
+
+def test_codes_are_as_narrow_as_the_vocabulary():
+    records = [{"year": i % 3, "name": f"student {i}"} for i in range(300)]
+    table = StudentTable(records)
+    assert table.codes["year"].itemsize == 1 and table.codes["name"].itemsize == 2
+    assert table.count("name", "student 299") == 1
+    assert table.postings("name", [299, 0])["student 0"] == {1}
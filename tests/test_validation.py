@@ -0,0 +1,117 @@
+import random
+import pytest
+from conftest import make_config
+from models import Match, Node
+from student_table import StudentTable
+from validation import Validator, validate_matches
+
+
+def make_roster(rng, num_students=60):
+    days = ["Mon", "Tue", "Wed"]
+    return [
+        {
+            "sid": i,
+            "year": rng.choice(["2025", "2026"]),
+            "days": rng.sample(days, rng.randint(1, 2)) if rng.random() < 0.9 else None,
+            "has_group": False,
+            "group_sid": None,
+        }
+        for i in range(num_students)
+    ]
+
+
+def partition_matches(records):
+    # Group students by (year, first day), chunked into groups of three to five.
+    by_path = {}
+    for prop in records:
+        days = prop["days"] if prop["days"] is not None else [None]
+        path = (("year", prop["year"]), ("days", days[0]))
+        by_path.setdefault(path, []).append(prop)
+    matches = []
+    for path, props in by_path.items():
+        for k in range(0, len(props), 4):
+            chunk = props[k : k + 4]
+            matches.append(Match(Node(list(chunk), size=len(chunk)), path=path))
+    return matches
+
+
+def break_matching(rng, records, matches):
+    # Drop a student, duplicate another, move one off their path and miscount a group.
+    matches[0].node.props.pop()
+    matches[1].node.props.append(matches[2].node.props[0])
+    other = next(m for m in matches if m.path[0] != matches[3].path[0])
+    matches[3].node.props.append(other.node.props[0])
+    matches[4].node.size += 1
+    matches.append(Match(Node([{"sid": -1}], size=1), path=None))
+    rng.shuffle(matches)
+    return matches
+
+
+def config_for(constraints=None):
+    return make_config(
+        {"Partition": ["year", "days"], **(constraints or {})},
+        MIN_GROUP_SIZE=1,
+        MAX_GROUP_SIZE=5,
+    )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_array_and_props_checks_agree(seed):
+    rng = random.Random(seed)
+    records = make_roster(rng)
+    matches = partition_matches(records)
+    if seed % 2:
+        matches = break_matching(rng, records, matches)
+    config = config_for()
+    table = StudentTable(records, columns=["year", "days"])
+    expected = validate_matches(config, matches, records)
+    assert validate_matches(config, matches, records, table=table) == expected
+    assert expected["ok"] == (seed % 2 == 0)
+
+
+def test_each_check_is_detected():
+    rng = random.Random(0)
+    records = make_roster(rng)
+    records[0].update(has_group=True, group_sid=7)
+    records[1].update(has_group=True, group_sid=7)
+    config = config_for(
+        {"Existing": {"type": "min_sid", "flag": "has_group", "data": ["group_sid"]}}
+    )
+    matches = partition_matches(records)
+    validator = Validator(config, records)
+    counts = validator.check(matches)["counts"]
+    assert set(counts) <= {"existing"}
+
+    matches = break_matching(rng, records, matches)
+    result = validator.check(matches)
+    assert not result["ok"]
+    assert {"coverage", "size", "partition_path"} <= set(result["counts"])
+    details = {v["detail"] for v in result["violations"] if v["check"] == "coverage"}
+    assert details == {"missing", "duplicated", "unknown"}
+
+
+def test_existing_groups_checked_together():
+    records = [
+        {"email": "a", "has_group": True, "p": "b"},
+        {"email": "b", "has_group": True, "p": None},
+        {"email": "c", "has_group": False, "p": None},
+    ]
+    config = make_config(
+        {
+            "Existing": {
+                "type": "explicit_keys",
+                "flag": "has_group",
+                "id_key": "email",
+                "data": ["p"],
+            }
+        },
+        MIN_GROUP_SIZE=1,
+    )
+    together = [
+        Match(Node(records[:2], size=2), source="existing"),
+        Match(Node(records[2:], size=1)),
+    ]
+    assert validate_matches(config, together, records)["ok"]
+    apart = [Match(Node([prop], size=1)) for prop in records]
+    result = validate_matches(config, apart, records)
+    assert result["counts"] == {"existing": 1}
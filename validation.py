@@ -0,0 +1,217 @@
+from models import *
+
+"""
+Post-match validation of the hard constraints every matching should satisfy:
+
+- coverage: every student of the roster is in exactly one group (and nobody else is)
+- size: every group's size is within [MIN_GROUP_SIZE, MAX_GROUP_SIZE] (student-requested
+  groups excepted) and agrees with its number of members
+- partition_path: every member of a partition group holds every value along its path
+- existing: students who asked to be grouped together (see existing_groups.py) are
+  in the same group
+
+The matching is laid out as a group x student incidence matrix in coordinate form (one entry
+per group member). Given a StudentTable (as large rosters have), every check is a handful of
+vectorized NumPy operations over its entries; small rosters are checked entry by entry on their
+props instead, so that validating them doesn't pay for importing NumPy. Everything that only
+depends on the roster is prepared once by the Validator, so checking a matching is cheap enough
+to use as an acceptance test inside optimization loops.
+"""
+
+
+class Validator(object):
+    def __init__(self, config: Configuration, records: list, table=None):
+        """
+        Prepare to validate matchings of a roster.
+
+        Args:
+            config (Configuration): Matching configuration
+            records (list): Every student's props dict, in roster order
+            table (StudentTable, optional): Columnar roster built from the same records, to
+                check with vectorized operations
+        """
+        self.config = config
+        self.records = records
+        self.table = table
+        self._row_by_id = {id(record): i for i, record in enumerate(records)}
+        self.partition_cols = set(config.constraints.get("Partition", []))
+        self.pairs = self._existing_pairs()
+
+    def _existing_pairs(self) -> list:
+        # Pairs of rows that asked to be grouped together, mirroring handle_existing.
+        existing = self.config.constraints.get("Existing")
+        pairs = []
+        if existing:
+            flag_key = existing["flag"]
+            flagged = [i for i, record in enumerate(self.records) if record[flag_key]]
+            if existing["type"] == "min_sid":
+                first = {}
+                for i in flagged:
+                    key = self.records[i][existing["data"][0]]
+                    pairs.append((first.setdefault(key, i), i))
+            else:
+                row_of_key = {self.records[i][existing["id_key"]]: i for i in flagged}
+                for i in flagged:
+                    for key in existing["data"]:
+                        partner = row_of_key.get(self.records[i][key])
+                        if partner is not None:
+                            pairs.append((i, partner))
+        return pairs
+
+    def check(self, matches: list) -> dict:
+        """
+        Check a matching.
+
+        Args:
+            matches (list): Match objects
+
+        Returns:
+            dict: "ok" (whether there were no violations), "violations" (a list of dicts,
+                each with the "check" that failed, the "group" (index into matches) and/or
+                "student" (row index into the roster) concerned, and further details) and
+                per-check violation "counts"
+        """
+        lo, hi = self.config.min_group_size, self.config.max_group_size
+        violations = []
+
+        # Lay out the incidence matrix: one (group, student row) entry per group member.
+        groups, rows = [], []
+        for g, match in enumerate(matches):
+            for prop in match.node.props:
+                groups.append(g)
+                rows.append(self._row_by_id.get(id(prop), -1))
+
+        # Collect the (column, value) steps along every partition path, along with the groups
+        # on each step.
+        steps = {}
+        for g, match in enumerate(matches):
+            if isinstance(match.path, (tuple, list)):
+                for step in match.path:
+                    if (
+                        isinstance(step, (tuple, list))
+                        and len(step) == 2
+                        and step[0] in self.partition_cols
+                    ):
+                        steps.setdefault((step[0], step[1]), []).append(g)
+
+        vectorized = self.table is not None and all(
+            col in self.table for col, _ in steps
+        )
+        check = self._check_arrays if vectorized else self._check_props
+        counts, members, wrong_steps, group_of = check(
+            matches, groups, rows, steps
+        )
+
+        # Coverage: column sums of the incidence matrix should all be exactly one.
+        for g, i in zip(groups, rows):
+            if i < 0:
+                violations.append({"check": "coverage", "group": g, "detail": "unknown"})
+        miscounted = {i: [] for i, count in enumerate(counts) if count != 1}
+        for g, i in zip(groups, rows):
+            if i in miscounted:
+                miscounted[i].append(g)
+        for i, in_groups in miscounted.items():
+            violations.append(
+                {
+                    "check": "coverage",
+                    "student": i,
+                    "detail": "missing" if not in_groups else "duplicated",
+                    "groups": in_groups,
+                }
+            )
+
+        # Size: row sums of the incidence matrix against the bounds and each node's size.
+        for g, match in enumerate(matches):
+            size = match.node.size
+            bounded = match.source != "existing"
+            if (bounded and not lo <= size <= hi) or size != members[g]:
+                violations.append(
+                    {"check": "size", "group": g, "size": size, "members": members[g]}
+                )
+
+        # Partition paths: every member of a group on a step must hold the step's value.
+        for g, i, col, val in wrong_steps:
+            violations.append(
+                {
+                    "check": "partition_path",
+                    "group": g,
+                    "student": i,
+                    "column": col,
+                    "value": val,
+                }
+            )
+
+        # Existing groups: every pair of students who asked to be together shares a group.
+        for i, j in self.pairs:
+            if group_of[i] != group_of[j]:
+                violations.append(
+                    {
+                        "check": "existing",
+                        "student": i,
+                        "partner": j,
+                        "groups": [group_of[i], group_of[j]],
+                    }
+                )
+
+        tally = {}
+        for violation in violations:
+            tally[violation["check"]] = tally.get(violation["check"], 0) + 1
+        return {"ok": not violations, "violations": violations, "counts": tally}
+
+    def _check_props(self, matches: list, groups: list, rows: list, steps: dict) -> tuple:
+        # Work out per-student counts, per-group member counts, members off their group's
+        # path and each student's group entry by entry.
+        counts = [0] * len(self.records)
+        members = [0] * len(matches)
+        group_of = [-1] * len(self.records)
+        for g, i in zip(groups, rows):
+            members[g] += 1
+            if i >= 0:
+                counts[i] += 1
+                group_of[i] = g
+
+        wrong_steps = []
+        for (col, val), step_groups in steps.items():
+            for g in step_groups:
+                for prop in matches[g].node.props:
+                    i = self._row_by_id.get(id(prop), -1)
+                    if i < 0:
+                        continue
+                    value = prop[col]
+                    holds = val in value if isinstance(value, list) else value == val
+                    if not holds:
+                        wrong_steps.append((g, i, col, val))
+        return counts, members, wrong_steps, group_of
+
+    def _check_arrays(self, matches: list, groups: list, rows: list, steps: dict) -> tuple:
+        # The same as _check_props, with vectorized operations over the incidence matrix.
+        import numpy as np
+
+        num_groups, num_rows = len(matches), len(self.records)
+        groups = np.asarray(groups, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        members = np.bincount(groups, minlength=num_groups)
+        known = rows >= 0
+        groups, rows = groups[known], rows[known]
+        counts = np.bincount(rows, minlength=num_rows)
+        group_of = np.full(num_rows, -1, dtype=np.int64)
+        group_of[rows] = groups
+
+        wrong_steps = []
+        for (col, val), step_groups in steps.items():
+            on_step = np.zeros(num_groups, dtype=bool)
+            on_step[step_groups] = True
+            selected = on_step[groups]
+            holds = self.table.has_value(col, val)[rows[selected]]
+            for g, i in zip(groups[selected][~holds], rows[selected][~holds]):
+                wrong_steps.append((int(g), int(i), col, val))
+        return counts.tolist(), members.tolist(), wrong_steps, group_of.tolist()
+
+
+def validate_matches(
+    config: Configuration, matches: list, records: list, table=None
+) -> dict:
+    """
+    Check a matching once (see Validator.check).
+    """
+    return Validator(config, records, table=table).check(matches)